@@ -1,8 +1,8 @@
+from django.conf import settings
 from django.contrib import admin
 from .models import Prompt
 
 
-@admin.register(Prompt)
 class PromptAdmin(admin.ModelAdmin):
     list_display = ['prompt_text_short', 'preference', 'created_at']
     list_filter = ['preference', 'created_at', 'model_name']
@@ -12,3 +12,8 @@ class PromptAdmin(admin.ModelAdmin):
     def prompt_text_short(self, obj):
         return obj.prompt_text[:50] + '...' if len(obj.prompt_text) > 50 else obj.prompt_text
     prompt_text_short.short_description = 'Prompt'
+
+
+# The Prompt admin goes through djongo, so it is only available when djongo backs the database.
+if settings.USE_DJONGO:
+    admin.site.register(Prompt, PromptAdmin)
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from pymongo import DESCENDING
+
+from .mongo import get_collection
+from .storage import PARAM_FIELDS
+
+# Preference analytics over every voted document, computed from columns that
+# an aggregation projects server-side (response lengths included, so no
+# response text crosses the wire), read in batches into NumPy arrays.
+# Confidence intervals are percentile bootstraps of a win rate; resampling n
+# Bernoulli outcomes with replacement is a Binomial(n, p) draw, so all buckets
+# are resampled at once without materializing resampled index arrays.
+# Results are cached per worker and in api_analytics_cache, keyed on the
+# query parameters and collection_version().
+
+def _side_value(field, side):
+    # Flat documents have temperature_a; compact ones params.a[0] (api.storage).
+    return {'$ifNull': [f'${field}_{side}', {'$arrayElemAt': [f'$params.{side}', PARAM_FIELDS.index(field)]}]}
+
+
+def _length(field):
+    # Compressed responses (api.storage) carry their uncompressed byte length;
+    # for plain strings the .length path is missing and $strLenCP applies.
+    return {'$ifNull': [f'${field}.length', {'$strLenCP': {'$ifNull': [f'${field}', '']}}]}
+
+
+def analytics_pipeline(model_name=None):
+    match = {'preference': {'$in': ['A', 'B', 'TIE']}}
+    if model_name:
+        match['model_name'] = model_name
+    project = {'_id': 0, 'preference': 1, 'model_name': 1, 'length_a': _length('response_a'),
+               'length_b': _length('response_b')}
+    for field in PARAM_FIELDS:
+        for side in ('a', 'b'):
+            project[f'{field}_{side}'] = _side_value(field, side)
+    return [{'$match': match}, {'$project': project}]
+
+
+COLUMNS = ['length_a', 'length_b'] + [f'{field}_{side}' for field in PARAM_FIELDS for side in ('a', 'b')]
+
+
+def load_columns(collection, model_name=None, batch_size=5000):
+    """Return ``(preference, model_name, {column: float array})`` for voted documents."""
+    preference_batches, model_batches = [], []
+    numeric_batches = {column: [] for column in COLUMNS}
+    rows = []
+
+    def flush():
+        preference_batches.append(np.array([row.get('preference') for row in rows], dtype=object))
+        model_batches.append(np.array([row.get('model_name') or '' for row in rows], dtype=object))
+        for column in COLUMNS:
+            numeric_batches[column].append(np.array(
+                [row.get(column) for row in rows], dtype=float
+            ))
+
+    cursor = collection.aggregate(analytics_pipeline(model_name), batchSize=batch_size, allowDiskUse=True)
+    for row in cursor:
+        rows.append(row)
+        if len(rows) >= batch_size:
+            flush()
+            rows = []
+    if rows:
+        flush()
+
+    def concat(batches, dtype):
+        return np.concatenate(batches) if batches else np.array([], dtype=dtype)
+
+    columns = {column: concat(numeric_batches[column], float) for column in COLUMNS}
+    return concat(preference_batches, object), concat(model_batches, object), columns
+
+
+def bootstrap_rates(wins, totals, resamples, rng, confidence=0.95):
+    """Percentile bootstrap interval of wins/totals for each entry, as ``(low, high)`` arrays."""
+    wins = np.asarray(wins, dtype=float)
+    totals = np.asarray(totals, dtype=np.int64)
+    rates = np.divide(wins, totals, out=np.zeros_like(wins), where=totals > 0)
+    draws = rng.binomial(totals[:, None], rates[:, None], size=(len(totals), resamples)) / np.maximum(totals, 1)[:, None]
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(draws, [tail, 100 - tail], axis=1)
+    return np.where(totals > 0, low, np.nan), np.where(totals > 0, high, np.nan)
+
+
+def bucket_index(values, max_buckets):
+    """Return ``(index, labels)``: one bucket per distinct value if few, else quantile ranges."""
+    distinct = np.unique(values)
+    if len(distinct) <= max_buckets:
+        return np.searchsorted(distinct, values), [{'value': float(value)} for value in distinct]
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, max_buckets + 1)))
+    index = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+    labels = [{'low': round(float(low), 4), 'high': round(float(high), 4)} for low, high in zip(edges[:-1], edges[1:])]
+    return index, labels
+
+
+def _rate_rows(labels, wins, totals, resamples, rng):
+    low, high = bootstrap_rates(wins, totals, resamples, rng)
+    return [
+        {
+            **label,
+            'n': int(total),
+            'wins': int(win),
+            'win_rate': round(float(win / total), 4) if total else None,
+            'ci': [round(float(lo), 4), round(float(hi), 4)] if total else None,
+        }
+        for label, win, total, lo, hi in zip(labels, wins, totals, low, high)
+    ]
+
+
+def win_rates_by_bucket(values, wins, max_buckets, resamples, rng):
+    """Win rate of a response as a function of its own parameter value."""
+    keep = ~np.isnan(values)
+    values, wins = values[keep], wins[keep]
+    if not len(values):
+        return []
+    index, labels = bucket_index(values, max_buckets)
+    totals = np.bincount(index, minlength=len(labels))
+    counts = np.bincount(index, weights=wins, minlength=len(labels))
+    return _rate_rows(labels, counts, totals, resamples, rng)
+
+
+def compute_analytics(preference, models, columns, max_buckets=10, resamples=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    a_wins = preference == 'A'
+    b_wins = preference == 'B'
+    ties = preference == 'TIE'
+    decisive = a_wins | b_wins
+    total = len(preference)
+
+    overall_low, overall_high = bootstrap_rates([b_wins.sum()], [decisive.sum()], resamples, rng)
+    result = {
+        'total_voted': int(total),
+        'decisive': int(decisive.sum()),
+        'preference_a': int(a_wins.sum()),
+        'preference_b': int(b_wins.sum()),
+        'ties': int(ties.sum()),
+        'b_win_rate': round(float(b_wins.sum() / decisive.sum()), 4) if decisive.any() else None,
+        'b_win_rate_ci': [round(float(overall_low[0]), 4), round(float(overall_high[0]), 4)] if decisive.any() else None,
+    }
+
+    # Each decisive pair contributes both responses: its value and whether it won.
+    side_wins = np.concatenate([a_wins[decisive], b_wins[decisive]]).astype(float)
+    result['win_rate_by_parameter'] = {
+        field: win_rates_by_bucket(
+            np.concatenate([columns[f'{field}_a'][decisive], columns[f'{field}_b'][decisive]]),
+            side_wins, max_buckets, resamples, rng,
+        )
+        for field in PARAM_FIELDS
+    }
+
+    # Per model: B win rate among decisive votes, plus the raw A and tie counts.
+    names, index = np.unique(models.astype(str), return_inverse=True)
+    per_model = {
+        name: np.bincount(index, weights=mask, minlength=len(names))
+        for name, mask in (('a', a_wins), ('b', b_wins), ('tie', ties), ('decisive', decisive))
+    }
+    result['by_model'] = [
+        dict(row, a_wins=int(a), ties=int(tie))
+        for row, a, tie in zip(
+            _rate_rows([{'model_name': str(name)} for name in names], per_model['b'], per_model['decisive'],
+                       resamples, rng),
+            per_model['a'], per_model['tie'],
+        )
+    ]
+
+    length_a, length_b = columns['length_a'][decisive], columns['length_b'][decisive]
+    differs = length_a != length_b
+    longer_won = np.where(length_b > length_a, b_wins[decisive], a_wins[decisive])[differs]
+    ratio = np.log((length_b + 1) / (length_a + 1))
+    outcome = b_wins[decisive].astype(float)
+    correlation = None
+    if len(ratio) > 1 and ratio.std() > 0 and outcome.std() > 0:
+        correlation = round(float(np.corrcoef(ratio, outcome)[0, 1]), 4)
+    longer_low, longer_high = bootstrap_rates([longer_won.sum()], [len(longer_won)], resamples, rng)
+    result['length_bias'] = {
+        'pairs_with_length_difference': int(differs.sum()),
+        'longer_win_rate': round(float(longer_won.mean()), 4) if len(longer_won) else None,
+        'longer_win_rate_ci': [round(float(longer_low[0]), 4), round(float(longer_high[0]), 4)] if len(longer_won) else None,
+        'log_length_ratio_b_win_correlation': correlation,
+        'mean_length_chosen': round(float(np.where(b_wins[decisive], length_b, length_a).mean()), 1) if len(outcome) else None,
+        'mean_length_rejected': round(float(np.where(b_wins[decisive], length_a, length_b).mean()), 1) if len(outcome) else None,
+        'b_win_rate_by_log_length_ratio': win_rates_by_bucket(ratio, outcome, max_buckets, resamples, rng),
+    }
+    return result
+
+
+def collection_version(collection):
+    """Changes whenever a document is added, removed or voted on."""
+    latest = collection.find_one({}, {'_id': 1}, sort=[('_id', DESCENDING)])
+    voted = collection.find_one(
+        {'preference_recorded_at': {'$ne': None}}, {'preference_recorded_at': 1},
+        sort=[('preference_recorded_at', DESCENDING)],
+    )
+    return [
+        collection.estimated_document_count(),
+        str(latest['_id']) if latest else None,
+        voted['preference_recorded_at'].isoformat() if voted else None,
+    ]
+
+
+CACHE_ENTRIES = 64
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _get_cache_collection():
+    return get_collection('api_analytics_cache')
+
+
+def get_analytics(collection, model_name=None, max_buckets=10, resamples=1000):
+    params = {'model_name': model_name, 'buckets': max_buckets, 'resamples': resamples}
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+    version = collection_version(collection)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    stored = _get_cache_collection().find_one({'_id': key, 'version': version})
+    if stored is not None:
+        result = stored['result']
+    else:
+        preference, models, columns = load_columns(collection, model_name)
+        result = compute_analytics(preference, models, columns, max_buckets, resamples)
+        result['computed_at'] = timezone.now().isoformat()
+        _get_cache_collection().replace_one(
+            {'_id': key}, {'_id': key, 'version': version, 'params': params, 'result': result}, upsert=True
+        )
+    with _cache_lock:
+        if len(_cache) >= CACHE_ENTRIES:
+            _cache.clear()
+        _cache[key] = (version, result)
+    return result
+
+
+def parse_analytics_params(params):
+    """Return (model_name, buckets, resamples) from query params or raise ValueError."""
+    try:
+        buckets = int(params.get('buckets') or 10)
+        resamples = int(params.get('resamples') or 1000)
+    except ValueError:
+        raise ValueError('buckets and resamples must be integers.')
+    if not 1 <= buckets <= 50:
+        raise ValueError('buckets must be between 1 and 50.')
+    if not 100 <= resamples <= settings.ANALYTICS_MAX_RESAMPLES:
+        raise ValueError(f'resamples must be between 100 and {settings.ANALYTICS_MAX_RESAMPLES}.')
+    return params.get('model_name') or None, buckets, resamples
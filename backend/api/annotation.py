@@ -0,0 +1,133 @@
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ASCENDING, ReturnDocument
+from rest_framework import serializers
+
+from .jobs import JOB_DONE, JOB_FAILED, build_job_document
+from .mongo import get_collection
+from .repository import insert_prompts
+from .serializers import GenerateResponsesSerializer
+from .stats import count_prompts_created
+from .storage import expand_document
+
+# Annotation queue: prompts read from a file are inserted as generation jobs
+# (api.jobs) flagged annotation_queue, keeping a target number of unvoted
+# pairs buffered, and annotators take finished pairs with lease_next_pair(): one
+# find_one_and_update that leases the oldest unvoted, unleased pair for
+# ANNOTATION_LEASE_SECONDS. A lease that runs out without a vote makes the
+# pair available again, so nothing has to sweep expired leases. Voting goes
+# through record-preference as before; a voted pair leaves the queue.
+SOURCES_COLLECTION = 'api_annotation_sources'
+
+
+def _available(now):
+    return {
+        'annotation_queue': True,
+        'preference': None,
+        'annotation_lease_expires_at': {'$not': {'$gt': now}},
+    }
+
+
+def queue_depth(collection, now=None):
+    """Unvoted queue pairs not under a lease, finished or still generating."""
+    query = dict(_available(now or timezone.now()), job_status={'$ne': JOB_FAILED})
+    return collection.count_documents(query)
+
+
+def lease_next_pair(collection, annotator=None, now=None):
+    """Lease the oldest available generated pair and return it, or None."""
+    now = now or timezone.now()
+    document = collection.find_one_and_update(
+        dict(_available(now), job_status=JOB_DONE),
+        {'$set': {
+            'annotation_lease_owner': annotator,
+            'annotation_lease_expires_at': now + timedelta(seconds=settings.ANNOTATION_LEASE_SECONDS),
+        }},
+        sort=[('created_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+    return expand_document(document)
+
+
+def pair_payload(document):
+    to_representation = serializers.DateTimeField().to_representation
+    return {
+        'id': str(document['_id']),
+        'prompt': document['prompt_text'],
+        'response_a': document['response_a'],
+        'response_b': document['response_b'],
+        'model_name': document['model_name'],
+        'temperature': document['temperature'],
+        'temperature_a': document['temperature_a'],
+        'temperature_b': document['temperature_b'],
+        'created_at': to_representation(document['created_at']),
+        'lease_expires_at': to_representation(document['annotation_lease_expires_at']),
+    }
+
+
+def _parse_line(line, prompt_field):
+    """Generate-request data for one source line: a JSON object, a JSON string or plain text."""
+    try:
+        value = json.loads(line)
+    except ValueError:
+        value = line
+    if isinstance(value, dict):
+        data = dict(value)
+        data['prompt'] = data.pop(prompt_field, None)
+        return data
+    return {'prompt': value}
+
+
+def fill_queue(collection, path, target, prompt_field='prompt', defaults=None, batch_size=100):
+    """Queue prompts from ``path`` until ``target`` pairs are buffered.
+
+    Progress through the file is kept as a byte offset in api_annotation_sources,
+    so each call continues where the last one stopped. Lines that are not a
+    valid generate request are skipped and counted as invalid.
+    """
+    now = timezone.now()
+    depth = queue_depth(collection, now)
+    result = {'depth': depth, 'queued': 0, 'invalid': 0, 'exhausted': False}
+    needed = target - depth
+    if needed <= 0:
+        return result
+
+    sources = get_collection(SOURCES_COLLECTION)
+    key = os.path.abspath(path)
+    state = sources.find_one({'_id': key}) or {}
+    documents = []
+
+    def flush(offset):
+        if documents:
+            insert_prompts(documents)
+            count_prompts_created(len(documents))
+            result['queued'] += len(documents)
+            documents.clear()
+        sources.update_one({'_id': key}, {'$set': {'offset': offset, 'updated_at': now}}, upsert=True)
+
+    with open(path, 'rb') as handle:
+        handle.seek(state.get('offset', 0))
+        while result['queued'] + len(documents) < needed:
+            line = handle.readline()
+            if not line:
+                result['exhausted'] = True
+                break
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+            serializer = GenerateResponsesSerializer(data={**(defaults or {}), **_parse_line(line, prompt_field)})
+            if not serializer.is_valid():
+                result['invalid'] += 1
+                continue
+            document = build_job_document(serializer.validated_data, now)
+            document['annotation_queue'] = True
+            documents.append(document)
+            if len(documents) >= batch_size:
+                flush(handle.tell())
+        flush(handle.tell())
+    result['depth'] = depth + result['queued']
+    return result
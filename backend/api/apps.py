@@ -1,6 +1,21 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        if not settings.MONGODB_ENSURE_INDEXES:
+            return
+        from .indexes import ensure_indexes
+        from .mongo import get_collection
+        try:
+            ensure_indexes(get_collection())
+        except Exception as e:
+            logger.warning('Could not ensure api_prompt indexes: %s', e)
@@ -0,0 +1,302 @@
+import asyncio
+import functools
+import json
+import math
+import time
+from itertools import islice
+
+from django.conf import settings
+from bson import ObjectId
+from bson.errors import InvalidId
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from . import dedup, metrics, streaming
+from .export import find_training_documents, parse_dedup_param, parse_export_params, training_pair
+from .jobs import build_job_document, job_finished, job_payload, parse_wait
+from .llm_service import agenerate_two_responses, astream_two_responses, describe_llm_error
+from .mongo import get_collection, get_read_collection
+from .ratelimit import RateLimited
+from .repository import build_prompt_document, get_prompt, insert_prompt
+from .serializers import GenerateResponsesSerializer
+from .stats import build_stats, count_prompts_created, read_counts
+from .tokens import BudgetExceeded, admit, client_key, request_tokens, settle, spent_tokens
+
+
+# Async counterparts of the hot PromptViewSet actions, routed in front of the
+# viewset when ASYNC_VIEWS is on (ASGI serving). DRF viewsets are sync-only, so
+# these are plain Django views returning the same payloads. OpenAI calls are
+# native asyncio; the short pymongo calls run via asyncio.to_thread, which is
+# how Motor drives pymongo too (Motor itself needs pymongo 4, djongo pins 3.12).
+
+def _csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt wraps in a sync function on 4.2.
+    view.csrf_exempt = True
+    return view
+
+
+def in_thread(view):
+    """Serve a sync view from the thread pool.
+
+    Under ASGI Django runs sync views on a single thread per worker
+    (thread_sensitive), so a slow one would hold up every other sync request.
+    """
+    run = sync_to_async(view, thread_sensitive=False)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run(request, *args, **kwargs)
+    return wrapper
+
+
+def _timed(action):
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not metrics.enabled():
+                return await view(request, *args, **kwargs)
+            started = time.perf_counter()
+            response = await view(request, *args, **kwargs)
+            metrics.API_VIEW_SECONDS.observe(
+                time.perf_counter() - started,
+                action=action, method=request.method, status=response.status_code, stage='handler',
+            )
+            return response
+        return wrapper
+    return decorator
+
+
+def _retry_later(error):
+    response = JsonResponse({'error': str(error)}, status=429)
+    if error.retry_after is not None:
+        response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+def _training_data(dedup_action):
+    docs = find_training_documents(get_read_collection(), batch_size=settings.EXPORT_BATCH_SIZE, dedup=dedup_action)
+    return [training_pair(doc) for doc in docs]
+
+
+@_csrf_exempt
+@_timed('generate')
+async def generate(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error.'}, status=400)
+
+    serializer = GenerateResponsesSerializer(data=payload)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    data = serializer.validated_data
+    duplicate, reusable = await asyncio.to_thread(dedup.check_generate_request, get_collection(), data)
+    if reusable is not None:
+        return JsonResponse(dedup.reused_payload(reusable))
+    extra = {'duplicate_of': dedup.duplicate_payload(duplicate)} if duplicate else {}
+
+    try:
+        reservation = await asyncio.to_thread(admit, client_key(request), request_tokens(data))
+    except BudgetExceeded as e:
+        return _retry_later(e)
+
+    if settings.GENERATION_JOBS_ENABLED:
+        document = await asyncio.to_thread(insert_prompt, build_job_document(data, timezone.now(), reservation))
+        await asyncio.to_thread(count_prompts_created)
+        return JsonResponse({**job_payload(document), **extra}, status=202)
+
+    try:
+        response_a, response_b, timing = await agenerate_two_responses(
+            data['prompt'],
+            model_name=data['model_name'],
+            temperature_a=data['temperature_a'],
+            max_tokens_a=data['max_tokens_a'],
+            top_p_a=data['top_p_a'],
+            frequency_penalty_a=data['frequency_penalty_a'],
+            presence_penalty_a=data['presence_penalty_a'],
+            temperature_b=data['temperature_b'],
+            max_tokens_b=data['max_tokens_b'],
+            top_p_b=data['top_p_b'],
+            frequency_penalty_b=data['frequency_penalty_b'],
+            presence_penalty_b=data['presence_penalty_b'],
+            bypass_cache=data['bypass_cache']
+        )
+    except RateLimited as e:
+        await asyncio.to_thread(settle, reservation, 0)
+        return _retry_later(e)
+    except Exception as e:
+        await asyncio.to_thread(settle, reservation, 0)
+        return JsonResponse({'error': describe_llm_error(str(e), data['model_name'])}, status=500)
+    usage = timing.pop('usage')
+    await asyncio.to_thread(settle, reservation, spent_tokens(usage))
+
+    now = timezone.now()
+    document = build_prompt_document(data, response_a, response_b, now, usage)
+    await asyncio.to_thread(insert_prompt, document)
+    await asyncio.to_thread(count_prompts_created)
+
+    return JsonResponse({
+        'id': str(document['_id']),
+        'prompt': data['prompt'],
+        'response_a': response_a,
+        'response_b': response_b,
+        'model_name': data['model_name'],
+        'temperature': document['temperature'],
+        'temperature_a': data['temperature_a'],
+        'temperature_b': data['temperature_b'],
+        'created_at': now.isoformat(),
+        'timing': timing,
+        'usage': usage,
+        **extra
+    }, status=201)
+
+
+@_csrf_exempt
+@_timed('generate_stream')
+async def generate_stream(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error.'}, status=400)
+
+    serializer = GenerateResponsesSerializer(data=payload)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    data = serializer.validated_data
+    duplicate, reusable = await asyncio.to_thread(dedup.check_generate_request, get_collection(), data)
+    if reusable is not None:
+        async def reused():
+            yield streaming.reused(reusable)
+        return streaming.response(reused())
+    extra = {'duplicate_of': dedup.duplicate_payload(duplicate)} if duplicate else {}
+
+    try:
+        reservation = await asyncio.to_thread(admit, client_key(request), request_tokens(data))
+    except BudgetExceeded as e:
+        return _retry_later(e)
+
+    # An async iterator: Django's ASGI handler sends each event as it is
+    # yielded, where a sync one would be collected in full first.
+    async def event_stream():
+        finished = {}
+        streamed = {'a': [], 'b': []}
+        events = astream_two_responses(
+            data['prompt'],
+            model_name=data['model_name'],
+            temperature_a=data['temperature_a'],
+            max_tokens_a=data['max_tokens_a'],
+            top_p_a=data['top_p_a'],
+            frequency_penalty_a=data['frequency_penalty_a'],
+            presence_penalty_a=data['presence_penalty_a'],
+            temperature_b=data['temperature_b'],
+            max_tokens_b=data['max_tokens_b'],
+            top_p_b=data['top_p_b'],
+            frequency_penalty_b=data['frequency_penalty_b'],
+            presence_penalty_b=data['presence_penalty_b'],
+            bypass_cache=data['bypass_cache']
+        )
+        try:
+            try:
+                async for kind, side, payload in events:
+                    if kind == 'delta':
+                        streamed[side].append(payload)
+                    else:
+                        finished[side] = payload
+                    yield streaming.event(kind, side, payload)
+            except Exception as e:
+                yield streaming.sse('error', {'error': describe_llm_error(str(e), data['model_name'])})
+                return
+            usage = {side: finished[side]['usage'] for side in ('a', 'b')}
+
+            now = timezone.now()
+            document = build_prompt_document(data, finished['a']['content'], finished['b']['content'], now, usage)
+            await asyncio.to_thread(insert_prompt, document)
+            await asyncio.to_thread(count_prompts_created)
+            yield streaming.done(data, document, now, usage, extra)
+        finally:
+            # Stops both sides if the client went away mid-stream.
+            await events.aclose()
+            await asyncio.to_thread(settle, reservation, spent_tokens(streaming.spent_usage(data, finished, streamed)))
+
+    return streaming.response(event_stream())
+
+
+@_timed('job')
+async def job(request, pk):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        object_id = ObjectId(pk)
+    except InvalidId:
+        return JsonResponse({'detail': f'Invalid ObjectId format: {pk}'}, status=404)
+    try:
+        wait = parse_wait(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Long-polling here only parks a coroutine, not a worker thread.
+    deadline = time.monotonic() + wait
+    delay = 0.1
+    document = await asyncio.to_thread(get_prompt, object_id)
+    while not job_finished(document) and time.monotonic() < deadline:
+        await asyncio.sleep(min(delay, deadline - time.monotonic()))
+        delay = min(delay * 2, 1.0)
+        document = await asyncio.to_thread(get_prompt, object_id)
+    if document is None:
+        return JsonResponse({'detail': f'Prompt not found with id: {pk}'}, status=404)
+    return JsonResponse(job_payload(document))
+
+
+@_timed('stats')
+async def stats(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    counts = await asyncio.to_thread(read_counts, get_read_collection())
+    return JsonResponse(build_stats(counts))
+
+
+@_timed('export_training_data')
+async def export_training_data(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        dedup_action = parse_dedup_param(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    training_data = await asyncio.to_thread(_training_data, dedup_action)
+    return JsonResponse({'count': len(training_data), 'data': training_data})
+
+
+@_timed('export_training_data_jsonl')
+async def export_training_data_jsonl(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        after, limit = parse_export_params(request.GET)
+        dedup_action = parse_dedup_param(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    batch_size = settings.EXPORT_BATCH_SIZE
+    docs = find_training_documents(
+        get_read_collection(), after=after, limit=limit, batch_size=batch_size, dedup=dedup_action
+    )
+
+    async def lines():
+        while True:
+            batch = await asyncio.to_thread(lambda: list(islice(docs, batch_size)))
+            if not batch:
+                return
+            for doc in batch:
+                yield json.dumps({'id': str(doc['_id']), **training_pair(doc)}) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="training-data.jsonl"'
+    return response
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .clients import get_async_openai_client, get_openai_client
+from .ratelimit import SharedRateLimiter
+
+# Completions are routed by model_name prefix, longest prefix first. Settings
+# LLM_BACKENDS adds entries in front of the default OpenAI backend (prefix ''),
+# e.g. {"prefix": "local/", "kind": "openai-compatible", "base_url": ...}.
+# With strip_prefix (the default) "local/llama-3-8b" is sent as "llama-3-8b".
+# requests_per_minute / tokens_per_minute put the backend behind a budget
+# shared by all workers (api.ratelimit.SharedRateLimiter).
+
+
+class LLMBackend:
+    def __init__(self, name, prefix='', concurrency=None, strip_prefix=True,
+                 requests_per_minute=0, tokens_per_minute=0):
+        self.name = name
+        self.prefix = prefix
+        self.concurrency = concurrency
+        self.strip_prefix = strip_prefix
+        self.limiter = None
+        if requests_per_minute or tokens_per_minute:
+            self.limiter = SharedRateLimiter(name, requests_per_minute, tokens_per_minute)
+        self._semaphore = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._async_semaphores = weakref.WeakKeyDictionary()
+
+    def remote_model(self, model_name):
+        if self.strip_prefix and self.prefix and model_name.startswith(self.prefix):
+            return model_name[len(self.prefix):]
+        return model_name
+
+    @contextmanager
+    def slot(self):
+        if self._semaphore is None:
+            yield
+            return
+        with self._semaphore:
+            yield
+
+    @asynccontextmanager
+    async def aslot(self):
+        if not self.concurrency:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        async with semaphore:
+            yield
+
+    def complete(self, model, messages, **params):
+        """Return ``(content, usage)``; usage may be None."""
+        raise NotImplementedError
+
+    def stream(self, model, messages, **params):
+        """Yield content deltas."""
+        raise NotImplementedError
+
+    async def acomplete(self, model, messages, **params):
+        raise NotImplementedError
+
+    def astream(self, model, messages, **params):
+        """Async iterator of content deltas."""
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, name, api_key, base_url=None, pool_size=None, timeout=None, **options):
+        super().__init__(name, **options)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # With a shared budget, retries go through the scheduler in llm_service
+        # so every worker sees the provider's retry-after.
+        self.max_retries = 0 if self.limiter else None
+
+    def _check_key(self):
+        if not self.api_key:
+            raise ValueError("OpenAI API key is not configured. Please set OPENAI_API_KEY environment variable.")
+
+    def complete(self, model, messages, **params):
+        self._check_key()
+        client = get_openai_client(self.api_key, self.base_url, self.pool_size, self.timeout, self.max_retries)
+        with self.slot():
+            response = client.chat.completions.create(model=model, messages=messages, **params)
+        return response.choices[0].message.content, response.usage
+
+    def stream(self, model, messages, **params):
+        self._check_key()
+        client = get_openai_client(self.api_key, self.base_url, self.pool_size, self.timeout, self.max_retries)
+        with self.slot():
+            stream = client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+            with stream:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+    async def acomplete(self, model, messages, **params):
+        self._check_key()
+        client = get_async_openai_client(self.api_key, self.base_url, self.pool_size, self.timeout, self.max_retries)
+        async with self.aslot():
+            response = await client.chat.completions.create(model=model, messages=messages, **params)
+        return response.choices[0].message.content, response.usage
+
+    async def astream(self, model, messages, **params):
+        self._check_key()
+        client = get_async_openai_client(self.api_key, self.base_url, self.pool_size, self.timeout, self.max_retries)
+        async with self.aslot():
+            stream = await client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic in-process completions for tests and benchmarks.
+
+    The text depends only on the model, messages and sampling parameters, so
+    the two sides of a pair differ whenever their parameters do.
+    """
+
+    def __init__(self, name, latency=0.0, **options):
+        super().__init__(name, **options)
+        self.latency = latency
+
+    def _words(self, model, messages, params):
+        seed = repr((model, messages, sorted(params.items()))).encode()
+        digest = hashlib.sha256(seed).hexdigest()
+        count = max(1, min(int(params.get('max_tokens') or 16), 64) // 4)
+        return [digest[(i * 4) % 60:(i * 4) % 60 + 4] for i in range(count)]
+
+    def _usage(self, messages, words):
+        prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in messages)
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(words),
+            total_tokens=prompt_tokens + len(words),
+        )
+
+    def complete(self, model, messages, **params):
+        words = self._words(model, messages, params)
+        with self.slot():
+            if self.latency:
+                time.sleep(self.latency)
+        return ' '.join(words), self._usage(messages, words)
+
+    def stream(self, model, messages, **params):
+        words = self._words(model, messages, params)
+        with self.slot():
+            if self.latency:
+                time.sleep(self.latency)
+            for index, word in enumerate(words):
+                yield word if index == 0 else ' ' + word
+
+    async def acomplete(self, model, messages, **params):
+        words = self._words(model, messages, params)
+        async with self.aslot():
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        return ' '.join(words), self._usage(messages, words)
+
+    async def astream(self, model, messages, **params):
+        words = self._words(model, messages, params)
+        async with self.aslot():
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            for index, word in enumerate(words):
+                yield word if index == 0 else ' ' + word
+
+
+BACKEND_KINDS = {
+    'openai': OpenAIBackend,
+    'openai-compatible': OpenAIBackend,
+    'fake': FakeBackend,
+}
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def build_backend(config):
+    config = dict(config)
+    kind = config.pop('kind', 'openai-compatible')
+    if kind not in BACKEND_KINDS:
+        raise ImproperlyConfigured(f'Unknown LLM backend kind {kind!r} (expected one of {sorted(BACKEND_KINDS)})')
+    prefix = config.pop('prefix', '')
+    name = config.pop('name', prefix.rstrip('/:') or kind)
+    if kind == 'openai':
+        config.setdefault('api_key', settings.OPENAI_API_KEY)
+        config.setdefault('base_url', settings.OPENAI_BASE_URL)
+    elif kind == 'openai-compatible':
+        if not config.get('base_url'):
+            raise ImproperlyConfigured(f'LLM backend {name!r} needs a base_url')
+        # Self-hosted servers usually ignore the key, but the client requires one.
+        config.setdefault('api_key', 'not-needed')
+    return BACKEND_KINDS[kind](name, prefix=prefix, **config)
+
+
+def get_backends():
+    global _backends
+    if _backends is None:
+        with _backends_lock:
+            if _backends is None:
+                backends = [build_backend(config) for config in settings.LLM_BACKENDS]
+                if not any(backend.prefix == '' for backend in backends):
+                    backends.append(build_backend({
+                        'kind': 'openai',
+                        'name': 'openai',
+                        'concurrency': settings.OPENAI_CONCURRENCY,
+                        'requests_per_minute': settings.OPENAI_REQUESTS_PER_MINUTE,
+                        'tokens_per_minute': settings.OPENAI_TOKENS_PER_MINUTE,
+                    }))
+                _backends = sorted(backends, key=lambda backend: len(backend.prefix), reverse=True)
+    return _backends
+
+
+def get_backend(model_name):
+    for backend in get_backends():
+        if model_name.startswith(backend.prefix):
+            return backend
+    raise ImproperlyConfigured(f'No LLM backend matches model {model_name!r}')
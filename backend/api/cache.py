@@ -0,0 +1,98 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+from .mongo import get_collection
+
+_completion_cache = None
+
+
+def completion_key(prompt, model_name, temperature, max_tokens, top_p,
+                   frequency_penalty, presence_penalty):
+    payload = json.dumps([prompt, model_name, temperature, max_tokens, top_p,
+                          frequency_penalty, presence_penalty])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    """In-process LRU in front of an optional Mongo TTL collection shared by all workers."""
+
+    def __init__(self, max_entries, ttl_seconds, use_mongo=True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.use_mongo = use_mongo
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._ttl_index_ready = False
+
+    def _get_mongo_collection(self):
+        collection = get_collection('api_completion_cache')
+        if not self._ttl_index_ready:
+            collection.create_index('created_at', expireAfterSeconds=self.ttl_seconds)
+            self._ttl_index_ready = True
+        return collection
+
+    def _remember(self, key, content):
+        with self._lock:
+            self._entries[key] = content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return content
+
+        if self.use_mongo:
+            doc = self._get_mongo_collection().find_one({'_id': key}, {'content': 1})
+            if doc is not None:
+                self._remember(key, doc['content'])
+                with self._lock:
+                    self.mongo_hits += 1
+                return doc['content']
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, content):
+        self._remember(key, content)
+        if self.use_mongo:
+            self._get_mongo_collection().replace_one(
+                {'_id': key},
+                {'_id': key, 'content': content, 'created_at': timezone.now()},
+                upsert=True
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory_hits': self.memory_hits,
+                'mongo_hits': self.mongo_hits,
+                'misses': self.misses,
+            }
+
+
+def get_completion_cache():
+    global _completion_cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _completion_cache is None:
+        _completion_cache = CompletionCache(
+            settings.LLM_CACHE_MAX_ENTRIES,
+            settings.LLM_CACHE_TTL,
+            use_mongo=settings.LLM_CACHE_MONGO,
+        )
+    return _completion_cache
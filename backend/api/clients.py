@@ -0,0 +1,93 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Sockets inherited from the parent must not be shared with gunicorn workers.
+    global _clients_lock
+    _clients.clear()
+    _async_clients.clear()
+    _clients_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _build_client(api_key, base_url, pool_size, timeout, max_retries):
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=timeout,
+    )
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=max_retries,
+        timeout=timeout,
+        http_client=http_client,
+    )
+
+
+def get_openai_client(api_key, base_url=None, pool_size=None, timeout=None, max_retries=None):
+    pool_size = pool_size or settings.OPENAI_POOL_SIZE
+    timeout = timeout or settings.OPENAI_TIMEOUT
+    max_retries = settings.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+    key = (api_key, base_url, pool_size, timeout, max_retries)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _build_client(api_key, base_url, pool_size, timeout, max_retries)
+                _clients[key] = client
+    return client
+
+
+def get_async_openai_client(api_key, base_url=None, pool_size=None, timeout=None, max_retries=None):
+    # Async connections belong to the event loop that opened them, so pools are
+    # kept per running loop; within one loop no lock is needed.
+    pool_size = pool_size or settings.OPENAI_ASYNC_POOL_SIZE
+    timeout = timeout or settings.OPENAI_TIMEOUT
+    max_retries = settings.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (api_key, base_url, pool_size, timeout, max_retries)
+    client = clients.get(key)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=timeout,
+        )
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=max_retries,
+            timeout=timeout,
+            http_client=http_client,
+        )
+        clients[key] = client
+    return client
+
+
+def close_openai_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
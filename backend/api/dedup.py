@@ -0,0 +1,229 @@
+import hashlib
+import random
+import re
+import struct
+import unicodedata
+from collections import Counter, defaultdict, namedtuple
+from functools import lru_cache
+
+from bson import Binary
+from django.conf import settings
+from rest_framework import serializers
+
+from .storage import PARAM_KEYS, expand_documents
+
+# Every api_prompt document written while DEDUP_MODE is not 'off' carries:
+#   dedup_hash       sha256 prefix of the normalized prompt (exact duplicates)
+#   dedup_signature  NUM_PERM 32-bit MinHash values over word 3-gram shingles
+#   dedup_bands      one int64 per LSH band (BANDS bands of ROWS values)
+# Near duplicates share at least one band key, so a lookup is an $in on the
+# multikey dedup_bands index followed by a signature comparison on the
+# DEDUP_MAX_CANDIDATES documents sharing the most bands, the likeliest to be
+# similar. With 8 bands of 8 rows, pairs at Jaccard 0.8 collide in some band
+# ~97% of the time and pairs at 0.5 ~3%.
+# The constants below define the stored format; changing them means running
+# `python manage.py backfill_dedup --all`.
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(20240101)
+_PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+_WORD = re.compile(r'\w+')
+
+Duplicate = namedtuple('Duplicate', 'id similarity')
+
+
+def enabled():
+    return settings.DEDUP_MODE != 'off'
+
+
+def normalize(text):
+    return ' '.join(_WORD.findall(unicodedata.normalize('NFKC', text).lower()))
+
+
+def shingles(words):
+    if len(words) <= SHINGLE_WORDS:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def minhash(shingle_set):
+    hashes = [_hash64(shingle) for shingle in shingle_set]
+    return [
+        min(((a * value + b) % _MERSENNE_PRIME) & 0xFFFFFFFF for value in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def band_keys(signature):
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(struct.pack(f'<B{ROWS}I', band, *rows), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+@lru_cache(maxsize=256)
+def _fingerprint(text):
+    normalized = normalize(text)
+    signature = minhash(shingles(normalized.split()))
+    return (
+        hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:32],
+        struct.pack(f'<{NUM_PERM}I', *signature),
+        tuple(band_keys(signature)),
+    )
+
+
+def fingerprint(text):
+    """The dedup fields to store on a document with ``text`` as its prompt."""
+    dedup_hash, signature, bands = _fingerprint(text or '')
+    return {'dedup_hash': dedup_hash, 'dedup_signature': Binary(signature), 'dedup_bands': list(bands)}
+
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of two packed signatures."""
+    values_a = struct.unpack(f'<{NUM_PERM}I', signature_a)
+    values_b = struct.unpack(f'<{NUM_PERM}I', signature_b)
+    return sum(a == b for a, b in zip(values_a, values_b)) / NUM_PERM
+
+
+def _matches(fields, candidates):
+    matches = []
+    for doc in candidates:
+        if doc['dedup_hash'] == fields['dedup_hash']:
+            score = 1.0
+        else:
+            score = similarity(bytes(fields['dedup_signature']), bytes(doc['dedup_signature']))
+        if score >= settings.DEDUP_THRESHOLD:
+            matches.append(Duplicate(doc['_id'], score))
+    return sorted(matches, key=lambda match: (-match.similarity, match.id))
+
+
+def find_similar(collection, fields, exclude_id=None, query=None):
+    """Documents at DEDUP_THRESHOLD similarity or above, most similar (then oldest) first."""
+    query = dict(query or {}, dedup_bands={'$in': fields['dedup_bands']})
+    if exclude_id is not None:
+        query['_id'] = {'$ne': exclude_id}
+    # $sort followed by $limit keeps only the top candidates in memory.
+    candidates = collection.aggregate([
+        {'$match': query},
+        {'$project': {
+            'dedup_hash': 1,
+            'dedup_signature': 1,
+            # Band keys embed the band number, so this is the size of the intersection.
+            'shared_bands': {'$size': {'$filter': {
+                'input': '$dedup_bands', 'cond': {'$in': ['$$this', fields['dedup_bands']]}
+            }}},
+        }},
+        {'$sort': {'shared_bands': -1, '_id': 1}},
+        {'$limit': settings.DEDUP_MAX_CANDIDATES},
+    ])
+    return _matches(fields, candidates)
+
+
+def find_similar_batch(collection, docs, query=None):
+    """find_similar() for many documents with one query: ``{_id: matches}``.
+
+    Documents without stored dedup fields are fingerprinted from prompt_text.
+    Each one's candidates are still the DEDUP_MAX_CANDIDATES sharing the most
+    bands with it, ranked here instead of on the server.
+    """
+    fields = {
+        doc['_id']: doc if doc.get('dedup_signature') is not None else fingerprint(doc.get('prompt_text'))
+        for doc in docs
+    }
+    bands = {band for doc_fields in fields.values() for band in doc_fields['dedup_bands']}
+    if not bands:
+        return {}
+    by_band = defaultdict(list)
+    for candidate in collection.find(dict(query or {}, dedup_bands={'$in': list(bands)}),
+                                     {'dedup_hash': 1, 'dedup_signature': 1, 'dedup_bands': 1}):
+        for band in candidate['dedup_bands']:
+            by_band[band].append(candidate)
+
+    result = {}
+    for object_id, doc_fields in fields.items():
+        shared, candidates = Counter(), {}
+        for band in doc_fields['dedup_bands']:
+            for candidate in by_band[band]:
+                if candidate['_id'] != object_id:
+                    shared[candidate['_id']] += 1
+                    candidates[candidate['_id']] = candidate
+        top = sorted(shared, key=lambda candidate_id: (-shared[candidate_id], candidate_id))
+        result[object_id] = _matches(doc_fields, [candidates[key] for key in top[:settings.DEDUP_MAX_CANDIDATES]])
+    return result
+
+
+def find_duplicate(collection, fields):
+    """The oldest exact duplicate, else the closest near duplicate, or None."""
+    exact = collection.find_one({'dedup_hash': fields['dedup_hash']}, {'_id': 1}, sort=[('_id', 1)])
+    if exact is not None:
+        return Duplicate(exact['_id'], 1.0)
+    matches = find_similar(collection, fields)
+    return matches[0] if matches else None
+
+
+def find_reusable(collection, fields, data):
+    """A finished pair for the same normalized prompt, model and sampling parameters.
+
+    Pairs whose prompt text matches exactly are preferred, newest first.
+    """
+    cursor = collection.find(
+        {'dedup_hash': fields['dedup_hash'], 'model_name': data['model_name']}
+    ).sort('_id', -1).limit(20)
+    matches = [
+        doc for doc in expand_documents(cursor)
+        if doc.get('response_a') is not None and doc.get('response_b') is not None
+        and all(doc.get(key) == data[key] for key in PARAM_KEYS)
+    ]
+    for doc in matches:
+        if doc['prompt_text'] == data['prompt']:
+            return doc
+    return matches[0] if matches else None
+
+
+def check_generate_request(collection, data):
+    """Return ``(duplicate, reusable)`` for a validated generate request.
+
+    ``reusable`` is only looked up in 'reuse' mode and without bypass_cache.
+    """
+    if not enabled():
+        return None, None
+    fields = fingerprint(data['prompt'])
+    if settings.DEDUP_MODE == 'reuse' and not data['bypass_cache']:
+        reusable = find_reusable(collection, fields, data)
+        if reusable is not None:
+            return Duplicate(reusable['_id'], 1.0), reusable
+    return find_duplicate(collection, fields), None
+
+
+def duplicate_payload(duplicate):
+    return {'id': str(duplicate.id), 'similarity': round(duplicate.similarity, 3)}
+
+
+def reused_payload(document):
+    """Generate-endpoint response body for a reused pair."""
+    return {
+        'id': str(document['_id']),
+        'prompt': document['prompt_text'],
+        'response_a': document['response_a'],
+        'response_b': document['response_b'],
+        'model_name': document['model_name'],
+        'temperature': document['temperature'],
+        'temperature_a': document['temperature_a'],
+        'temperature_b': document['temperature_b'],
+        'created_at': serializers.DateTimeField().to_representation(document.get('created_at')),
+        'timing': None,
+        'reused': True,
+    }
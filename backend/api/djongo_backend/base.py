@@ -0,0 +1,24 @@
+from collections import OrderedDict
+
+from djongo.base import DatabaseWrapper as DjongoDatabaseWrapper, DjongoClient
+
+from api.mongo import get_client
+
+
+# djongo, but on the process-wide client from api.mongo instead of a second
+# MongoClient of its own, so Django's tables and the API share one pool (and
+# its fork handling). djongo closes its client whenever Django closes the
+# connection, which here would drop the API's pool after every request, so
+# closing only forgets the database handle.
+class DatabaseWrapper(DjongoDatabaseWrapper):
+    def get_new_connection(self, connection_params):
+        client = get_client()
+        self.client_connection = client
+        # djongo relies on OrderedDict documents.
+        codec_options = client.codec_options.with_options(document_class=OrderedDict)
+        database = client.get_database(connection_params['name'], codec_options=codec_options)
+        self.djongo_connection = DjongoClient(database, connection_params['enforce_schema'])
+        return database
+
+    def _close(self):
+        pass
@@ -0,0 +1,106 @@
+from itertools import islice
+
+from bson import ObjectId
+
+from .dedup import find_similar_batch
+from .storage import expand_documents, storage_projection
+
+# With dedup='drop' only the oldest pair of each group of near duplicates
+# (api.dedup) is exported; with 'cluster' every pair is, tagged with that
+# oldest id as its cluster.
+DEDUP_ACTIONS = ('drop', 'cluster')
+
+TRAINING_PAIR_PROJECTION = {
+    'prompt_text': 1,
+    'response_a': 1,
+    'response_b': 1,
+    'preference': 1,
+    'model_name': 1,
+    'temperature': 1,
+    'temperature_a': 1,
+    'temperature_b': 1,
+    'created_at': 1,
+    'preference_recorded_at': 1,
+}
+
+
+def training_pair(doc):
+    # Dict counterpart of Prompt.get_training_pair for raw api_prompt documents.
+    chosen = doc['response_a'] if doc['preference'] == 'A' else doc['response_b']
+    rejected = doc['response_b'] if doc['preference'] == 'A' else doc['response_a']
+    pair = {
+        'prompt': doc['prompt_text'],
+        'chosen': chosen,
+        'rejected': rejected,
+        'metadata': {
+            'model': doc.get('model_name'),
+            'temperature': doc.get('temperature'),
+            'temperature_a': doc.get('temperature_a'),
+            'temperature_b': doc.get('temperature_b'),
+            'created_at': doc['created_at'].isoformat() if doc.get('created_at') else None,
+            'preference_recorded_at': doc['preference_recorded_at'].isoformat() if doc.get('preference_recorded_at') else None,
+        }
+    }
+    if 'dedup_cluster' in doc:
+        pair['cluster'] = doc['dedup_cluster']
+    return pair
+
+
+def training_documents_cursor(collection, after=None, limit=None, batch_size=500, dedup=None):
+    # Voted pairs in _id order, served by the (preference, _id) index (api.indexes).
+    query = {'preference': {'$in': ['A', 'B']}}
+    if after is not None:
+        query['_id'] = {'$gt': after}
+    projection = storage_projection(TRAINING_PAIR_PROJECTION)
+    if dedup:
+        projection.update(dedup_hash=1, dedup_signature=1, dedup_bands=1)
+    cursor = collection.find(query, projection).sort('_id', 1).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def find_training_documents(collection, after=None, limit=None, batch_size=500, dedup=None):
+    cursor = training_documents_cursor(collection, after, limit, batch_size, dedup)
+    docs = expand_documents(cursor, batch_size)
+    return _deduplicate(collection, docs, dedup, batch_size) if dedup else docs
+
+
+def _deduplicate(collection, docs, action, batch_size):
+    # Keyed on _id order, so a page resumed with ?after= decides the same way.
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            return
+        similar = find_similar_batch(collection, batch, query={'preference': {'$in': ['A', 'B']}})
+        for doc in batch:
+            cluster = min([doc['_id']] + [match.id for match in similar.get(doc['_id'], [])])
+            if action == 'drop' and cluster != doc['_id']:
+                continue
+            if action == 'cluster':
+                doc['dedup_cluster'] = str(cluster)
+            yield doc
+
+
+def parse_dedup_param(params):
+    dedup = params.get('dedup') or None
+    if dedup is not None and dedup not in DEDUP_ACTIONS:
+        raise ValueError(f'dedup must be one of {", ".join(DEDUP_ACTIONS)}.')
+    return dedup
+
+
+def parse_export_params(params):
+    """Return (after, limit) from export query params or raise ValueError."""
+    after = params.get('after')
+    limit = params.get('limit')
+    try:
+        after = ObjectId(after) if after else None
+    except Exception:
+        raise ValueError(f'Invalid ObjectId format: {after}')
+    try:
+        limit = int(limit) if limit else None
+    except ValueError:
+        limit = 0
+    if limit is not None and limit < 1:
+        raise ValueError('limit must be a positive integer.')
+    return after, limit
@@ -0,0 +1,290 @@
+import gzip
+import hashlib
+import json
+import math
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from bson import ObjectId
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .repository import PROMPT_DEFAULTS, insert_prompts
+from .stats import count_preference_changes, count_prompts_created
+from .storage import expand_documents, storage_projection
+
+# Bulk import of preference datasets ({prompt, chosen, rejected, metadata}
+# rows, as written by the export endpoints and export_training_data) into
+# api_prompt without calling the LLM. chosen becomes response_a with
+# preference 'A'; metadata fills model, temperatures and timestamps, so
+# exporting an imported pair gives back the same row.
+#
+# Rows are deduplicated on content_hash: a hash of the prompt and the two
+# responses in sorted order, so it does not depend on which side won. A
+# unique partial index on it makes the server drop duplicates during the
+# unordered insert_many, across files and runs, with no in-memory hash set.
+# Documents created through the API get their content_hash from
+# backfill_content_hashes() at the start of each import.
+READ_CHUNK_BYTES = 1 << 20
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+# Strings (skipped whole), brackets, commas, or a string left open at the end.
+_ELEMENT_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{},]|"')
+# Yielded in place of an element or line that is not valid JSON; import_records
+# counts it as invalid like any other row that is not an object.
+MALFORMED = object()
+
+
+def content_hash(prompt, response_a, response_b):
+    digest = hashlib.sha256()
+    for text in [prompt] + sorted([response_a, response_b]):
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:32]
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_jsonl(handle):
+    for line in handle:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield MALFORMED
+
+
+def _element_end(buffer, position):
+    """Index of the ',' or ']' ending the array element at ``position``, or None if it is cut off."""
+    depth = 0
+    for match in _ELEMENT_TOKEN.finditer(buffer, position):
+        token = match.group()
+        if token == '"':
+            return None
+        if token in '[{':
+            depth += 1
+        elif token in ']}':
+            if not depth:
+                return match.start()
+            depth -= 1
+        elif token == ',' and not depth:
+            return match.start()
+    return None
+
+
+def iter_json_array(handle):
+    """Yield the elements of a top-level array, or of the array under a top-level
+    "data" key, decoding one element at a time from a sliding buffer."""
+    buffer, position, eof = '', 0, False
+
+    def more():
+        nonlocal buffer, position, eof
+        chunk = handle.read(READ_CHUNK_BYTES)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+    def skip(characters):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            more()
+
+    # Find the opening bracket: the first character, or the value of "data".
+    skip(_WHITESPACE)
+    if buffer[position:position + 1] == '{':
+        while True:
+            index = buffer.find('"data"', position)
+            if index >= 0:
+                position = index + len('"data"')
+                skip(_WHITESPACE + ':')
+                break
+            if eof:
+                raise ValueError('Expected a JSON array or an object with a "data" array')
+            position = max(position, len(buffer) - len('"data"'))
+            more()
+    if buffer[position:position + 1] != '[':
+        raise ValueError('Expected a JSON array or an object with a "data" array')
+    position += 1
+
+    while True:
+        skip(_WHITESPACE + ',')
+        if buffer[position:position + 1] in (']', ''):
+            return
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError:
+                # Read on only while the element is incomplete; a complete but
+                # malformed one is skipped up to its delimiter.
+                end = _element_end(buffer, position)
+                if end is not None or eof:
+                    value = MALFORMED
+                    break
+                more()
+        if value is MALFORMED:
+            yield value
+            if end is None:
+                # Cut off by the end of the file.
+                return
+            position = end
+            continue
+        # A number cut off by the chunk boundary still decodes; make sure it ended.
+        if end == len(buffer) and not eof:
+            more()
+            continue
+        position = end
+        yield value
+
+
+def iter_records(path, input_format=None):
+    """Rows of a .json/.jsonl file (optionally .gz); ``input_format`` overrides the extension."""
+    if input_format is None:
+        input_format = 'jsonl' if path.removesuffix('.gz').endswith('.jsonl') else 'json'
+    with _open(path) as handle:
+        yield from (iter_jsonl(handle) if input_format == 'jsonl' else iter_json_array(handle))
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError('timestamps must be ISO 8601 strings')
+    parsed = datetime.fromisoformat(value)
+    return parsed if timezone.is_aware(parsed) else parsed.replace(tzinfo=dt_timezone.utc)
+
+
+def _temperature(value):
+    # bool is an int, but not a temperature.
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError('temperatures must be finite numbers')
+    return float(value)
+
+
+def prompt_document(row, now):
+    """The api_prompt document for one dataset row; raises ValueError when malformed."""
+    if not isinstance(row, dict):
+        raise ValueError('row is not an object')
+    prompt, chosen, rejected = row.get('prompt'), row.get('chosen'), row.get('rejected')
+    if not all(isinstance(text, str) and text for text in (prompt, chosen, rejected)):
+        raise ValueError('prompt, chosen and rejected must be non-empty strings')
+    metadata = row.get('metadata')
+    if not isinstance(metadata, dict):
+        metadata = {}
+    created_at = _parse_datetime(metadata.get('created_at')) or now
+    document = {
+        '_id': ObjectId(),
+        **PROMPT_DEFAULTS,
+        'prompt_text': prompt,
+        'response_a': chosen,
+        'response_b': rejected,
+        'response_a_generated_at': created_at,
+        'response_b_generated_at': created_at,
+        'preference': 'A',
+        'preference_recorded_at': _parse_datetime(metadata.get('preference_recorded_at')) or created_at,
+        'created_at': created_at,
+        'updated_at': now,
+        'content_hash': content_hash(prompt, chosen, rejected),
+    }
+    if metadata.get('model') is not None:
+        if not isinstance(metadata['model'], str):
+            raise ValueError('model must be a string')
+        document['model_name'] = metadata['model']
+    for field in ('temperature', 'temperature_a', 'temperature_b'):
+        if metadata.get(field) is not None:
+            document[field] = _temperature(metadata[field])
+    return document
+
+
+def backfill_content_hashes(collection, batch_size=1000):
+    """Set content_hash on generated documents that lack it; return how many were set."""
+    query = {'content_hash': {'$exists': False}, 'response_a': {'$ne': None}, 'response_b': {'$ne': None}}
+    projection = storage_projection({'prompt_text': 1, 'response_a': 1, 'response_b': 1})
+    cursor = collection.find(query, projection).batch_size(batch_size)
+    updated = 0
+    operations = []
+
+    def flush():
+        nonlocal updated
+        try:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+        except BulkWriteError as e:
+            # Identical documents already in the collection: the first keeps the hash.
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            updated += e.details['nModified']
+        operations.clear()
+
+    for doc in expand_documents(cursor, batch_size):
+        if not all(isinstance(doc.get(key), str) for key in ('prompt_text', 'response_a', 'response_b')):
+            continue
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'content_hash': content_hash(doc['prompt_text'], doc['response_a'], doc['response_b'])}}
+        ))
+        if len(operations) >= batch_size:
+            flush()
+    if operations:
+        flush()
+    return updated
+
+
+def _insert(documents):
+    """Insert what is not a duplicate; return the number inserted."""
+    try:
+        insert_prompts(documents)
+        inserted = len(documents)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        inserted = e.details['nInserted']
+    count_prompts_created(inserted)
+    count_preference_changes([(None, 'A')] * inserted)
+    return inserted
+
+
+def import_records(records, batch_size=1000, progress=None):
+    """Insert dataset rows in unordered batches and return the counters.
+
+    ``progress`` is called with the counters after every batch.
+    """
+    result = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0}
+    batch, hashes = [], set()
+
+    def flush():
+        inserted = _insert(batch)
+        result['inserted'] += inserted
+        result['duplicates'] += len(batch) - inserted
+        batch.clear()
+        hashes.clear()
+        if progress:
+            progress(result)
+
+    now = timezone.now()
+    for row in records:
+        result['rows'] += 1
+        try:
+            document = prompt_document(row, now)
+        except ValueError:
+            result['invalid'] += 1
+            continue
+        # Duplicates within a batch never reach the server.
+        if document['content_hash'] in hashes:
+            result['duplicates'] += 1
+            continue
+        hashes.add(document['content_hash'])
+        batch.append(document)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return result
@@ -0,0 +1,309 @@
+import glob
+import gzip
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from .dedup import find_similar_batch
+from .export import DEDUP_ACTIONS, TRAINING_PAIR_PROJECTION, training_pair
+from .storage import expand_documents, storage_projection
+
+# Incremental training-data export into a local directory:
+#
+#   pairs-<run>-<shard>.jsonl[.gz|.parquet]  pairs first exported by each run
+#   overrides.jsonl                          latest change per already-exported id
+#   manifest.json                            shards, high-water mark, row counts
+#   state.sqlite3                            bookkeeping behind the files above
+#
+# Each run reads only documents written (updated_at) past the high-water
+# mark: keyed on the write time, not preference_recorded_at, because imported
+# pairs keep the vote time of their source dataset, which may be long past. New A/B pairs go to the run's shards; a later vote on an
+# exported pair becomes an "upsert" line in overrides.jsonl, and a vote that
+# takes it out of the dataset (TIE, cleared) a "delete" line. Consumers load
+# every shard, then apply overrides.jsonl by id.
+#
+# Shards are written before the state commit and named by run, so a crashed
+# run is simply redone. Edits that leave the preference alone (text changes
+# through PUT) are not picked up.
+#
+# With dedup='drop' a new pair is skipped when an already-exported pair is a
+# near duplicate (api.dedup); with 'cluster' it is kept and tagged with the
+# smallest id among itself and those pairs. Documents without a stored
+# fingerprint are fingerprinted on the fly but can only be found as
+# duplicates after `manage.py backfill_dedup`.
+
+FORMATS = {'jsonl': '.jsonl', 'jsonl.gz': '.jsonl.gz', 'parquet': '.parquet'}
+
+STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS exported (id TEXT PRIMARY KEY, preference TEXT);
+CREATE TABLE IF NOT EXISTS overrides (id TEXT PRIMARY KEY, run INTEGER, line TEXT);
+CREATE TABLE IF NOT EXISTS shards (file TEXT PRIMARY KEY, run INTEGER, rows INTEGER);
+'''
+
+
+def _parquet_schema():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImproperlyConfigured('The parquet format requires the pyarrow package')
+    return pa.schema([
+        ('id', pa.string()),
+        ('prompt', pa.string()),
+        ('chosen', pa.string()),
+        ('rejected', pa.string()),
+        ('metadata', pa.struct([
+            ('model', pa.string()),
+            ('temperature', pa.float64()),
+            ('temperature_a', pa.float64()),
+            ('temperature_b', pa.float64()),
+            ('created_at', pa.string()),
+            ('preference_recorded_at', pa.string()),
+        ])),
+        ('cluster', pa.string()),
+    ])
+
+
+class ShardWriter:
+    """Writes rows into ``pairs-<run>-<n>`` files of at most ``shard_size`` rows."""
+
+    PARQUET_ROW_GROUP = 1000
+
+    def __init__(self, directory, run, output_format, shard_size):
+        self.directory = directory
+        self.run = run
+        self.format = output_format
+        self.shard_size = shard_size
+        self.shards = []
+        self._handle = None
+        self._rows = 0
+        self._pending = []
+        self._schema = _parquet_schema() if output_format == 'parquet' else None
+
+    def _open(self):
+        name = f'pairs-{self.run:06d}-{len(self.shards) + 1:04d}{FORMATS[self.format]}'
+        self.shards.append([name, 0])
+        path = os.path.join(self.directory, name)
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self._handle = pq.ParquetWriter(path, self._schema)
+        elif self.format == 'jsonl.gz':
+            self._handle = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._handle = open(path, 'w', encoding='utf-8')
+        self._rows = 0
+
+    def _flush_parquet(self):
+        if self._pending:
+            import pyarrow as pa
+            self._handle.write_table(pa.Table.from_pylist(self._pending, schema=self._schema))
+            self._pending = []
+
+    def _close_shard(self):
+        if self._handle is None:
+            return
+        if self.format == 'parquet':
+            self._flush_parquet()
+        self._handle.close()
+        self._handle = None
+
+    def write(self, row):
+        if self._handle is None or self._rows >= self.shard_size:
+            self._close_shard()
+            self._open()
+        if self.format == 'parquet':
+            self._pending.append(row)
+            if len(self._pending) >= self.PARQUET_ROW_GROUP:
+                self._flush_parquet()
+        else:
+            self._handle.write(json.dumps(row) + '\n')
+        self._rows += 1
+        self.shards[-1][1] += 1
+
+    def close(self):
+        self._close_shard()
+
+
+def _write_atomic(path, text):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as handle:
+        handle.write(text)
+    os.replace(temporary, path)
+
+
+class IncrementalExport:
+    def __init__(self, directory, output_format='jsonl', shard_size=50000, settle_seconds=60, dedup=None):
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown format {output_format!r} (expected one of {sorted(FORMATS)})')
+        if dedup is not None and dedup not in DEDUP_ACTIONS:
+            raise ValueError(f'Unknown dedup action {dedup!r} (expected one of {DEDUP_ACTIONS})')
+        self.dedup = dedup
+        self.directory = directory
+        self.format = output_format
+        self.shard_size = shard_size
+        self.settle_seconds = settle_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'state.sqlite3'))
+        self.db.executescript(STATE_SCHEMA)
+        stored_format = self._meta('format')
+        if stored_format and stored_format != output_format:
+            raise ValueError(f'{directory} holds a {stored_format} export; use another directory for {output_format}')
+
+    def _meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def _query(self, high_water_mark, cutoff):
+        query = {'updated_at': {'$lte': cutoff}}
+        if high_water_mark is None:
+            # First run: everything in the dataset, including pairs stored
+            # without an updated_at.
+            return {'$or': [query, {'preference': {'$in': ['A', 'B']}, 'updated_at': None}]}
+        updated_at, last_id = high_water_mark
+        updated_at = datetime.fromisoformat(updated_at)
+        return {'$and': [query, {'$or': [
+            {'updated_at': {'$gt': updated_at}},
+            {'updated_at': updated_at, '_id': {'$gt': last_id}},
+        ]}]}
+
+    def _remove_uncommitted_shards(self, run):
+        for path in glob.glob(os.path.join(self.directory, 'pairs-*')):
+            try:
+                shard_run = int(os.path.basename(path).split('-')[1])
+            except (IndexError, ValueError):
+                continue
+            if shard_run >= run:
+                os.remove(path)
+
+    def run(self, collection, batch_size=500):
+        """Export everything new since the last run and return its counters."""
+        run = self._meta('runs', 0) + 1
+        self._remove_uncommitted_shards(run)
+        stored_mark = self._meta('high_water_mark')
+        high_water_mark = (stored_mark[0], ObjectId(stored_mark[1])) if stored_mark else None
+        cutoff = timezone.now() - timedelta(seconds=self.settle_seconds)
+
+        projection = storage_projection(dict(TRAINING_PAIR_PROJECTION, updated_at=1))
+        if self.dedup:
+            projection.update(dedup_hash=1, dedup_signature=1, dedup_bands=1)
+        cursor = collection.find(self._query(high_water_mark, cutoff), projection).sort(
+            [('updated_at', 1), ('_id', 1)]
+        ).batch_size(batch_size)
+
+        writer = ShardWriter(self.directory, run, self.format, self.shard_size)
+        result = {'run': run, 'examined': 0, 'appended': 0, 'upserts': 0, 'deletes': 0, 'duplicates': 0}
+        batch = []
+        try:
+            for doc in expand_documents(cursor, batch_size):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    high_water_mark = self._process(collection, batch, run, writer, result) or high_water_mark
+                    batch = []
+            if batch:
+                high_water_mark = self._process(collection, batch, run, writer, result) or high_water_mark
+        finally:
+            writer.close()
+
+        for name, rows in writer.shards:
+            self.db.execute('INSERT OR REPLACE INTO shards (file, run, rows) VALUES (?, ?, ?)', (name, run, rows))
+        if high_water_mark is not None:
+            updated_at, last_id = high_water_mark
+            self._set_meta('high_water_mark', [str(updated_at), str(last_id)])
+        self._set_meta('format', self.format)
+        self._set_meta('runs', run)
+        self.db.commit()
+        self.write_files()
+        return result
+
+    def _exported_duplicates(self, matches):
+        if not matches:
+            return []
+        ids = [str(match.id) for match in matches]
+        placeholders = ','.join('?' * len(ids))
+        return [object_id for (object_id,) in self.db.execute(
+            f'SELECT id FROM exported WHERE preference IS NOT NULL AND id IN ({placeholders})', ids
+        )]
+
+    def _process(self, collection, batch, run, writer, result):
+        ids = [str(doc['_id']) for doc in batch]
+        placeholders = ','.join('?' * len(ids))
+        exported = dict(self.db.execute(
+            f'SELECT id, preference FROM exported WHERE id IN ({placeholders})', ids
+        ).fetchall())
+        similar = {}
+        if self.dedup:
+            # One candidate lookup for every new pair in the batch.
+            similar = find_similar_batch(collection, [
+                doc for doc, object_id in zip(batch, ids)
+                if object_id not in exported and doc.get('preference') in ('A', 'B')
+            ], query={'preference': {'$in': ['A', 'B']}})
+        last = None
+        for doc, object_id in zip(batch, ids):
+            result['examined'] += 1
+            preference = doc.get('preference')
+            if doc.get('updated_at') is not None:
+                last = (doc['updated_at'].isoformat(), doc['_id'])
+            in_dataset = preference in ('A', 'B')
+            if object_id not in exported:
+                if in_dataset:
+                    row = {'id': object_id, **training_pair(doc)}
+                    if self.dedup:
+                        duplicates = self._exported_duplicates(similar.get(doc['_id']))
+                        if duplicates and self.dedup == 'drop':
+                            result['duplicates'] += 1
+                            continue
+                        if duplicates:
+                            result['duplicates'] += 1
+                        row['cluster'] = min([object_id] + duplicates)
+                    writer.write(row)
+                    self.db.execute('INSERT INTO exported (id, preference) VALUES (?, ?)', (object_id, preference))
+                    result['appended'] += 1
+                continue
+            previous = exported[object_id]
+            if previous == (preference if in_dataset else None):
+                continue
+            if in_dataset:
+                line = {'id': object_id, 'action': 'upsert', **training_pair(doc)}
+                result['upserts'] += 1
+            else:
+                line = {'id': object_id, 'action': 'delete'}
+                result['deletes'] += 1
+            self.db.execute(
+                'INSERT OR REPLACE INTO overrides (id, run, line) VALUES (?, ?, ?)',
+                (object_id, run, json.dumps(line))
+            )
+            self.db.execute(
+                'UPDATE exported SET preference = ? WHERE id = ?',
+                (preference if in_dataset else None, object_id)
+            )
+        return last
+
+    def write_files(self):
+        """Rewrite overrides.jsonl and manifest.json from the committed state."""
+        lines = [line for (line,) in self.db.execute('SELECT line FROM overrides ORDER BY run, id')]
+        _write_atomic(os.path.join(self.directory, 'overrides.jsonl'), ''.join(line + '\n' for line in lines))
+        shards = [
+            {'file': name, 'run': run, 'rows': rows}
+            for name, run, rows in self.db.execute('SELECT file, run, rows FROM shards ORDER BY file')
+        ]
+        manifest = {
+            'format': self._meta('format', self.format),
+            'runs': self._meta('runs', 0),
+            'high_water_mark': self._meta('high_water_mark'),
+            'rows': sum(shard['rows'] for shard in shards),
+            'overrides': len(lines),
+            'shards': shards,
+            'overrides_file': 'overrides.jsonl',
+        }
+        _write_atomic(os.path.join(self.directory, 'manifest.json'), json.dumps(manifest, indent=2) + '\n')
+
+    def close(self):
+        self.db.close()
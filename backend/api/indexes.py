@@ -0,0 +1,76 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from .export import training_documents_cursor
+from .stats import STATS_INDEX, stats_aggregation
+
+# Unique among documents that have one, so bulk imports (api.importer) skip
+# duplicate pairs server-side.
+CONTENT_HASH_INDEX = IndexModel([('content_hash', ASCENDING)], name='content_hash_1', unique=True,
+                                partialFilterExpression={'content_hash': {'$exists': True}})
+
+# (preference, preference_recorded_at) also serves preference-only filters,
+# so a separate single-field preference index would be redundant.
+PROMPT_INDEXES = [
+    # Also answers the stats aggregation (api.stats)
+    IndexModel([('preference', ASCENDING), ('preference_recorded_at', ASCENDING)], name=STATS_INDEX),
+    IndexModel([('model_name', ASCENDING), ('created_at', DESCENDING)],
+               name='model_name_1_created_at_-1'),
+    # Training-pair exports in _id order (api.export.find_training_documents):
+    # one scan per preference value, merged on _id without an in-memory sort
+    IndexModel([('preference', ASCENDING), ('_id', ASCENDING)], name='preference_1__id_1'),
+    # Also the keyset for list pagination (api.pagination)
+    IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_at_-1__id_-1'),
+    # Latest vote (api.analytics.collection_version)
+    IndexModel([('preference_recorded_at', ASCENDING), ('_id', ASCENDING)],
+               name='preference_recorded_at_1__id_1'),
+    # Incremental export high-water mark (api.incremental_export)
+    IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at_1__id_1'),
+    # Duplicate lookups (api.dedup); dedup_bands is multikey
+    IndexModel([('dedup_hash', ASCENDING)], name='dedup_hash_1', sparse=True),
+    IndexModel([('dedup_bands', ASCENDING)], name='dedup_bands_1', sparse=True),
+    # Annotation leasing (api.annotation.lease_next_pair); queue documents only
+    IndexModel([('annotation_queue', ASCENDING), ('preference', ASCENDING), ('created_at', ASCENDING)],
+               name='annotation_queue_1_preference_1_created_at_1',
+               partialFilterExpression={'annotation_queue': True}),
+    CONTENT_HASH_INDEX,
+    # Generation job leasing (api.jobs.claim_job)
+    IndexModel([('job_status', ASCENDING), ('created_at', ASCENDING)],
+               name='job_status_1_created_at_1'),
+]
+
+
+def ensure_indexes(collection):
+    return collection.create_indexes(PROMPT_INDEXES)
+
+
+def missing_indexes(collection):
+    existing = collection.index_information()
+    return [index.document['name'] for index in PROMPT_INDEXES if index.document['name'] not in existing]
+
+
+def _plan_stages(node, stages):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'rejectedPlans':
+                continue
+            if key == 'stage' and isinstance(value, str):
+                stages.add(value)
+            else:
+                _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, stages)
+    return stages
+
+
+def explain_hot_queries(collection):
+    """Return the winning-plan stages of the export and stats queries."""
+    export_plan = training_documents_cursor(collection).explain()
+    pipeline, options = stats_aggregation(collection)
+    stats_plan = collection.database.command(
+        'aggregate', collection.name, pipeline=pipeline, explain=True, **options
+    )
+    return {
+        'export-training-data': sorted(_plan_stages(export_plan, set())),
+        'stats': sorted(_plan_stages(stats_plan, set())),
+    }
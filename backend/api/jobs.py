@@ -0,0 +1,237 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import PyMongoError
+from rest_framework import serializers
+
+from .llm_service import describe_llm_error, generate_two_responses
+from .mongo import get_collection
+from .ratelimit import RateLimited
+from .repository import build_prompt_document
+from .storage import compress_text, expand_document, is_compact
+from .tokens import settle, spent_tokens
+
+logger = logging.getLogger(__name__)
+
+# Generation jobs live in api_prompt itself: a pending document is the queue
+# entry, and workers lease it with find_one_and_update so a crashed worker's
+# job is picked up again once job_lease_expires_at passes. Documents written
+# before job mode have no job_status and are treated as done.
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def default_owner():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def build_job_document(data, now, token_reservation=None):
+    document = build_prompt_document(data, None, None, now)
+    document.update({
+        'response_a_generated_at': None,
+        'response_b_generated_at': None,
+        'job_status': JOB_PENDING,
+        'job_attempts': 0,
+        'job_lease_owner': None,
+        'job_lease_expires_at': None,
+        'job_retry_at': None,
+        'job_error': None,
+        'job_bypass_cache': data['bypass_cache'],
+        # Settled against the actual usage once the job finishes (see api.tokens).
+        'token_reservation': token_reservation,
+    })
+    return document
+
+
+def claim_job(collection, owner, now=None):
+    """Lease the oldest pending (or abandoned running) job, or return None."""
+    now = now or timezone.now()
+    return collection.find_one_and_update(
+        {'$or': [
+            {'job_status': JOB_PENDING, 'job_retry_at': {'$not': {'$gt': now}}},
+            {'job_status': JOB_RUNNING, 'job_lease_expires_at': {'$lt': now}},
+        ]},
+        {
+            '$set': {
+                'job_status': JOB_RUNNING,
+                'job_lease_owner': owner,
+                'job_lease_expires_at': now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            },
+            '$inc': {'job_attempts': 1},
+        },
+        sort=[('created_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def complete_job(collection, job, response_a, response_b, now=None, usage=None):
+    """Store both responses; False if the lease was lost to another worker."""
+    usage = usage or {}
+    now = now or timezone.now()
+    if is_compact(job):
+        response_a, response_b = compress_text(response_a), compress_text(response_b)
+    result = collection.update_one(
+        {'_id': job['_id'], 'job_status': JOB_RUNNING, 'job_lease_owner': job['job_lease_owner']},
+        {'$set': {
+            'response_a': response_a,
+            'response_b': response_b,
+            'response_a_generated_at': now,
+            'response_b_generated_at': now,
+            'usage_a': usage.get('a'),
+            'usage_b': usage.get('b'),
+            'job_status': JOB_DONE,
+            'job_lease_expires_at': None,
+            'job_error': None,
+            'updated_at': now,
+        }}
+    )
+    return result.modified_count == 1
+
+
+def fail_job(collection, job, error, now=None):
+    """Requeue the job with exponential backoff, or mark it failed after JOB_MAX_ATTEMPTS."""
+    now = now or timezone.now()
+    final = job['job_attempts'] >= settings.JOB_MAX_ATTEMPTS
+    backoff = settings.JOB_RETRY_DELAY * 2 ** (job['job_attempts'] - 1)
+    collection.update_one(
+        {'_id': job['_id'], 'job_status': JOB_RUNNING, 'job_lease_owner': job['job_lease_owner']},
+        {'$set': {
+            'job_status': JOB_FAILED if final else JOB_PENDING,
+            'job_lease_expires_at': None,
+            'job_retry_at': None if final else now + timedelta(seconds=backoff),
+            'job_error': error,
+            'updated_at': now,
+        }}
+    )
+    return final
+
+
+def defer_job(collection, job, seconds, now=None):
+    """Requeue the job after ``seconds`` without spending one of its attempts."""
+    now = now or timezone.now()
+    collection.update_one(
+        {'_id': job['_id'], 'job_status': JOB_RUNNING, 'job_lease_owner': job['job_lease_owner']},
+        {
+            '$set': {
+                'job_status': JOB_PENDING,
+                'job_lease_expires_at': None,
+                'job_retry_at': now + timedelta(seconds=seconds),
+                'updated_at': now,
+            },
+            '$inc': {'job_attempts': -1},
+        }
+    )
+
+
+def process_job(collection, job):
+    # ``job`` stays in its stored layout so complete_job writes the same one.
+    fields = expand_document(job)
+    try:
+        response_a, response_b, meta = generate_two_responses(
+            fields['prompt_text'],
+            model_name=fields['model_name'],
+            temperature_a=fields['temperature_a'],
+            max_tokens_a=fields['max_tokens_a'],
+            top_p_a=fields['top_p_a'],
+            frequency_penalty_a=fields['frequency_penalty_a'],
+            presence_penalty_a=fields['presence_penalty_a'],
+            temperature_b=fields['temperature_b'],
+            max_tokens_b=fields['max_tokens_b'],
+            top_p_b=fields['top_p_b'],
+            frequency_penalty_b=fields['frequency_penalty_b'],
+            presence_penalty_b=fields['presence_penalty_b'],
+            bypass_cache=fields.get('job_bypass_cache', False)
+        )
+    except RateLimited as e:
+        # The shared budget is busy; nothing was sent, so try again once it refills.
+        defer_job(collection, job, e.retry_after)
+        return False
+    except Exception as e:
+        error = describe_llm_error(str(e), job['model_name'])
+        final = fail_job(collection, job, error)
+        logger.warning('Generation job %s failed (attempt %s%s): %s',
+                       job['_id'], job['job_attempts'], ', giving up' if final else '', error)
+        if final:
+            settle(job.get('token_reservation'), 0)
+        return False
+    if not complete_job(collection, job, response_a, response_b, usage=meta['usage']):
+        logger.warning('Generation job %s lost its lease before completing', job['_id'])
+        return False
+    settle(job.get('token_reservation'), spent_tokens(meta['usage']))
+    return True
+
+
+def run_worker(stop_event, owner=None, collection=None):
+    """Claim and process jobs until ``stop_event`` is set."""
+    owner = owner or default_owner()
+    collection = collection if collection is not None else get_collection()
+    while not stop_event.is_set():
+        try:
+            job = claim_job(collection, owner)
+            if job is not None:
+                process_job(collection, job)
+                continue
+        except PyMongoError:
+            # The lease expires, so another attempt will pick the job up.
+            logger.exception('Generation worker %s hit a MongoDB error', owner)
+        stop_event.wait(settings.JOB_POLL_INTERVAL)
+
+
+def job_payload(document):
+    payload = {
+        'id': str(document['_id']),
+        'status': document.get('job_status', JOB_DONE),
+        'attempts': document.get('job_attempts', 0),
+        'error': document.get('job_error'),
+    }
+    if payload['status'] == JOB_DONE:
+        payload.update({
+            'prompt': document['prompt_text'],
+            'response_a': document['response_a'],
+            'response_b': document['response_b'],
+            'model_name': document['model_name'],
+            'temperature': document['temperature'],
+            'temperature_a': document['temperature_a'],
+            'temperature_b': document['temperature_b'],
+            'created_at': serializers.DateTimeField().to_representation(document['created_at']),
+        })
+    return payload
+
+
+def parse_wait(params):
+    """Return the long-poll timeout from ``?wait=<seconds>``, capped at JOB_WAIT_MAX_SECONDS."""
+    try:
+        wait = float(params.get('wait') or 0)
+    except ValueError:
+        raise ValueError('wait must be a number of seconds.')
+    if not wait > 0:
+        return 0.0
+    return min(wait, settings.JOB_WAIT_MAX_SECONDS)
+
+
+def job_finished(document):
+    return document is None or document.get('job_status', JOB_DONE) in (JOB_DONE, JOB_FAILED)
+
+
+def wait_for_job(collection, object_id, timeout):
+    """Poll the job document until it is done/failed or ``timeout`` seconds pass."""
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    while True:
+        document = collection.find_one({'_id': object_id})
+        if job_finished(document):
+            return expand_document(document)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return expand_document(document)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 1.0)
@@ -1,50 +1,552 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
-from openai import OpenAI
+
+from . import metrics
+from .backends import get_backend
+from .cache import completion_key, get_completion_cache
+from .ratelimit import (
+    RateLimited,
+    TokenRateLimiter,
+    backoff_delay,
+    is_retryable,
+    retry_after_seconds,
+)
+from .tokens import estimated_usage, prompt_tokens, usage_document
+
+_pair_executor = None
+_batch_limiter = None
+
+
+def _get_pair_executor():
+    global _pair_executor
+    if _pair_executor is None:
+        _pair_executor = ThreadPoolExecutor(
+            max_workers=settings.LLM_PAIR_WORKERS,
+            thread_name_prefix='llm-pair'
+        )
+    return _pair_executor
+
+
+def _get_batch_limiter():
+    global _batch_limiter
+    if _batch_limiter is None:
+        _batch_limiter = TokenRateLimiter(settings.LLM_BATCH_TOKENS_PER_MINUTE)
+    return _batch_limiter
 
 
 def generate_llm_response(prompt, model_name='gpt-3.5-turbo', temperature=0.7, max_tokens=500, 
-                          top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0):
+                          top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0, reserved=False):
+    return complete_llm_response(prompt, model_name, temperature, max_tokens, top_p,
+                                 frequency_penalty, presence_penalty, reserved)[0]
+
+
+def complete_llm_response(prompt, model_name='gpt-3.5-turbo', temperature=0.7, max_tokens=500,
+                          top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0, reserved=False):
+    """Like generate_llm_response(), but returns ``(content, usage)`` with usage as a document."""
     try:
-        api_key = settings.OPENAI_API_KEY
-        if not api_key:
-            raise ValueError("OpenAI API key is not configured. Please set OPENAI_API_KEY environment variable.")
-        
-        client = OpenAI(
-            api_key=api_key,
-            max_retries=2,
-            timeout=30.0
-        )
+        backend = get_backend(model_name)
+        attempt = 0
+        while True:
+            if not reserved:
+                _reserve(backend, 1, prompt_tokens(prompt, model_name) + max_tokens)
+            reserved = False
+            started = time.perf_counter()
+            try:
+                content, usage = backend.complete(
+                    backend.remote_model(model_name),
+                    [{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p,
+                    frequency_penalty=frequency_penalty,
+                    presence_penalty=presence_penalty
+                )
+                break
+            except Exception as e:
+                delay = _retry_delay(backend, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+        _record_llm_success(model_name, started, usage)
         
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
+        return content, usage_document(usage)
+    except RateLimited:
+        # Views answer it with a 429 and Retry-After, so it keeps its type.
+        raise
+    except Exception as e:
+        error_type = type(e).__name__
+        error_msg = str(e)
+        _record_llm_failure(model_name, f"{error_type}: {error_msg}")
+        raise Exception(f"{error_type}: {error_msg}")
+
+
+def stream_llm_response(prompt, model_name='gpt-3.5-turbo', temperature=0.7, max_tokens=500,
+                        top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0, reserved=False):
+    # Streams reserve budget but are not retried: deltas may already be out.
+    try:
+        backend = get_backend(model_name)
+        if not reserved:
+            _reserve(backend, 1, prompt_tokens(prompt, model_name) + max_tokens)
+        started = time.perf_counter()
+        yield from backend.stream(
+            backend.remote_model(model_name),
+            [{"role": "user", "content": prompt}],
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=top_p,
             frequency_penalty=frequency_penalty,
             presence_penalty=presence_penalty
         )
-        
-        return response.choices[0].message.content
+        _record_llm_success(model_name, started, None)
+    except RateLimited:
+        raise
     except Exception as e:
         error_type = type(e).__name__
         error_msg = str(e)
+        _record_llm_failure(model_name, f"{error_type}: {error_msg}")
         raise Exception(f"{error_type}: {error_msg}")
 
 
+def classify_llm_error(error_msg):
+    if 'authentication' in error_msg.lower() or 'api key' in error_msg.lower() or 'unauthorized' in error_msg.lower():
+        return 'auth'
+    elif 'quota' in error_msg.lower() or 'billing' in error_msg.lower():
+        return 'quota'
+    elif 'rate limit' in error_msg.lower():
+        return 'rate_limit'
+    elif 'model' in error_msg.lower():
+        return 'model'
+    return 'other'
+
+
+def describe_llm_error(error_msg, model_name):
+    error_class = classify_llm_error(error_msg)
+    if error_class == 'auth':
+        return 'Invalid API key.'
+    elif error_class == 'quota':
+        return 'OpenAI quota exceeded.'
+    elif error_class == 'rate_limit':
+        return 'Rate limit exceeded. Try again in a moment.'
+    elif error_class == 'model':
+        return f'{model_name} may not be available.'
+    return error_msg[:100]
+
+
+def _record_llm_success(model_name, started, usage):
+    if metrics.enabled():
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=model_name, outcome='ok')
+        metrics.record_usage(model_name, usage)
+
+
+def _record_llm_failure(model_name, error_msg):
+    if metrics.enabled():
+        metrics.LLM_ERRORS.inc(model=model_name, error_class=classify_llm_error(error_msg))
+
+
+def _reserve(backend, requests, tokens):
+    if backend.limiter is not None:
+        backend.limiter.acquire(requests, tokens)
+
+
+def _reserve_pair(args_a, args_b):
+    """Reserve shared budget for both sides at once so a pair never goes out half-sent.
+
+    Returns whether anything was reserved. Reserved before the cache lookup, so
+    cache hits are counted against the budget too.
+    """
+    backend = get_backend(args_a[1])
+    if backend.limiter is None:
+        return False
+    tokens = sum(prompt_tokens(args[0], args[1]) + args[3] for args in (args_a, args_b))
+    backend.limiter.acquire(2, tokens)
+    return True
+
+
+async def _areserve_pair(args_a, args_b):
+    backend = get_backend(args_a[1])
+    if backend.limiter is None:
+        return False
+    tokens = sum(prompt_tokens(args[0], args[1]) + args[3] for args in (args_a, args_b))
+    await backend.limiter.aacquire(2, tokens)
+    return True
+
+
+def _retry_delay(backend, error, attempt):
+    """Seconds to wait before retrying ``error``, or None to give up."""
+    if backend.limiter is None or attempt >= settings.LLM_RETRY_ATTEMPTS or not is_retryable(error):
+        return None
+    retry_after = retry_after_seconds(error)
+    if retry_after:
+        # Hold every worker off this backend, not just this call.
+        backend.limiter.block(retry_after)
+    return max(retry_after or 0, backoff_delay(attempt, settings.LLM_RETRY_BASE_DELAY, settings.LLM_RETRY_MAX_DELAY))
+
+
+def _timed_llm_response(args, bypass_cache=False, limiter=None, reserved=False):
+    """Return ``(content, ms, usage)``; usage is None for a cache hit."""
+    started = time.perf_counter()
+    cache = None if bypass_cache else get_completion_cache()
+    key = completion_key(*args) if cache else None
+    content = cache.get(key) if cache else None
+    usage = None
+    if content is None:
+        # Only real completions spend token budget; cache hits are free.
+        if limiter is not None:
+            prompt, max_tokens = args[0], args[3]
+            limiter.acquire(prompt_tokens(prompt, args[1]) + max_tokens)
+        content, usage = complete_llm_response(*args, reserved=reserved)
+        if cache:
+            cache.set(key, content)
+    return content, round((time.perf_counter() - started) * 1000, 1), usage
+
+
 def generate_two_responses(prompt, model_name='gpt-3.5-turbo', 
                           temperature_a=0.7, max_tokens_a=500, top_p_a=1.0, 
                           frequency_penalty_a=0.0, presence_penalty_a=0.0,
                           temperature_b=0.9, max_tokens_b=500, top_p_b=1.0,
-                          frequency_penalty_b=0.0, presence_penalty_b=0.0):
-    response_a = generate_llm_response(
-        prompt, model_name, temperature_a, max_tokens_a, 
-        top_p_a, frequency_penalty_a, presence_penalty_a
-    )
-    
-    response_b = generate_llm_response(
-        prompt, model_name, temperature_b, max_tokens_b,
-        top_p_b, frequency_penalty_b, presence_penalty_b
+                          frequency_penalty_b=0.0, presence_penalty_b=0.0,
+                          bypass_cache=False):
+    args_a = (prompt, model_name, temperature_a, max_tokens_a,
+              top_p_a, frequency_penalty_a, presence_penalty_a)
+    args_b = (prompt, model_name, temperature_b, max_tokens_b,
+              top_p_b, frequency_penalty_b, presence_penalty_b)
+
+    started = time.perf_counter()
+    reserved = _reserve_pair(args_a, args_b)
+    if settings.LLM_CONCURRENT_PAIRS:
+        executor = _get_pair_executor()
+        future_a = executor.submit(_timed_llm_response, args_a, bypass_cache, None, reserved)
+        future_b = executor.submit(_timed_llm_response, args_b, bypass_cache, None, reserved)
+        response_a, response_a_ms, usage_a = future_a.result()
+        response_b, response_b_ms, usage_b = future_b.result()
+    else:
+        response_a, response_a_ms, usage_a = _timed_llm_response(args_a, bypass_cache, reserved=reserved)
+        response_b, response_b_ms, usage_b = _timed_llm_response(args_b, bypass_cache, reserved=reserved)
+
+    meta = {
+        'response_a_ms': response_a_ms,
+        'response_b_ms': response_b_ms,
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        'usage': {'a': usage_a, 'b': usage_b},
+    }
+    return response_a, response_b, meta
+
+
+def generate_response_batch(items):
+    """Generate pairs for many validated GenerateResponsesSerializer items.
+
+    All 2*N completions share one pool of LLM_BATCH_CONCURRENCY threads and the
+    worker's token-per-minute budget. Yields ``(index, result)`` as each pair
+    finishes, so callers can store it right away; ``result`` is
+    ``(response_a, response_b, meta)`` or the raised exception.
+    """
+    limiter = _get_batch_limiter()
+    finished = queue.Queue()
+    done_sides = {}
+    pending = 0
+
+    def finished_pairs(block):
+        nonlocal pending
+        while pending:
+            try:
+                index, side, future = finished.get(block=block)
+            except queue.Empty:
+                return
+            sides = done_sides.setdefault(index, {})
+            sides[side] = future
+            if len(sides) < 2:
+                continue
+            del done_sides[index]
+            pending -= 1
+            try:
+                response_a, response_a_ms, usage_a = sides['a'].result()
+                response_b, response_b_ms, usage_b = sides['b'].result()
+            except Exception as e:
+                yield index, e
+                continue
+            yield index, (response_a, response_b, {
+                'response_a_ms': response_a_ms,
+                'response_b_ms': response_b_ms,
+                'usage': {'a': usage_a, 'b': usage_b},
+            })
+
+    with ThreadPoolExecutor(max_workers=settings.LLM_BATCH_CONCURRENCY,
+                            thread_name_prefix='llm-batch') as executor:
+        for index, item in enumerate(items):
+            sides = [
+                (item['prompt'], item['model_name'],
+                 item[f'temperature_{side}'], item[f'max_tokens_{side}'], item[f'top_p_{side}'],
+                 item[f'frequency_penalty_{side}'], item[f'presence_penalty_{side}'])
+                for side in ('a', 'b')
+            ]
+            # Reserving here, in submission order, also paces the batch to the shared budget.
+            try:
+                reserved = _reserve_pair(*sides)
+            except Exception as e:
+                yield index, e
+                continue
+            pending += 1
+            for side, args in zip(('a', 'b'), sides):
+                future = executor.submit(_timed_llm_response, args, item['bypass_cache'], limiter, reserved)
+                future.add_done_callback(lambda future, index=index, side=side: finished.put((index, side, future)))
+            # Hand back pairs finished while later ones are still being paced.
+            yield from finished_pairs(block=False)
+        yield from finished_pairs(block=True)
+
+
+def _pump_stream(side, args, events, cancelled, bypass_cache, reserved=False):
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    cache = None if bypass_cache else get_completion_cache()
+    key = completion_key(*args) if cache else None
+    try:
+        cached = cache.get(key) if cache else None
+        deltas = [cached] if cached is not None else stream_llm_response(*args, reserved=reserved)
+        for delta in deltas:
+            if cancelled.is_set():
+                return
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+            parts.append(delta)
+            events.put(('delta', side, delta))
+    except Exception as e:
+        events.put(('error', side, e))
+        return
+    content = ''.join(parts)
+    if cache and cached is None:
+        cache.set(key, content)
+    events.put(('end', side, {
+        'content': content,
+        'first_token_ms': first_token_ms,
+        'ms': round((time.perf_counter() - started) * 1000, 1),
+        # Streams report no usage; count it locally.
+        'usage': estimated_usage(args[0], content, args[1]) if cached is None else None,
+    }))
+
+
+def stream_two_responses(prompt, model_name='gpt-3.5-turbo',
+                         temperature_a=0.7, max_tokens_a=500, top_p_a=1.0,
+                         frequency_penalty_a=0.0, presence_penalty_a=0.0,
+                         temperature_b=0.9, max_tokens_b=500, top_p_b=1.0,
+                         frequency_penalty_b=0.0, presence_penalty_b=0.0,
+                         bypass_cache=False):
+    """Stream both sides at once, yielding (kind, side, payload) as chunks arrive.
+
+    ``kind`` is ``'delta'`` with the next piece of text, or ``'end'`` with the
+    full content, timings and usage once that side finishes. The first error from
+    either side is raised and the other stream is abandoned.
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+    sides = {
+        'a': (prompt, model_name, temperature_a, max_tokens_a,
+              top_p_a, frequency_penalty_a, presence_penalty_a),
+        'b': (prompt, model_name, temperature_b, max_tokens_b,
+              top_p_b, frequency_penalty_b, presence_penalty_b),
+    }
+    reserved = _reserve_pair(sides['a'], sides['b'])
+    # Dedicated threads: streams are long-lived and must not starve the pair pool.
+    for side, args in sides.items():
+        threading.Thread(
+            target=_pump_stream, args=(side, args, events, cancelled, bypass_cache, reserved),
+            name=f'llm-stream-{side}', daemon=True
+        ).start()
+
+    remaining = len(sides)
+    try:
+        while remaining:
+            kind, side, payload = events.get()
+            if kind == 'error':
+                raise payload
+            if kind == 'end':
+                remaining -= 1
+            yield kind, side, payload
+    finally:
+        cancelled.set()
+
+
+async def agenerate_llm_response(prompt, model_name='gpt-3.5-turbo', temperature=0.7, max_tokens=500,
+                                 top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0, reserved=False):
+    content, _ = await acomplete_llm_response(prompt, model_name, temperature, max_tokens, top_p,
+                                              frequency_penalty, presence_penalty, reserved)
+    return content
+
+
+async def acomplete_llm_response(prompt, model_name='gpt-3.5-turbo', temperature=0.7, max_tokens=500,
+                                 top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0, reserved=False):
+    try:
+        backend = get_backend(model_name)
+        attempt = 0
+        while True:
+            if not reserved and backend.limiter is not None:
+                await backend.limiter.aacquire(1, prompt_tokens(prompt, model_name) + max_tokens)
+            reserved = False
+            started = time.perf_counter()
+            try:
+                content, usage = await backend.acomplete(
+                    backend.remote_model(model_name),
+                    [{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p,
+                    frequency_penalty=frequency_penalty,
+                    presence_penalty=presence_penalty
+                )
+                break
+            except Exception as e:
+                delay = await asyncio.to_thread(_retry_delay, backend, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+        _record_llm_success(model_name, started, usage)
+
+        return content, usage_document(usage)
+    except RateLimited:
+        raise
+    except Exception as e:
+        error_type = type(e).__name__
+        error_msg = str(e)
+        _record_llm_failure(model_name, f"{error_type}: {error_msg}")
+        raise Exception(f"{error_type}: {error_msg}")
+
+
+async def _atimed_llm_response(args, bypass_cache=False, reserved=False):
+    started = time.perf_counter()
+    cache = None if bypass_cache else get_completion_cache()
+    key = completion_key(*args) if cache else None
+    # The cache's Mongo tier is synchronous; keep it off the event loop.
+    content = await asyncio.to_thread(cache.get, key) if cache else None
+    usage = None
+    if content is None:
+        content, usage = await acomplete_llm_response(*args, reserved=reserved)
+        if cache:
+            await asyncio.to_thread(cache.set, key, content)
+    return content, round((time.perf_counter() - started) * 1000, 1), usage
+
+
+async def agenerate_two_responses(prompt, model_name='gpt-3.5-turbo',
+                                  temperature_a=0.7, max_tokens_a=500, top_p_a=1.0,
+                                  frequency_penalty_a=0.0, presence_penalty_a=0.0,
+                                  temperature_b=0.9, max_tokens_b=500, top_p_b=1.0,
+                                  frequency_penalty_b=0.0, presence_penalty_b=0.0,
+                                  bypass_cache=False):
+    args_a = (prompt, model_name, temperature_a, max_tokens_a,
+              top_p_a, frequency_penalty_a, presence_penalty_a)
+    args_b = (prompt, model_name, temperature_b, max_tokens_b,
+              top_p_b, frequency_penalty_b, presence_penalty_b)
+
+    started = time.perf_counter()
+    reserved = await _areserve_pair(args_a, args_b)
+    (response_a, response_a_ms, usage_a), (response_b, response_b_ms, usage_b) = await asyncio.gather(
+        _atimed_llm_response(args_a, bypass_cache, reserved),
+        _atimed_llm_response(args_b, bypass_cache, reserved),
     )
-    
-    return response_a, response_b
+    meta = {
+        'response_a_ms': response_a_ms,
+        'response_b_ms': response_b_ms,
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        'usage': {'a': usage_a, 'b': usage_b},
+    }
+    return response_a, response_b, meta
+
+
+async def astream_llm_response(prompt, model_name='gpt-3.5-turbo', temperature=0.7, max_tokens=500,
+                               top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0, reserved=False):
+    try:
+        backend = get_backend(model_name)
+        if not reserved and backend.limiter is not None:
+            await backend.limiter.aacquire(1, prompt_tokens(prompt, model_name) + max_tokens)
+        started = time.perf_counter()
+        async for delta in backend.astream(
+            backend.remote_model(model_name),
+            [{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty
+        ):
+            yield delta
+        _record_llm_success(model_name, started, None)
+    except RateLimited:
+        raise
+    except Exception as e:
+        error_type = type(e).__name__
+        error_msg = str(e)
+        _record_llm_failure(model_name, f"{error_type}: {error_msg}")
+        raise Exception(f"{error_type}: {error_msg}")
+
+
+
+async def _once(value):
+    yield value
+
+
+async def _apump_stream(side, args, events, bypass_cache, reserved=False):
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    cache = None if bypass_cache else get_completion_cache()
+    key = completion_key(*args) if cache else None
+    try:
+        cached = await asyncio.to_thread(cache.get, key) if cache else None
+        deltas = _once(cached) if cached is not None else astream_llm_response(*args, reserved=reserved)
+        async for delta in deltas:
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+            parts.append(delta)
+            await events.put(('delta', side, delta))
+    except Exception as e:
+        await events.put(('error', side, e))
+        return
+    content = ''.join(parts)
+    if cache and cached is None:
+        await asyncio.to_thread(cache.set, key, content)
+    await events.put(('end', side, {
+        'content': content,
+        'first_token_ms': first_token_ms,
+        'ms': round((time.perf_counter() - started) * 1000, 1),
+        'usage': estimated_usage(args[0], content, args[1]) if cached is None else None,
+    }))
+
+
+async def astream_two_responses(prompt, model_name='gpt-3.5-turbo',
+                                temperature_a=0.7, max_tokens_a=500, top_p_a=1.0,
+                                frequency_penalty_a=0.0, presence_penalty_a=0.0,
+                                temperature_b=0.9, max_tokens_b=500, top_p_b=1.0,
+                                frequency_penalty_b=0.0, presence_penalty_b=0.0,
+                                bypass_cache=False):
+    """stream_two_responses() with both sides as tasks on the running event loop."""
+    events = asyncio.Queue()
+    sides = {
+        'a': (prompt, model_name, temperature_a, max_tokens_a,
+              top_p_a, frequency_penalty_a, presence_penalty_a),
+        'b': (prompt, model_name, temperature_b, max_tokens_b,
+              top_p_b, frequency_penalty_b, presence_penalty_b),
+    }
+    reserved = await _areserve_pair(sides['a'], sides['b'])
+    tasks = [
+        asyncio.create_task(_apump_stream(side, args, events, bypass_cache, reserved))
+        for side, args in sides.items()
+    ]
+
+    remaining = len(sides)
+    try:
+        while remaining:
+            kind, side, payload = await events.get()
+            if kind == 'error':
+                raise payload
+            if kind == 'end':
+                remaining -= 1
+            yield kind, side, payload
+    finally:
+        for task in tasks:
+            task.cancel()
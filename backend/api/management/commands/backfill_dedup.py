@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from api.dedup import fingerprint
+from api.mongo import get_collection
+from api.storage import expand_documents, storage_projection
+
+
+class Command(BaseCommand):
+    help = 'Store dedup fingerprints (exact hash, MinHash signature, LSH bands) on api_prompt documents.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute documents that already have a fingerprint.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        collection = get_collection()
+        query = {} if options['all'] else {'dedup_hash': {'$exists': False}}
+        batch_size = options['batch_size']
+        cursor = collection.find(query, storage_projection({'prompt_text': 1})).sort('_id', 1).batch_size(batch_size)
+
+        started = time.perf_counter()
+        updated = 0
+        operations = []
+        for doc in expand_documents(cursor, batch_size):
+            operations.append(UpdateOne({'_id': doc['_id']}, {'$set': fingerprint(doc.get('prompt_text'))}))
+            if len(operations) >= batch_size:
+                updated += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+
+        elapsed = time.perf_counter() - started
+        rate = updated / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f'Fingerprinted {updated} documents in {elapsed:.1f}s ({rate:.0f}/s).'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from api.mongo import get_collection
+from api.storage import TEXTS_COLLECTION, migrate_documents, storage_stats
+
+
+class Command(BaseCommand):
+    help = 'Rewrite api_prompt documents into the compact storage layout (or back with --expand).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expand', action='store_true', help='Convert compact documents back to the flat layout.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only report the sizes a migration would produce.')
+
+    def write_stats(self, label, collections):
+        for collection in collections:
+            stats = storage_stats(collection)
+            if stats is None:
+                self.stdout.write(f'{label} {collection.name}: collStats unavailable')
+                continue
+            self.stdout.write(f'{label} {collection.name}: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+    def handle(self, *args, **options):
+        collections = [get_collection(), get_collection(TEXTS_COLLECTION)]
+        self.write_stats('before', collections)
+
+        result = migrate_documents(
+            collections[0],
+            compact=not options['expand'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        for field, value in result.items():
+            self.stdout.write(f'{field}: {value}')
+        if result['bytes_before']:
+            after = result['bytes_after'] + result['text_bytes']
+            self.stdout.write(f"document bytes: {after / result['bytes_before']:.1%} of before")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Dry run; nothing was written.'))
+            return
+        self.write_stats('after', collections)
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(
+                f"{result['skipped']} documents changed during the run; run the command again to convert them."
+            ))
+        self.stdout.write(self.style.SUCCESS('Storage migration finished.'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.indexes import ensure_indexes, explain_hot_queries, missing_indexes
+from api.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = 'Create the api_prompt indexes, or check them and the hot query plans with --check.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Do not create anything; fail if an index is missing or a hot query falls back to COLLSCAN '
+                 'or an in-memory SORT.',
+        )
+
+    def handle(self, *args, **options):
+        collection = get_collection()
+
+        if not options['check']:
+            for name in ensure_indexes(collection):
+                self.stdout.write(f'ensured {name}')
+            return
+
+        problems = [f'missing index {name}' for name in missing_indexes(collection)]
+        for query, stages in explain_hot_queries(collection).items():
+            self.stdout.write(f'{query}: {", ".join(stages)}')
+            if 'COLLSCAN' in stages:
+                problems.append(f'{query} uses COLLSCAN')
+            if 'SORT' in stages:
+                problems.append(f'{query} sorts in memory')
+
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('All indexes present and no hot query uses COLLSCAN or an in-memory SORT.'))
@@ -0,0 +1,47 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from api.incremental_export import DEDUP_ACTIONS, FORMATS, IncrementalExport
+from api.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = 'Append preference pairs recorded since the last run to sharded files in a directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Export directory; its state.sqlite3 keeps the high-water mark.')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='jsonl')
+        parser.add_argument('--shard-size', type=int, default=50000, help='Maximum rows per shard file.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dedup',
+            choices=DEDUP_ACTIONS,
+            help='drop: skip near duplicates of exported pairs; cluster: tag rows with a cluster id.',
+        )
+        parser.add_argument(
+            '--settle-seconds',
+            type=int,
+            default=60,
+            help='Skip votes newer than this, so writes still in flight are not passed by the high-water mark.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            export = IncrementalExport(
+                options['directory'],
+                output_format=options['format'],
+                shard_size=options['shard_size'],
+                settle_seconds=options['settle_seconds'],
+                dedup=options['dedup'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        try:
+            result = export.run(get_collection(), batch_size=options['batch_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        finally:
+            export.close()
+        for field, value in result.items():
+            self.stdout.write(f'{field}: {value}')
+        self.stdout.write(self.style.SUCCESS(f"Export run {result['run']} written to {options['directory']}."))
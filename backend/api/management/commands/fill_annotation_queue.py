@@ -0,0 +1,71 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.annotation import fill_queue
+from api.jobs import JOB_PENDING, JOB_RUNNING, run_worker
+from api.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue prompts from a file (JSONL objects, JSON strings or plain text, one per line) for '
+        'annotation, keeping --target unvoted pairs buffered. Pairs are generated by '
+        'run_generation_workers, or by --workers started here.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--target', type=int, default=settings.ANNOTATION_QUEUE_TARGET,
+                            help='Unvoted pairs to keep buffered.')
+        parser.add_argument('--prompt-field', default='prompt', help='Key holding the prompt in JSON objects.')
+        parser.add_argument('--model-name', help='Model for lines that do not name one.')
+        parser.add_argument('--watch', action='store_true', help='Keep topping the queue up until interrupted.')
+        parser.add_argument('--interval', type=float, default=10.0, help='Seconds between top-ups with --watch.')
+        parser.add_argument('--workers', type=int, default=0, help='Generation workers to run in this process.')
+
+    def handle(self, *args, **options):
+        if options['target'] < 1:
+            raise CommandError('--target must be at least 1')
+        defaults = {'model_name': options['model_name']} if options['model_name'] else {}
+        collection = get_collection()
+
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+        threads = []
+        for index in range(options['workers']):
+            thread = threading.Thread(target=run_worker, args=(stop,), name=f'generation-worker-{index}')
+            thread.start()
+            threads.append(thread)
+
+        try:
+            while True:
+                try:
+                    result = fill_queue(collection, options['path'], options['target'],
+                                        prompt_field=options['prompt_field'], defaults=defaults)
+                except OSError as e:
+                    raise CommandError(str(e))
+                if result['queued'] or result['invalid'] or not options['watch']:
+                    self.stdout.write(
+                        f"queued {result['queued']}, skipped {result['invalid']} invalid lines; "
+                        f"{result['depth']} pairs buffered" + (' (end of file)' if result['exhausted'] else '')
+                    )
+                if not options['watch'] or stop.wait(options['interval']):
+                    break
+            # Without --watch, in-process workers finish the queued jobs before exiting.
+            while threads and not stop.is_set() and _generating(collection):
+                stop.wait(1)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(self.style.SUCCESS('Annotation queue filled.'))
+
+
+def _generating(collection):
+    return collection.count_documents(
+        {'annotation_queue': True, 'job_status': {'$in': [JOB_PENDING, JOB_RUNNING]}}, limit=1
+    ) > 0
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import backfill_content_hashes, import_records, iter_records
+from api.indexes import CONTENT_HASH_INDEX
+from api.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = (
+        'Import preference datasets ({prompt, chosen, rejected, metadata} rows in .json, .jsonl '
+        'or their .gz) into api_prompt, skipping pairs that are already there.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--format', choices=['json', 'jsonl'], help='Override the format implied by the extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--progress-every', type=int, default=100000, help='Print progress every N rows.')
+
+    def handle(self, *args, **options):
+        collection = get_collection()
+        collection.create_indexes([CONTENT_HASH_INDEX])
+        started = time.perf_counter()
+        hashed = backfill_content_hashes(collection, options['batch_size'])
+        if hashed:
+            self.stdout.write(f'hashed {hashed} existing documents in {time.perf_counter() - started:.1f}s')
+
+        totals = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0}
+        started = time.perf_counter()
+        reported = [0]
+        for path in options['paths']:
+
+            def progress(result):
+                rows = totals['rows'] + result['rows']
+                if rows - reported[0] >= options['progress_every']:
+                    reported[0] = rows
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f'{rows} rows, {totals["inserted"] + result["inserted"]} inserted '
+                                      f'({rows / elapsed:.0f} rows/s)')
+
+            try:
+                result = import_records(iter_records(path, options['format']), options['batch_size'], progress)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'{path}: {e}')
+            self.stdout.write(f"{path}: {result['rows']} rows, {result['inserted']} inserted, "
+                              f"{result['duplicates']} duplicates, {result['invalid']} invalid")
+            for key, value in result.items():
+                totals[key] += value
+
+        elapsed = time.perf_counter() - started
+        rate = totals['rows'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['inserted']} of {totals['rows']} rows in {elapsed:.1f}s ({rate:.0f} rows/s)."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.mongo import get_collection
+from api.stats import reconcile_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the api_counters stats document from a full aggregation of api_prompt.'
+
+    def handle(self, *args, **options):
+        counts = reconcile_counts(get_collection())
+        for field, value in counts.items():
+            self.stdout.write(f'{field}: {value}')
+        self.stdout.write(self.style.SUCCESS('Stats counters reconciled.'))
@@ -0,0 +1,30 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Process pending generation jobs from api_prompt until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Jobs processed concurrently.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        threads = []
+        for index in range(options['workers']):
+            thread = threading.Thread(target=run_worker, args=(stop,), name=f'generation-worker-{index}')
+            thread.start()
+            threads.append(thread)
+        self.stdout.write(f"Started {options['workers']} generation workers.")
+
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+        self.stdout.write(self.style.SUCCESS('Generation workers stopped.'))
@@ -0,0 +1,183 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from pymongo import monitoring
+
+# Minimal in-process Prometheus registry. Every gunicorn/uvicorn worker keeps
+# its own series, so a scrape of /metrics reports the worker that answered it.
+# With METRICS_ENABLED off, each hook is a single settings lookup.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def enabled():
+    return settings.METRICS_ENABLED
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labels, key)} {value}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(self.labels, key, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, key)} {round(total, 6)}'
+            yield f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}'
+
+
+@contextmanager
+def timed(histogram, **labels):
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+LLM_REQUEST_SECONDS = Histogram(
+    'llm_request_seconds', 'OpenAI chat completion latency.', ('model', 'outcome'),
+)
+LLM_TOKENS = Counter(
+    'llm_tokens_total', 'Tokens reported in response.usage.', ('model', 'kind'),
+)
+LLM_ERRORS = Counter(
+    'llm_errors_total', 'Failed completions by error class.', ('model', 'error_class'),
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    'mongo_command_seconds', 'MongoDB command latency as seen by pymongo.', ('collection', 'command', 'outcome'),
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    'mongo_pool_connections', 'Connections in the pymongo pool per server, open and checked out.',
+    ('address', 'state'),
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    'mongo_pool_checkout_failures_total', 'Connection check-outs that failed, by reason.', ('address', 'reason'),
+)
+TOKEN_BUDGET_REJECTIONS = Counter(
+    'token_budget_rejections_total', 'Generate requests refused by a token budget, by scope.', ('scope',),
+)
+API_VIEW_SECONDS = Histogram(
+    'api_view_seconds', 'Prompt API time per action, split into handler and response rendering.',
+    ('action', 'method', 'status', 'stage'),
+)
+
+
+def record_usage(model_name, usage):
+    if not settings.METRICS_ENABLED or usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model_name, kind='prompt')
+    LLM_TOKENS.inc(usage.completion_tokens or 0, model=model_name, kind='completion')
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command on the API's pymongo client, including getMore."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        key = 'collection' if event.command_name == 'getMore' else event.command_name
+        value = event.command.get(key)
+        self._collections[(event.connection_id, event.request_id)] = value if isinstance(value, str) else ''
+
+    def _finish(self, event, outcome):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6,
+            collection=collection, command=event.command_name, outcome=outcome,
+        )
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'error')
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+
+import pymongo
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import ReadPreference
+
+from . import metrics
+
+# One MongoClient per process, shared by the API's pymongo paths and by
+# Django's own tables when USE_DJONGO (api.djongo_backend). A client must not
+# cross a fork: under gunicorn's pre-fork model anything created in the master
+# (an AppConfig.ready() index check, --preload) is dropped in each worker,
+# which then builds its own on first use. Pool size, timeouts, write concern
+# and wire compression come from the MONGODB_* settings; a readPreference in
+# MONGODB_URI still applies to everything else. get_read_collection()
+# applies MONGODB_ANALYTICS_READ_PREFERENCE, so stats, analytics and the export
+# endpoints can read from secondaries while every write goes to the primary.
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Open and checked-out connections per server, for health() and /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _update(self, address, **changes):
+        address = '%s:%s' % address
+        with self._lock:
+            pool = self._pools.setdefault(address, {'open': 0, 'in_use': 0, 'checkout_failures': 0})
+            for key, change in changes.items():
+                pool[key] += change
+            snapshot = dict(pool)
+        metrics.MONGO_POOL_CONNECTIONS.set(snapshot['open'], address=address, state='open')
+        metrics.MONGO_POOL_CONNECTIONS.set(snapshot['in_use'], address=address, state='in_use')
+
+    def snapshot(self):
+        with self._lock:
+            return {address: dict(pool) for address, pool in self._pools.items()}
+
+    def pool_created(self, event):
+        self._update(event.address)
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event.address, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, checkout_failures=1)
+        metrics.MONGO_POOL_CHECKOUT_FAILURES.inc(address='%s:%s' % event.address, reason=event.reason)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, in_use=-1)
+
+
+_pool_stats = PoolStats()
+
+
+def _forget_client():
+    # Runs in the child right after fork(); the parent's client (and a lock
+    # another thread may have held) are unusable there.
+    global _client, _client_lock, _pool_stats
+    _client = None
+    _client_lock = threading.Lock()
+    _pool_stats = PoolStats()
+
+
+os.register_at_fork(after_in_child=_forget_client)
+
+
+def client_options():
+    options = {
+        'maxPoolSize': settings.MONGODB_MAX_POOL_SIZE,
+        'minPoolSize': settings.MONGODB_MIN_POOL_SIZE,
+        'serverSelectionTimeoutMS': settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        'connectTimeoutMS': settings.MONGODB_CONNECT_TIMEOUT_MS,
+        'socketTimeoutMS': settings.MONGODB_SOCKET_TIMEOUT_MS,
+        'retryWrites': settings.MONGODB_RETRY_WRITES,
+    }
+    # 0 leaves these unlimited (pymongo rejects an explicit 0).
+    if settings.MONGODB_MAX_IDLE_TIME_MS:
+        options['maxIdleTimeMS'] = settings.MONGODB_MAX_IDLE_TIME_MS
+    if settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS:
+        options['waitQueueTimeoutMS'] = settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS
+    if settings.MONGODB_WRITE_CONCERN:
+        w = settings.MONGODB_WRITE_CONCERN
+        options['w'] = int(w) if w.isdigit() else w
+    if settings.MONGODB_WRITE_TIMEOUT_MS:
+        options['wTimeoutMS'] = settings.MONGODB_WRITE_TIMEOUT_MS
+    if settings.MONGODB_COMPRESSORS:
+        # pymongo warns about and skips compressors whose module is missing
+        # (zstd needs zstandard, snappy python-snappy).
+        options['compressors'] = settings.MONGODB_COMPRESSORS
+    return options
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                listeners = [_pool_stats]
+                if settings.METRICS_ENABLED:
+                    listeners.append(metrics.MongoCommandMetrics())
+                _client = pymongo.MongoClient(settings.MONGODB_URI, event_listeners=listeners, **client_options())
+    return _client
+
+
+def get_database():
+    return get_client()[settings.MONGODB_NAME]
+
+
+def get_collection(name='api_prompt'):
+    return get_database()[name]
+
+
+def get_read_collection(name='api_prompt'):
+    """``name`` for reads that tolerate replication lag (stats, analytics, exports)."""
+    read_preference = READ_PREFERENCES.get(settings.MONGODB_ANALYTICS_READ_PREFERENCE)
+    if read_preference is None:
+        raise ImproperlyConfigured(f'MONGODB_ANALYTICS_READ_PREFERENCE must be one of {sorted(READ_PREFERENCES)}')
+    return get_collection(name).with_options(read_preference=read_preference)
+
+
+def health():
+    """Ping the deployment; returns ``(ok, details)`` with round trip, topology and pool use."""
+    client = get_client()
+    details = {}
+    started = time.perf_counter()
+    try:
+        client.admin.command('ping')
+        details['ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        details['primary'] = '%s:%s' % client.primary if client.primary else None
+        details['secondaries'] = sorted('%s:%s' % address for address in client.secondaries)
+    except PyMongoError as e:
+        details['error'] = str(e)
+    pools = _pool_stats.snapshot()
+    for pool in pools.values():
+        pool['utilization'] = round(pool['in_use'] / settings.MONGODB_MAX_POOL_SIZE, 3)
+    details.update(pool=pools, max_pool_size=settings.MONGODB_MAX_POOL_SIZE)
+    return 'error' not in details, details
@@ -0,0 +1,72 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+# Keyset pagination for GET /api/prompts/: newest first on (created_at, _id),
+# served by the created_at_-1__id_-1 index. The cursor is the sort key of the
+# last row of a page, so a page costs one index range scan however deep it is,
+# and rows inserted meanwhile never shift later pages. Legacy documents with a
+# missing or null created_at sort after every dated one (MongoDB orders null
+# lowest), so a cursor may carry a null created_at and every dated cursor's
+# query still reaches them.
+
+LIST_VIEWS = ('full', 'summary')
+
+
+def encode_cursor(document):
+    created_at = document.get('created_at')
+    key = [created_at.isoformat() if created_at else None, str(document['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, object_id = json.loads(raw)
+        return datetime.fromisoformat(created_at) if created_at is not None else None, ObjectId(object_id)
+    except (binascii.Error, ValueError, TypeError, InvalidId):
+        raise ValueError('Invalid cursor.')
+
+
+def page_query(cursor):
+    if cursor is None:
+        return {}
+    created_at, object_id = cursor
+    # {'created_at': None} matches both null and missing.
+    if created_at is None:
+        return {'created_at': None, '_id': {'$lt': object_id}}
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': object_id}},
+        {'created_at': None},
+    ]}
+
+
+def parse_list_params(params, allowed_fields):
+    """Return (cursor, limit, view, fields) from list query params or raise ValueError.
+
+    ``allowed_fields`` maps each view to the field names ``fields=`` may pick from.
+    """
+    cursor = params.get('cursor')
+    cursor = decode_cursor(cursor) if cursor else None
+    try:
+        limit = int(params.get('limit') or settings.PROMPT_LIST_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('limit must be an integer.')
+    if not 1 <= limit <= settings.PROMPT_LIST_MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {settings.PROMPT_LIST_MAX_PAGE_SIZE}.')
+    view = params.get('view') or 'full'
+    if view not in LIST_VIEWS:
+        raise ValueError(f'view must be one of {", ".join(LIST_VIEWS)}.')
+    fields = None
+    if params.get('fields'):
+        fields = [field.strip() for field in params['fields'].split(',') if field.strip()]
+        unknown = sorted(set(fields) - set(allowed_fields[view]))
+        if unknown:
+            raise ValueError(f'Unknown fields for the {view} view: {", ".join(unknown)}')
+    return cursor, limit, view, fields
@@ -0,0 +1,183 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone as tz
+from email.utils import parsedate_to_datetime
+
+import openai
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError
+
+from .mongo import get_collection
+
+
+def estimate_tokens(text):
+    # Rough English average of ~4 characters per token; good enough for budgeting.
+    return len(text) // 4 + 1
+
+
+class TokenRateLimiter:
+    """Sliding one-minute token budget shared by the threads of one worker.
+
+    Like SharedRateLimiter, acquire() waits at most LLM_RATE_LIMIT_MAX_WAIT
+    seconds and then raises RateLimited.
+    """
+
+    window = 60.0
+
+    def __init__(self, tokens_per_minute):
+        self.tokens_per_minute = tokens_per_minute
+        self._spent = deque()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        if not self.tokens_per_minute:
+            return
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._spent and now - self._spent[0][0] >= self.window:
+                    self._used -= self._spent.popleft()[1]
+                if self._used + tokens <= self.tokens_per_minute:
+                    self._spent.append((now, tokens))
+                    self._used += tokens
+                    return
+                wait = self.window - (now - self._spent[0][0])
+            if waited + wait > settings.LLM_RATE_LIMIT_MAX_WAIT:
+                raise RateLimited(wait)
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimited(Exception):
+    """The shared budget cannot cover a call within LLM_RATE_LIMIT_MAX_WAIT."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limit budget exhausted; retry in {retry_after:.1f}s')
+        self.retry_after = retry_after
+
+
+class SharedRateLimiter:
+    """Requests- and tokens-per-minute token buckets shared by every worker through Mongo.
+
+    A backend's buckets are one api_rate_limits document holding the requests
+    and tokens still available and when they were last refilled; both refill
+    continuously at the per-minute rate, up to one minute's worth. A
+    reservation is a single upsert whose $expr filter only matches when both
+    buckets, refilled to now, cover the call and whose pipeline update refills
+    and takes in the same step, so a pair is reserved all-or-nothing. When it
+    does not fit, the upsert collides with the existing document (duplicate
+    key) and one read tells how long the refill takes. A ``retry-after`` from
+    the provider sets blocked_until on the buckets.
+
+    Callers wait at most LLM_RATE_LIMIT_MAX_WAIT seconds; past that acquire()
+    raises RateLimited so a request gets a 429 instead of outliving its worker.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, jitter=0.5):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.jitter = jitter
+
+    def _budgets(self, requests, tokens):
+        budgets = []
+        if self.requests_per_minute:
+            budgets.append(('requests', min(requests, self.requests_per_minute), self.requests_per_minute))
+        if self.tokens_per_minute:
+            budgets.append(('tokens', min(tokens, self.tokens_per_minute), self.tokens_per_minute))
+        return budgets
+
+    def _attempt(self, requests, tokens):
+        """Reserve and return 0, or return the seconds to wait before trying again."""
+        collection = get_collection('api_rate_limits')
+        now = time.time()
+        budgets = self._budgets(requests, tokens)
+        fits = [{'$lte': [{'$ifNull': ['$blocked_until', 0]}, now]}]
+        take = {'refilled_at': now}
+        for field, amount, per_minute in budgets:
+            # A new document starts with full buckets.
+            available = {'$min': [per_minute, {'$add': [
+                {'$ifNull': [f'${field}', per_minute]},
+                {'$multiply': [{'$subtract': [now, {'$ifNull': ['$refilled_at', now]}]}, per_minute / 60]},
+            ]}]}
+            fits.append({'$gte': [available, amount]})
+            take[field] = {'$subtract': [available, amount]}
+        try:
+            collection.update_one({'_id': self.name, '$expr': {'$and': fits}}, [{'$set': take}], upsert=True)
+            return 0
+        except DuplicateKeyError:
+            pass
+
+        bucket = collection.find_one({'_id': self.name}) or {}
+        elapsed = now - bucket.get('refilled_at', now)
+        waits = [bucket.get('blocked_until', 0) - now]
+        for field, amount, per_minute in budgets:
+            available = min(per_minute, bucket.get(field, per_minute) + elapsed * per_minute / 60)
+            waits.append((amount - available) * 60 / per_minute)
+        # Spread the herd waiting on the same refill.
+        return max(max(waits), 0.01) + random.uniform(0, self.jitter)
+
+    def acquire(self, requests=1, tokens=0):
+        waited = 0.0
+        while True:
+            wait = self._attempt(requests, tokens)
+            if not wait:
+                return
+            if waited + wait > settings.LLM_RATE_LIMIT_MAX_WAIT:
+                raise RateLimited(wait)
+            time.sleep(wait)
+            waited += wait
+
+    async def aacquire(self, requests=1, tokens=0):
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self._attempt, requests, tokens)
+            if not wait:
+                return
+            if waited + wait > settings.LLM_RATE_LIMIT_MAX_WAIT:
+                raise RateLimited(wait)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def block(self, seconds):
+        get_collection('api_rate_limits').update_one(
+            {'_id': self.name}, {'$max': {'blocked_until': time.time() + seconds}}, upsert=True
+        )
+
+
+def retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(tz.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def backoff_delay(attempt, base, cap):
+    # "Full jitter": uniform over the exponential envelope.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
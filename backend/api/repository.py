@@ -0,0 +1,132 @@
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from . import dedup
+from .mongo import get_collection
+from .pagination import page_query
+from .storage import (
+    COMPACT,
+    compact_document,
+    compact_documents,
+    compact_update,
+    expand_document,
+    expand_documents,
+    storage_projection,
+)
+
+# Model-level defaults from api.models.Prompt, applied to directly created documents.
+PROMPT_DEFAULTS = {
+    'model_name': 'gpt-3.5-turbo',
+    'temperature': 0.7,
+    'temperature_a': 0.7,
+    'max_tokens_a': 500,
+    'top_p_a': 1.0,
+    'frequency_penalty_a': 0.0,
+    'presence_penalty_a': 0.0,
+    'temperature_b': 0.9,
+    'max_tokens_b': 500,
+    'top_p_b': 1.0,
+    'frequency_penalty_b': 0.0,
+    'presence_penalty_b': 0.0,
+    'response_a_generated_at': None,
+    'response_b_generated_at': None,
+    'preference': None,
+    'preference_recorded_at': None,
+}
+
+
+def build_prompt_document(data, response_a, response_b, now, usage=None):
+    # usage: {'a': ..., 'b': ...} token counts per side, as from generate_two_responses()
+    usage = usage or {}
+    return {
+        '_id': ObjectId(),
+        'prompt_text': data['prompt'],
+        'response_a': response_a,
+        'response_b': response_b,
+        'model_name': data['model_name'],
+        'temperature': (data['temperature_a'] + data['temperature_b']) / 2,
+        'temperature_a': data['temperature_a'],
+        'max_tokens_a': data['max_tokens_a'],
+        'top_p_a': data['top_p_a'],
+        'frequency_penalty_a': data['frequency_penalty_a'],
+        'presence_penalty_a': data['presence_penalty_a'],
+        'temperature_b': data['temperature_b'],
+        'max_tokens_b': data['max_tokens_b'],
+        'top_p_b': data['top_p_b'],
+        'frequency_penalty_b': data['frequency_penalty_b'],
+        'presence_penalty_b': data['presence_penalty_b'],
+        'response_a_generated_at': now,
+        'response_b_generated_at': now,
+        'usage_a': usage.get('a'),
+        'usage_b': usage.get('b'),
+        'preference': None,
+        'preference_recorded_at': None,
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+def get_prompt(object_id, projection=None):
+    return expand_document(get_collection().find_one({'_id': object_id}, storage_projection(projection)))
+
+
+def list_prompt_page(projection=None, cursor=None, limit=50):
+    """Up to ``limit`` documents after ``cursor`` (see api.pagination), newest first."""
+    if projection is not None:
+        projection = dict(projection, created_at=1)
+    documents = get_collection().find(page_query(cursor), storage_projection(projection)).sort(
+        [('created_at', -1), ('_id', -1)]
+    ).limit(limit)
+    return list(expand_documents(documents, limit))
+
+
+def insert_prompt(document):
+    """Insert ``document`` (flat layout) and return it."""
+    if dedup.enabled():
+        document.update(dedup.fingerprint(document.get('prompt_text')))
+    stored = compact_document(document) if settings.COMPACT_STORAGE_ENABLED else document
+    get_collection().insert_one(stored)
+    return document
+
+
+def insert_prompts(documents):
+    if not documents:
+        return documents
+    if dedup.enabled():
+        for document in documents:
+            document.update(dedup.fingerprint(document.get('prompt_text')))
+    stored = compact_documents(documents) if settings.COMPACT_STORAGE_ENABLED else documents
+    get_collection().insert_many(stored, ordered=False)
+    return documents
+
+
+def update_prompt(object_id, fields):
+    """Apply ``fields`` and return the document as it was before, or None."""
+    fields = dict(fields, updated_at=timezone.now())
+    if 'prompt_text' in fields and dedup.enabled():
+        fields.update(dedup.fingerprint(fields['prompt_text']))
+    # The filter pins the layout the update was translated for; try the
+    # configured layout first, so a mixed collection costs one extra round trip
+    # only for documents not yet migrated.
+    compact_first = settings.COMPACT_STORAGE_ENABLED
+    for compact in (compact_first, not compact_first):
+        if compact:
+            set_fields, unset_fields = compact_update(fields)
+            update = {'$set': set_fields, **({'$unset': unset_fields} if unset_fields else {})}
+        else:
+            update = {'$set': fields}
+        previous = get_collection().find_one_and_update(
+            {'_id': object_id, 'storage': COMPACT if compact else {'$ne': COMPACT}},
+            update,
+            return_document=ReturnDocument.BEFORE
+        )
+        if previous is not None:
+            return expand_document(previous)
+    return None
+
+
+def delete_prompt(object_id):
+    """Delete the document and return it, or None if it did not exist."""
+    return get_collection().find_one_and_delete({'_id': object_id})
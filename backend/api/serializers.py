@@ -1,12 +1,79 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Prompt
 
+from .tokens import prompt_tokens
 
-class PromptSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Prompt
-        fields = '__all__'
-        read_only_fields = ['created_at', 'updated_at', 'response_a_generated_at', 'response_b_generated_at']
+
+class FieldsMixin:
+    """Accepts ``fields=[...]`` to serialize only those fields (plus _id)."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields) - {'_id'}:
+                self.fields.pop(name)
+
+
+# Mirrors api.models.Prompt field for field, but works on raw api_prompt
+# documents so the request path never goes through djongo.
+class PromptSerializer(FieldsMixin, serializers.Serializer):
+    _id = serializers.CharField(read_only=True)
+    prompt_text = serializers.CharField(style={'base_template': 'textarea.html'})
+    response_a = serializers.CharField(style={'base_template': 'textarea.html'})
+    response_b = serializers.CharField(style={'base_template': 'textarea.html'})
+
+    model_name = serializers.CharField(max_length=100, required=False)
+    temperature = serializers.FloatField(required=False)
+
+    temperature_a = serializers.FloatField(required=False)
+    max_tokens_a = serializers.IntegerField(required=False)
+    top_p_a = serializers.FloatField(required=False)
+    frequency_penalty_a = serializers.FloatField(required=False)
+    presence_penalty_a = serializers.FloatField(required=False)
+
+    temperature_b = serializers.FloatField(required=False)
+    max_tokens_b = serializers.IntegerField(required=False)
+    top_p_b = serializers.FloatField(required=False)
+    frequency_penalty_b = serializers.FloatField(required=False)
+    presence_penalty_b = serializers.FloatField(required=False)
+
+    response_a_generated_at = serializers.DateTimeField(allow_null=True, read_only=True)
+    response_b_generated_at = serializers.DateTimeField(allow_null=True, read_only=True)
+    usage_a = serializers.DictField(allow_null=True, read_only=True)
+    usage_b = serializers.DictField(allow_null=True, read_only=True)
+
+    preference = serializers.ChoiceField(
+        choices=[('A', 'Response A'), ('B', 'Response B'), ('TIE', 'Tie')],
+        allow_null=True,
+        allow_blank=True,
+        required=False
+    )
+    preference_recorded_at = serializers.DateTimeField(allow_null=True, required=False)
+
+    created_at = serializers.DateTimeField(allow_null=True, read_only=True)
+    updated_at = serializers.DateTimeField(allow_null=True, read_only=True)
+
+
+# Row of a history view: no responses or parameters, prompt_text cut to
+# PROMPT_SUMMARY_CHARS characters.
+class PromptSummarySerializer(FieldsMixin, serializers.Serializer):
+    _id = serializers.CharField(read_only=True)
+    prompt_text = serializers.SerializerMethodField()
+    prompt_truncated = serializers.SerializerMethodField()
+    model_name = serializers.CharField(read_only=True)
+    preference = serializers.CharField(allow_null=True, read_only=True)
+    preference_recorded_at = serializers.DateTimeField(allow_null=True, read_only=True)
+    created_at = serializers.DateTimeField(allow_null=True, read_only=True)
+    updated_at = serializers.DateTimeField(allow_null=True, read_only=True)
+
+    # Stored fields each output field is built from
+    SOURCE_FIELDS = {'prompt_truncated': 'prompt_text'}
+
+    def get_prompt_text(self, document):
+        return (document.get('prompt_text') or '')[:settings.PROMPT_SUMMARY_CHARS]
+
+    def get_prompt_truncated(self, document):
+        return len(document.get('prompt_text') or '') > settings.PROMPT_SUMMARY_CHARS
 
 
 class GenerateResponsesSerializer(serializers.Serializer):
@@ -25,11 +92,34 @@ class GenerateResponsesSerializer(serializers.Serializer):
     frequency_penalty_b = serializers.FloatField(default=0.0, min_value=-2.0, max_value=2.0)
     presence_penalty_b = serializers.FloatField(default=0.0, min_value=-2.0, max_value=2.0)
 
+    bypass_cache = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if settings.PROMPT_MAX_TOKENS:
+            tokens = prompt_tokens(data['prompt'], data['model_name'])
+            if tokens > settings.PROMPT_MAX_TOKENS:
+                raise serializers.ValidationError(
+                    {'prompt': f'Prompt is {tokens} tokens; the limit is {settings.PROMPT_MAX_TOKENS}.'}
+                )
+        return data
+
+
+class GenerateBatchSerializer(serializers.Serializer):
+    items = GenerateResponsesSerializer(many=True, allow_empty=False, max_length=settings.LLM_BATCH_MAX_ITEMS)
+
 
 class RecordPreferenceSerializer(serializers.Serializer):
     preference = serializers.ChoiceField(choices=['A', 'B', 'TIE'], required=True)
 
 
+class BulkPreferenceItemSerializer(RecordPreferenceSerializer):
+    id = serializers.CharField(required=True)
+
+
+class BulkRecordPreferenceSerializer(serializers.Serializer):
+    items = BulkPreferenceItemSerializer(many=True, allow_empty=False, max_length=settings.BULK_PREFERENCE_MAX_ITEMS)
+
+
 class TrainingDataSerializer(serializers.Serializer):
     prompt = serializers.CharField()
     chosen = serializers.CharField()
@@ -0,0 +1,123 @@
+import time
+
+from django.conf import settings
+from pymongo.errors import OperationFailure
+
+from .mongo import get_collection
+
+COUNTERS_ID = 'api_prompt'
+PREFERENCE_COUNTERS = {'A': 'preference_a', 'B': 'preference_b', 'TIE': 'ties'}
+COUNTER_FIELDS = ('total_prompts', 'preference_a', 'preference_b', 'ties')
+
+STATS_GROUP = {'$group': {'_id': '$preference', 'count': {'$sum': 1}}}
+# With the (preference, ...) index (see api.indexes), a leading $sort hinted to
+# it lets the planner answer the $group from the index alone. Without it the
+# $sort would be an in-memory sort of the whole collection, so the plain $group
+# runs instead. Index existence is looked up once per process, and again
+# STATS_INDEX_RECHECK_SECONDS after finding it missing.
+STATS_INDEX = 'preference_1_preference_recorded_at_1'
+STATS_INDEX_RECHECK_SECONDS = 60
+
+_stats_index = {'exists': False, 'checked_at': None}
+
+
+def _stats_index_exists(collection):
+    checked_at = _stats_index['checked_at']
+    if checked_at is None or (not _stats_index['exists']
+                              and time.monotonic() - checked_at > STATS_INDEX_RECHECK_SECONDS):
+        _stats_index.update(exists=STATS_INDEX in collection.index_information(), checked_at=time.monotonic())
+    return _stats_index['exists']
+
+
+def stats_aggregation(collection):
+    """Return ``(pipeline, options)`` for the per-preference counts."""
+    if _stats_index_exists(collection):
+        return [{'$sort': {'preference': 1}}, STATS_GROUP], {'hint': STATS_INDEX}
+    return [STATS_GROUP], {}
+
+
+def _get_counters_collection():
+    return get_collection('api_counters')
+
+
+def aggregate_counts(collection):
+    counts = dict.fromkeys(COUNTER_FIELDS, 0)
+    pipeline, options = stats_aggregation(collection)
+    try:
+        rows = list(collection.aggregate(pipeline, **options))
+    except OperationFailure:
+        if not options:
+            raise
+        # The hinted index was dropped since it was looked up.
+        _stats_index['checked_at'] = None
+        rows = list(collection.aggregate([STATS_GROUP]))
+    for row in rows:
+        counts['total_prompts'] += row['count']
+        field = PREFERENCE_COUNTERS.get(row['_id'])
+        if field:
+            counts[field] += row['count']
+    return counts
+
+
+def reconcile_counts(collection):
+    counts = aggregate_counts(collection)
+    _get_counters_collection().replace_one({'_id': COUNTERS_ID}, counts, upsert=True)
+    return counts
+
+
+def read_counts(collection):
+    if not settings.STATS_COUNTERS_ENABLED:
+        return aggregate_counts(collection)
+    doc = _get_counters_collection().find_one({'_id': COUNTERS_ID})
+    if doc is None:
+        return reconcile_counts(collection)
+    return {field: doc.get(field, 0) for field in COUNTER_FIELDS}
+
+
+# Increments never upsert: until the first read seeds the document from a full
+# aggregation there is nothing meaningful to increment.
+def count_prompts_created(count=1):
+    if settings.STATS_COUNTERS_ENABLED and count:
+        _get_counters_collection().update_one({'_id': COUNTERS_ID}, {'$inc': {'total_prompts': count}})
+
+
+def count_prompt_deleted(preference):
+    if not settings.STATS_COUNTERS_ENABLED:
+        return
+    inc = {'total_prompts': -1}
+    if preference in PREFERENCE_COUNTERS:
+        inc[PREFERENCE_COUNTERS[preference]] = -1
+    _get_counters_collection().update_one({'_id': COUNTERS_ID}, {'$inc': inc})
+
+
+def count_preference_change(previous, preference):
+    count_preference_changes([(previous, preference)])
+
+
+def count_preference_changes(changes):
+    if not settings.STATS_COUNTERS_ENABLED:
+        return
+    inc = {}
+    for previous, preference in changes:
+        if previous == preference:
+            continue
+        if preference in PREFERENCE_COUNTERS:
+            inc[PREFERENCE_COUNTERS[preference]] = inc.get(PREFERENCE_COUNTERS[preference], 0) + 1
+        if previous in PREFERENCE_COUNTERS:
+            inc[PREFERENCE_COUNTERS[previous]] = inc.get(PREFERENCE_COUNTERS[previous], 0) - 1
+    inc = {field: value for field, value in inc.items() if value}
+    if inc:
+        _get_counters_collection().update_one({'_id': COUNTERS_ID}, {'$inc': inc})
+
+
+def build_stats(counts):
+    with_preference = counts['preference_a'] + counts['preference_b'] + counts['ties']
+    return {
+        'total_prompts': counts['total_prompts'],
+        'with_preference': with_preference,
+        'without_preference': counts['total_prompts'] - with_preference,
+        'preference_a': counts['preference_a'],
+        'preference_b': counts['preference_b'],
+        'ties': counts['ties'],
+        'training_pairs': counts['preference_a'] + counts['preference_b'],
+    }
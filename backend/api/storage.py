@@ -0,0 +1,301 @@
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from bson import BSON, Binary
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from .mongo import get_collection
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compact api_prompt layout (storage: 2), written while COMPACT_STORAGE_ENABLED:
+# - prompt_text moves to api_prompt_texts under its sha256 and the document
+#   keeps prompt_id; prompts no longer than the digest stay inline.
+# - response_a/response_b of COMPRESS_MIN_BYTES or more become
+#   {codec, data, length} sub-documents (zstd when installed, else zlib).
+# - the ten per-side sampling fields become params: {a: [...], b: [...]} in
+#   PARAM_FIELDS order.
+# expand_document() returns the flat layout for either kind of document, so
+# collections can hold both. Texts are never deleted; an orphan costs one row.
+COMPACT = 2
+TEXTS_COLLECTION = 'api_prompt_texts'
+PROMPT_INLINE_BYTES = 64
+PARAM_FIELDS = ('temperature', 'max_tokens', 'top_p', 'frequency_penalty', 'presence_penalty')
+SIDES = ('a', 'b')
+PARAM_KEYS = {
+    f'{field}_{side}': (side, index)
+    for side in SIDES
+    for index, field in enumerate(PARAM_FIELDS)
+}
+RESPONSE_KEYS = ('response_a', 'response_b')
+
+TEXT_CACHE_ENTRIES = 4096
+
+_texts = OrderedDict()
+_texts_lock = threading.Lock()
+
+
+def is_compact(document):
+    return document is not None and document.get('storage') == COMPACT
+
+
+def prompt_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def compress_text(text):
+    if not isinstance(text, str):
+        return text
+    raw = text.encode('utf-8')
+    if len(raw) < settings.COMPRESS_MIN_BYTES:
+        return text
+    if zstandard is not None:
+        codec, data = 'zstd', zstandard.ZstdCompressor().compress(raw)
+    else:
+        codec, data = 'zlib', zlib.compress(raw)
+    if len(data) >= len(raw):
+        return text
+    return {'codec': codec, 'data': Binary(data), 'length': len(raw)}
+
+
+def decompress_text(value):
+    if not isinstance(value, dict):
+        return value
+    data = bytes(value['data'])
+    if value['codec'] == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('Reading zstd-compressed responses requires the zstandard package')
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raw = zlib.decompress(data)
+    return raw.decode('utf-8')
+
+
+def _remember_texts(texts):
+    with _texts_lock:
+        for prompt_id, text in texts.items():
+            _texts[prompt_id] = text
+            _texts.move_to_end(prompt_id)
+        while len(_texts) > TEXT_CACHE_ENTRIES:
+            _texts.popitem(last=False)
+
+
+def _externalized(text):
+    return isinstance(text, str) and len(text.encode('utf-8')) > PROMPT_INLINE_BYTES
+
+
+def store_prompt_texts(texts):
+    """Make sure every long text is in api_prompt_texts; return {text: prompt_id}."""
+    ids = {text: prompt_hash(text) for text in texts if _externalized(text)}
+    with _texts_lock:
+        missing = {prompt_id: text for text, prompt_id in ids.items() if prompt_id not in _texts}
+    if missing:
+        now = timezone.now()
+        try:
+            get_collection(TEXTS_COLLECTION).bulk_write([
+                UpdateOne({'_id': prompt_id}, {'$setOnInsert': {'text': text, 'created_at': now}}, upsert=True)
+                for prompt_id, text in missing.items()
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Concurrent upserts of the same text race on _id; the row exists either way.
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+        _remember_texts(missing)
+    return ids
+
+
+def load_prompt_texts(prompt_ids):
+    found = {}
+    with _texts_lock:
+        for prompt_id in prompt_ids:
+            if prompt_id in _texts:
+                found[prompt_id] = _texts[prompt_id]
+                _texts.move_to_end(prompt_id)
+    missing = [prompt_id for prompt_id in prompt_ids if prompt_id not in found]
+    if missing:
+        loaded = {
+            doc['_id']: doc['text']
+            for doc in get_collection(TEXTS_COLLECTION).find({'_id': {'$in': missing}})
+        }
+        _remember_texts(loaded)
+        found.update(loaded)
+    return found
+
+
+def _compact(document, ids):
+    if is_compact(document):
+        return document
+    compact = {
+        key: value for key, value in document.items()
+        if key not in PARAM_KEYS and key != 'prompt_text'
+    }
+    text = document.get('prompt_text')
+    if _externalized(text):
+        compact['prompt_id'] = ids[text]
+    else:
+        compact['prompt_text'] = text
+    for key in RESPONSE_KEYS:
+        if key in document:
+            compact[key] = compress_text(document[key])
+    compact['params'] = {
+        side: [document.get(f'{field}_{side}') for field in PARAM_FIELDS]
+        for side in SIDES
+    }
+    compact['storage'] = COMPACT
+    return compact
+
+
+def compact_documents(documents):
+    ids = store_prompt_texts([doc.get('prompt_text') for doc in documents if not is_compact(doc)])
+    return [_compact(doc, ids) for doc in documents]
+
+
+def compact_document(document):
+    return compact_documents([document])[0]
+
+
+def _expand(document, texts):
+    if not is_compact(document):
+        return document
+    flat = dict(document)
+    del flat['storage']
+    if 'prompt_id' in flat:
+        flat['prompt_text'] = texts.get(flat.pop('prompt_id'))
+    for key in RESPONSE_KEYS:
+        if key in flat:
+            flat[key] = decompress_text(flat[key])
+    for side, values in (flat.pop('params', None) or {}).items():
+        flat.update(zip((f'{field}_{side}' for field in PARAM_FIELDS), values))
+    return flat
+
+
+def _expand_batch(documents):
+    texts = load_prompt_texts({doc['prompt_id'] for doc in documents if is_compact(doc) and 'prompt_id' in doc})
+    return [_expand(doc, texts) for doc in documents]
+
+
+def expand_document(document):
+    if not is_compact(document):
+        return document
+    return _expand_batch([document])[0]
+
+
+def expand_documents(documents, batch_size=500):
+    """Lazily expand a cursor, fetching prompt texts once per batch."""
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield from _expand_batch(batch)
+            batch = []
+    if batch:
+        yield from _expand_batch(batch)
+
+
+def storage_projection(projection):
+    """Add the compact-layout fields behind a flat inclusion projection."""
+    if not projection or not any(projection.values()):
+        return projection
+    projection = dict(projection, storage=1)
+    if projection.get('prompt_text'):
+        projection['prompt_id'] = 1
+    if any(projection.get(key) for key in PARAM_KEYS):
+        projection['params'] = 1
+    return projection
+
+
+def compact_update(fields):
+    """Translate flat ``fields`` into ``($set, $unset)`` for a compact document."""
+    set_fields, unset_fields = {}, {}
+    for key, value in fields.items():
+        if key == 'prompt_text':
+            ids = store_prompt_texts([value])
+            if value in ids:
+                set_fields['prompt_id'] = ids[value]
+                unset_fields['prompt_text'] = ''
+            else:
+                set_fields['prompt_text'] = value
+                unset_fields['prompt_id'] = ''
+        elif key in RESPONSE_KEYS:
+            set_fields[key] = compress_text(value)
+        elif key in PARAM_KEYS:
+            side, index = PARAM_KEYS[key]
+            set_fields[f'params.{side}.{index}'] = value
+        else:
+            set_fields[key] = value
+    return set_fields, unset_fields
+
+
+def storage_stats(collection):
+    """collStats numbers for ``collection``, or None where the server has no collStats."""
+    try:
+        stats = collection.database.command({'collStats': collection.name})
+    except (OperationFailure, NotImplementedError):
+        return None
+    return {key: stats.get(key) for key in ('count', 'size', 'avgObjSize', 'storageSize', 'totalIndexSize')}
+
+
+def migrate_documents(collection, compact=True, batch_size=500, dry_run=False):
+    """Rewrite documents into the compact (or flat) layout in _id order.
+
+    Replacements only apply while updated_at is unchanged, so a vote or edit
+    that lands mid-migration is kept and the document counted as skipped.
+    Pending and running jobs are left alone. Returns counters including the
+    BSON bytes of the rewritten documents before and after, and of the
+    distinct prompt texts they reference.
+    """
+    from .jobs import JOB_PENDING, JOB_RUNNING
+
+    query = {
+        'storage': {'$ne': COMPACT} if compact else COMPACT,
+        'job_status': {'$nin': [JOB_PENDING, JOB_RUNNING]},
+    }
+    result = {'examined': 0, 'rewritten': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0, 'text_bytes': 0}
+    seen_texts = set()
+    cursor = collection.find(query).sort('_id', 1).batch_size(batch_size)
+    batch = []
+
+    def flush():
+        if compact:
+            ids = {
+                doc['prompt_text']: prompt_hash(doc['prompt_text'])
+                for doc in batch if _externalized(doc.get('prompt_text'))
+            }
+            for text, prompt_id in ids.items():
+                if prompt_id not in seen_texts:
+                    seen_texts.add(prompt_id)
+                    result['text_bytes'] += len(BSON.encode({'_id': prompt_id, 'text': text}))
+            if not dry_run:
+                store_prompt_texts(list(ids))
+            rewritten = [_compact(doc, ids) for doc in batch]
+        else:
+            rewritten = _expand_batch(batch)
+        result['examined'] += len(batch)
+        result['bytes_before'] += sum(len(BSON.encode(doc)) for doc in batch)
+        result['bytes_after'] += sum(len(BSON.encode(doc)) for doc in rewritten)
+        if dry_run:
+            return
+        outcome = collection.bulk_write([
+            ReplaceOne({'_id': doc['_id'], 'updated_at': doc.get('updated_at')}, doc)
+            for doc in rewritten
+        ], ordered=False)
+        result['rewritten'] += outcome.modified_count
+        result['skipped'] += len(batch) - outcome.matched_count
+
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return result
@@ -0,0 +1,61 @@
+import json
+
+from django.http import StreamingHttpResponse
+
+from . import dedup
+from .tokens import estimated_usage
+
+# Server-sent events of generate-stream, shared by the viewset action and its
+# async counterpart: 'delta' and 'end' per side, then 'done' with the stored
+# pair, or a single 'error'. A reused pair (DEDUP_MODE=reuse) is a lone 'done'.
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def event(kind, side, payload):
+    """The SSE for a ``(kind, side, payload)`` from stream_two_responses()."""
+    if kind == 'delta':
+        return sse('delta', {'side': side, 'content': payload})
+    return sse('end', {'side': side, 'first_token_ms': payload['first_token_ms'], 'ms': payload['ms']})
+
+
+def response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def reused(document):
+    return sse('done', dedup.reused_payload(document))
+
+
+def done(data, document, now, usage, extra):
+    return sse('done', {
+        'id': str(document['_id']),
+        'prompt': data['prompt'],
+        'response_a': document['response_a'],
+        'response_b': document['response_b'],
+        'model_name': data['model_name'],
+        'temperature': document['temperature'],
+        'temperature_a': data['temperature_a'],
+        'temperature_b': data['temperature_b'],
+        'created_at': now.isoformat(),
+        'usage': usage,
+        **extra
+    })
+
+
+def spent_usage(data, finished, streamed):
+    """Usage to settle once a stream stops, finished or not.
+
+    A side cut off mid-stream (error or client disconnect) is charged for what
+    it had streamed.
+    """
+    return {
+        side: finished[side]['usage'] if side in finished else
+        estimated_usage(data['prompt'], ''.join(parts), data['model_name']) if parts else None
+        for side, parts in streamed.items()
+    }
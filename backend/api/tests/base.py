@@ -0,0 +1,23 @@
+import unittest
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api import mongo
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock (pip install -r requirements-dev.txt)')
+class MongoTestCase(SimpleTestCase):
+    """Gives api.mongo a fresh in-memory mongomock client for each test."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(mongo, '_client', mongomock.MongoClient())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collection = mongo.get_collection()
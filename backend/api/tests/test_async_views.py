@@ -0,0 +1,58 @@
+import asyncio
+import importlib
+import json
+
+from django.test import AsyncRequestFactory, override_settings
+
+from api import async_views, urls
+
+from .base import MongoTestCase
+
+
+@override_settings(LLM_BACKENDS=[{'prefix': 'fake/', 'kind': 'fake'}], LLM_CACHE_ENABLED=False,
+                   TOKEN_BUDGET_PER_CLIENT=0, TOKEN_BUDGET_GLOBAL=0)
+class AsyncViewTests(MongoTestCase):
+    factory = AsyncRequestFactory()
+
+    def post(self, path, data):
+        return self.factory.post(path, json.dumps(data), content_type='application/json')
+
+    async def test_generate_stream_sends_events_as_they_are_produced(self):
+        response = await async_views.generate_stream(
+            self.post('/api/prompts/generate-stream/', {'prompt': 'tell me a story', 'model_name': 'fake/model'})
+        )
+        # An async iterator is what the ASGI handler streams instead of buffering.
+        self.assertTrue(response.is_async)
+        events = [chunk.decode().split('\n', 1)[0] async for chunk in response.streaming_content]
+        self.assertEqual(events[0], 'event: delta')
+        self.assertEqual(events.count('event: end'), 2)
+        self.assertEqual(events[-1], 'event: done')
+        self.assertEqual(await asyncio.to_thread(self.collection.count_documents, {}), 1)
+
+    async def test_busy_sync_actions_run_in_the_thread_pool(self):
+        with override_settings(ASYNC_VIEWS=True):
+            patterns = importlib.reload(urls).urlpatterns
+        self.addCleanup(importlib.reload, urls)
+        views = {str(pattern.pattern): pattern.callback for pattern in patterns if hasattr(pattern, 'callback')}
+        view = views['prompts/<str:pk>/record-preference/']
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+
+        inserted = await asyncio.to_thread(self.collection.insert_one, {'prompt_text': 'hi'})
+        object_id = str(inserted.inserted_id)
+        response = await view(self.post(f'/api/prompts/{object_id}/record-preference/', {'preference': 'A'}),
+                              pk=object_id)
+        self.assertEqual(response.status_code, 200)
+        document = await asyncio.to_thread(self.collection.find_one, {'_id': inserted.inserted_id})
+        self.assertEqual(document['preference'], 'A')
+
+    @override_settings(DEDUP_MODE='reuse')
+    async def test_generate_stream_reuses_a_stored_pair(self):
+        data = {'prompt': 'tell me a story', 'model_name': 'fake/model'}
+        first = await async_views.generate_stream(self.post('/api/prompts/generate-stream/', data))
+        [_ async for _ in first.streaming_content]
+        response = await async_views.generate_stream(self.post('/api/prompts/generate-stream/', data))
+        chunks = [chunk.decode() async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith('event: done'))
+        self.assertTrue(json.loads(chunks[0].split('data: ', 1)[1])['reused'])
+        self.assertEqual(await asyncio.to_thread(self.collection.count_documents, {}), 1)
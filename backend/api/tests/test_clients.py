@@ -0,0 +1,87 @@
+import asyncio
+import os
+import threading
+
+from django.test import SimpleTestCase
+
+from api import clients
+from benchmarks.stub_llm import StubLLM
+
+
+class CountingStubLLM(StubLLM):
+    """StubLLM that also counts the TCP connections it accepts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await super().handle(reader, writer)
+
+
+class StubServerMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = CountingStubLLM(latency=0)
+        cls.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(cls.loop)
+            cls.server, port = cls.loop.run_until_complete(cls.stub.serve())
+            cls.base_url = f'http://127.0.0.1:{port}/v1'
+            started.set()
+            cls.loop.run_forever()
+
+        cls.thread = threading.Thread(target=run, daemon=True)
+        cls.thread.start()
+        started.wait()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.call_soon_threadsafe(cls.server.close)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join()
+        super().tearDownClass()
+
+
+class OpenAIClientPoolTests(StubServerMixin, SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(clients.close_openai_clients)
+
+    def complete(self, client):
+        return client.chat.completions.create(
+            model='stub', messages=[{'role': 'user', 'content': 'hello'}], max_tokens=4
+        )
+
+    def test_completions_reuse_one_connection(self):
+        connections, requests = self.stub.connections, self.stub.requests
+        client = clients.get_openai_client('key', self.base_url)
+        self.complete(client)
+        self.assertIs(clients.get_openai_client('key', self.base_url), client)
+        self.complete(clients.get_openai_client('key', self.base_url))
+        self.assertEqual(self.stub.requests - requests, 2)
+        self.assertEqual(self.stub.connections - connections, 1)
+
+    def test_forked_child_builds_its_own_client(self):
+        parent = clients.get_openai_client('key', self.base_url)
+        self.complete(parent)
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_end)
+                child = clients.get_openai_client('key', self.base_url)
+                fresh = child is not parent and child._client is not parent._client
+                answered = self.complete(child).choices[0].message.content is not None
+                os.write(write_end, b'1' if fresh and answered else b'0')
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end, 'rb') as pipe:
+            result = pipe.read()
+        os.waitpid(pid, 0)
+        self.assertEqual(result, b'1')
+        self.assertIs(clients.get_openai_client('key', self.base_url), parent)
@@ -0,0 +1,80 @@
+import json
+
+from bson import Binary
+from django.test import override_settings
+
+from api import dedup
+
+from .base import MongoTestCase
+
+
+@override_settings(DEDUP_MAX_CANDIDATES=3, DEDUP_THRESHOLD=0.8)
+class FindSimilarTests(MongoTestCase):
+    def test_candidates_are_the_documents_sharing_the_most_bands(self):
+        fields = dedup.fingerprint(' '.join(f'word{i}' for i in range(40)))
+        signature = bytes(fields['dedup_signature'])
+        # Older documents that share one band only, enough to fill the candidate limit.
+        weak = [{
+            'dedup_hash': f'weak{i}',
+            'dedup_signature': Binary(bytes(4 * dedup.NUM_PERM)),
+            'dedup_bands': [fields['dedup_bands'][0], i],
+        } for i in range(5)]
+        self.collection.insert_many(weak)
+        # Differs from the query in one row only, so it shares 7 of the 8 bands.
+        close = {
+            'dedup_hash': 'close',
+            'dedup_signature': Binary(bytes(4) + signature[4:]),
+            'dedup_bands': [0] + fields['dedup_bands'][1:],
+        }
+        self.collection.insert_one(close)
+
+        matches = dedup.find_similar(self.collection, fields)
+        self.assertEqual([match.id for match in matches], [close['_id']])
+        self.assertAlmostEqual(matches[0].similarity, 63 / 64)
+
+    def test_batch_lookup_ranks_each_documents_candidates_the_same_way(self):
+        texts = [' '.join(f'{word}{i}' for i in range(40)) for word in ('alpha', 'beta')]
+        stored = []
+        for text in texts:
+            fields = dedup.fingerprint(text)
+            stored += [dict(fields, _id=index) for index in range(len(stored), len(stored) + 4)]
+        self.collection.insert_many(stored)
+        probes = [dict(dedup.fingerprint(text), _id=f'probe-{index}') for index, text in enumerate(texts)]
+
+        batch = dedup.find_similar_batch(self.collection, probes)
+        for probe in probes:
+            self.assertEqual(batch[probe['_id']], dedup.find_similar(self.collection, probe))
+            self.assertEqual(len(batch[probe['_id']]), 3)
+
+
+@override_settings(DEDUP_MODE='warn', DEDUP_THRESHOLD=0.8)
+class ExportDedupTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        words = [f'word{i}' for i in range(40)]
+        self.texts = [' '.join(words), ' '.join(words[:-1] + ['other']), 'something else entirely']
+        self.ids = self.collection.insert_many([
+            dict(dedup.fingerprint(text), prompt_text=text, response_a='a', response_b='b', preference='A',
+                 model_name='fake/model', temperature=0.7, temperature_a=0.7, temperature_b=0.9)
+            for text in self.texts
+        ]).inserted_ids
+
+    def export(self, path, dedup_action):
+        response = self.client.get(f'/api/prompts/{path}/', {'dedup': dedup_action})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_drop_exports_only_the_oldest_of_near_duplicates(self):
+        pairs = self.export('export-training-data', 'drop').json()['data']
+        self.assertEqual([pair['prompt'] for pair in pairs], [self.texts[0], self.texts[2]])
+
+    def test_cluster_tags_each_row_with_its_oldest_near_duplicate(self):
+        response = self.export('export-training-data-jsonl', 'cluster')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        clusters = [json.loads(line)['cluster'] for line in lines]
+        self.assertEqual(clusters, [str(self.ids[0]), str(self.ids[0]), str(self.ids[2])])
+
+    def test_unknown_action_is_rejected(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get('/api/prompts/export-training-data/', {'dedup': 'merge'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from api import llm_service
+
+from .base import MongoTestCase
+
+URL = '/api/prompts/generate-batch/'
+
+
+@override_settings(LLM_BACKENDS=[{'prefix': 'fake/', 'kind': 'fake'}], LLM_CACHE_ENABLED=False)
+class GenerateBatchTests(MongoTestCase):
+    def post(self, items):
+        return self.client.post(URL, {'items': items}, content_type='application/json')
+
+    def test_stores_every_pair(self):
+        response = self.post([{'prompt': f'prompt {i}', 'model_name': 'fake/model'} for i in range(5)])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['succeeded'], 5)
+        self.assertEqual([entry['index'] for entry in body['results']], list(range(5)))
+        self.assertEqual(self.collection.count_documents({}), 5)
+
+    def test_pairs_are_stored_before_the_batch_ends(self):
+        stored_before_failure = []
+        real_batch = llm_service.generate_response_batch
+
+        def failing_batch(items):
+            for count, result in enumerate(real_batch(items)):
+                if count == 2:
+                    stored_before_failure.append(self.collection.count_documents({}))
+                    raise RuntimeError('worker killed')
+                yield result
+
+        with mock.patch('api.views.generate_response_batch', failing_batch):
+            with self.assertRaises(RuntimeError), self.assertLogs('django.request', 'ERROR'):
+                self.post([{'prompt': f'prompt {i}', 'model_name': 'fake/model'} for i in range(4)])
+        self.assertEqual(stored_before_failure, [2])
+
+    @override_settings(GENERATION_JOBS_ENABLED=True)
+    def test_job_mode_queues_items(self):
+        response = self.post([{'prompt': f'prompt {i}', 'model_name': 'fake/model'} for i in range(3)])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([entry['status'] for entry in response.json()['results']], ['pending'] * 3)
+        self.assertEqual(self.collection.count_documents({'job_status': 'pending'}), 3)
+
+    @override_settings(DEDUP_MODE='reuse')
+    def test_reused_items_are_not_generated_again(self):
+        item = {'prompt': 'tell me a story', 'model_name': 'fake/model'}
+        first = self.client.post('/api/prompts/generate/', item, content_type='application/json').json()
+        with mock.patch('api.views.generate_response_batch', wraps=llm_service.generate_response_batch) as batch:
+            body = self.post([{'prompt': 'something new', 'model_name': 'fake/model'}, item]).json()
+        self.assertEqual(len(batch.call_args.args[0]), 1)
+        self.assertEqual(body['succeeded'], 2)
+        reused = body['results'][1]
+        self.assertEqual((reused['index'], reused['status'], reused['id'], reused['reused']), (1, 'ok', first['id'], True))
+        self.assertEqual(self.collection.count_documents({}), 2)
@@ -0,0 +1,49 @@
+import io
+import json
+from unittest import mock
+
+from api import importer
+
+from .base import MongoTestCase
+
+
+def row(index):
+    return {'prompt': f'prompt {index}', 'chosen': 'yes', 'rejected': 'no', 'metadata': {}}
+
+
+class ImporterTests(MongoTestCase):
+    def test_malformed_jsonl_lines_are_counted_as_invalid(self):
+        lines = [json.dumps(row(1)), '{"prompt": "cut', json.dumps(row(2)), '', 'null']
+        result = importer.import_records(importer.iter_jsonl(io.StringIO('\n'.join(lines))))
+        self.assertEqual(result, {'rows': 4, 'inserted': 2, 'duplicates': 0, 'invalid': 2})
+
+    @mock.patch.object(importer, 'READ_CHUNK_BYTES', 16)
+    def test_malformed_array_element_is_skipped_to_its_delimiter(self):
+        text = '{"data": [%s, {"prompt" "x", "chosen": "a, ]"}, %s]}' % (json.dumps(row(1)), json.dumps(row(2)))
+        handle = io.StringIO(text)
+        values = importer.iter_json_array(handle)
+        self.assertEqual(next(values), row(1))
+        self.assertIs(next(values), importer.MALFORMED)
+        # Skipping the bad element did not read ahead to the end of the file.
+        self.assertLess(handle.tell(), len(text))
+        self.assertEqual(list(values), [row(2)])
+
+    def test_array_cut_off_inside_an_element_ends_with_it_invalid(self):
+        values = list(importer.iter_json_array(io.StringIO('[%s, {"prompt": "cut' % json.dumps(row(1)))))
+        self.assertEqual(values, [row(1), importer.MALFORMED])
+
+    def test_rows_with_mistyped_metadata_are_invalid(self):
+        bad = [
+            {'created_at': 1700000000},
+            {'preference_recorded_at': {'at': 'noon'}},
+            {'temperature': 'hot'},
+            {'temperature_a': float('nan')},
+            {'temperature_b': True},
+            {'model': ['gpt']},
+        ]
+        records = [dict(row(index), metadata=metadata) for index, metadata in enumerate(bad)]
+        records.append(dict(row(99), metadata={'model': 'gpt-4', 'temperature': 1, 'created_at': '2024-01-02T03:04:05'}))
+        result = importer.import_records(records)
+        self.assertEqual(result, {'rows': 7, 'inserted': 1, 'duplicates': 0, 'invalid': 6})
+        document = self.collection.find_one()
+        self.assertEqual((document['model_name'], document['temperature']), ('gpt-4', 1.0))
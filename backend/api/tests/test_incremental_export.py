@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.utils import timezone
+
+from api import dedup, importer
+from api.incremental_export import IncrementalExport
+
+from .base import MongoTestCase
+
+
+class IncrementalExportTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def export(self, dedup=None):
+        export = IncrementalExport(self.directory, settle_seconds=0, dedup=dedup)
+        try:
+            return export.run(self.collection)
+        finally:
+            export.close()
+
+    def test_pairs_imported_after_an_export_are_in_the_next_one(self):
+        now = timezone.now()
+        self.collection.insert_one({
+            'prompt_text': 'voted', 'response_a': 'a', 'response_b': 'b', 'preference': 'B',
+            'created_at': now, 'preference_recorded_at': now, 'updated_at': now,
+        })
+        self.assertEqual(self.export()['appended'], 1)
+
+        # Its vote predates the first export's high-water mark.
+        importer.import_records([{'prompt': 'imported', 'chosen': 'yes', 'rejected': 'no', 'metadata': {
+            'created_at': '2023-05-01T00:00:00+00:00', 'preference_recorded_at': '2023-05-02T00:00:00+00:00',
+        }}])
+        self.assertEqual(self.export()['appended'], 1)
+
+        rows = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith('pairs-'):
+                with open(os.path.join(self.directory, name)) as handle:
+                    rows += [json.loads(line) for line in handle]
+        self.assertEqual([row['prompt'] for row in rows], ['voted', 'imported'])
+        # The pair still carries its source vote time.
+        self.assertEqual(rows[1]['metadata']['preference_recorded_at'], '2023-05-02T00:00:00')
+
+    def test_dedup_looks_up_candidates_once_per_batch(self):
+        now = timezone.now()
+        text = ' '.join(f'word{i}' for i in range(40))
+        self.collection.insert_many([{
+            'prompt_text': prompt, 'response_a': 'a', 'response_b': 'b', 'preference': 'A',
+            'created_at': now, 'preference_recorded_at': now, 'updated_at': now, **dedup.fingerprint(prompt),
+        } for prompt in (text, text + ' again', 'something else entirely')])
+
+        with mock.patch('api.incremental_export.find_similar_batch', wraps=dedup.find_similar_batch) as lookup:
+            result = self.export(dedup='drop')
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual((result['appended'], result['duplicates']), (2, 1))
@@ -0,0 +1,85 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import override_settings
+from django.utils import timezone
+
+from api.jobs import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    build_job_document,
+    claim_job,
+    complete_job,
+    fail_job,
+    process_job,
+)
+from api.ratelimit import RateLimited
+from api.serializers import GenerateResponsesSerializer
+
+from .base import MongoTestCase
+
+
+@override_settings(JOB_LEASE_SECONDS=60, JOB_MAX_ATTEMPTS=3, JOB_RETRY_DELAY=5)
+class JobQueueTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        serializer = GenerateResponsesSerializer(data={'prompt': 'hello'})
+        serializer.is_valid(raise_exception=True)
+        # BSON dates keep milliseconds only.
+        self.now = timezone.now().replace(microsecond=0)
+        self.job = build_job_document(serializer.validated_data, self.now)
+        self.collection.insert_one(self.job)
+
+    def test_claim_takes_over_an_expired_lease(self):
+        first = claim_job(self.collection, 'worker-1', now=self.now)
+        self.assertEqual((first['job_status'], first['job_lease_owner']), (JOB_RUNNING, 'worker-1'))
+        # Leased and still valid: nobody else gets it.
+        self.assertIsNone(claim_job(self.collection, 'worker-2', now=self.now + timedelta(seconds=59)))
+
+        later = self.now + timedelta(seconds=61)
+        second = claim_job(self.collection, 'worker-2', now=later)
+        self.assertEqual(second['_id'], self.job['_id'])
+        self.assertEqual(second['job_lease_owner'], 'worker-2')
+        self.assertEqual(second['job_attempts'], 2)
+
+    def test_complete_with_a_stolen_lease_is_a_no_op(self):
+        stale = claim_job(self.collection, 'worker-1', now=self.now)
+        current = claim_job(self.collection, 'worker-2', now=self.now + timedelta(seconds=61))
+
+        self.assertFalse(complete_job(self.collection, stale, 'late a', 'late b'))
+        document = self.collection.find_one({'_id': self.job['_id']})
+        self.assertEqual((document['job_status'], document['response_a']), (JOB_RUNNING, None))
+
+        self.assertTrue(complete_job(self.collection, current, 'a', 'b'))
+        document = self.collection.find_one({'_id': self.job['_id']})
+        self.assertEqual((document['job_status'], document['response_a']), (JOB_DONE, 'a'))
+
+    def test_fail_backs_off_then_gives_up(self):
+        now = self.now
+        for attempt, backoff in ((1, 5), (2, 10)):
+            job = claim_job(self.collection, 'worker', now=now)
+            self.assertEqual(job['job_attempts'], attempt)
+            self.assertFalse(fail_job(self.collection, job, 'boom', now=now))
+            document = self.collection.find_one({'_id': self.job['_id']})
+            self.assertEqual(document['job_status'], JOB_PENDING)
+            self.assertEqual(document['job_retry_at'], (now + timedelta(seconds=backoff)).replace(tzinfo=None))
+            # Not claimable until the backoff passes.
+            self.assertIsNone(claim_job(self.collection, 'worker', now=now + timedelta(seconds=backoff - 1)))
+            now += timedelta(seconds=backoff)
+
+        job = claim_job(self.collection, 'worker', now=now)
+        self.assertTrue(fail_job(self.collection, job, 'boom', now=now))
+        document = self.collection.find_one({'_id': self.job['_id']})
+        self.assertEqual((document['job_status'], document['job_error']), (JOB_FAILED, 'boom'))
+        self.assertIsNone(claim_job(self.collection, 'worker', now=now + timedelta(days=1)))
+
+    def test_rate_limited_job_is_deferred_without_spending_an_attempt(self):
+        job = claim_job(self.collection, 'worker', now=self.now)
+        with mock.patch('api.jobs.generate_two_responses', side_effect=RateLimited(30)), \
+                mock.patch('api.jobs.timezone.now', return_value=self.now):
+            self.assertFalse(process_job(self.collection, job))
+        document = self.collection.find_one({'_id': self.job['_id']})
+        self.assertEqual((document['job_status'], document['job_attempts']), (JOB_PENDING, 0))
+        self.assertEqual(document['job_retry_at'], (self.now + timedelta(seconds=30)).replace(tzinfo=None))
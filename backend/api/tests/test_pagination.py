@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from api.pagination import decode_cursor, encode_cursor, page_query
+
+from .base import MongoTestCase
+
+
+class CursorTests(MongoTestCase):
+    def test_round_trip(self):
+        document = {'_id': ObjectId(), 'created_at': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}
+        self.assertEqual(decode_cursor(encode_cursor(document)), (document['created_at'], document['_id']))
+
+    def test_undated_document(self):
+        for document in ({'_id': ObjectId()}, {'_id': ObjectId(), 'created_at': None}):
+            cursor = decode_cursor(encode_cursor(document))
+            self.assertEqual(cursor, (None, document['_id']))
+            self.assertEqual(page_query(cursor), {'created_at': None, '_id': {'$lt': document['_id']}})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor')
+
+
+class ListPaginationTests(MongoTestCase):
+    def test_pages_reach_legacy_documents(self):
+        now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        documents = [{'_id': ObjectId(), 'prompt_text': f'dated {i}', 'created_at': now - timedelta(minutes=i // 2)}
+                     for i in range(5)]
+        documents += [{'_id': ObjectId(), 'prompt_text': 'missing'},
+                      {'_id': ObjectId(), 'prompt_text': 'null', 'created_at': None},
+                      {'_id': ObjectId(), 'prompt_text': 'missing too'}]
+        self.collection.insert_many(documents)
+
+        seen = []
+        url = '/api/prompts/?limit=2&view=summary'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            seen += [row['_id'] for row in body['results']]
+            url = body['next'] and '/api/prompts/?limit=2&view=summary&cursor=' + body['next_cursor']
+
+        self.assertEqual(len(seen), len(documents))
+        self.assertEqual(set(seen), {str(document['_id']) for document in documents})
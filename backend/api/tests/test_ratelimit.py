@@ -0,0 +1,100 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from api import backends
+from api.ratelimit import RateLimited, SharedRateLimiter, TokenRateLimiter
+
+from .base import MongoTestCase
+
+
+@override_settings(LLM_RATE_LIMIT_MAX_WAIT=5)
+class SharedRateLimiterTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = 1000.0
+        for name, fake in (('time', lambda: self.clock), ('sleep', self.sleep)):
+            patcher = mock.patch(f'api.ratelimit.time.{name}', fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.slept = []
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.clock += seconds
+
+    def test_burst_is_capped_at_one_minutes_budget(self):
+        limiter = SharedRateLimiter('test', requests_per_minute=2, jitter=0)
+        limiter.acquire()
+        limiter.acquire()
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire()
+        self.assertAlmostEqual(raised.exception.retry_after, 30)
+        self.assertEqual(self.slept, [])
+
+        # Refills continuously: half a minute buys one request back, not a fresh window.
+        self.clock += 30
+        limiter.acquire()
+        with self.assertRaises(RateLimited):
+            limiter.acquire()
+
+    def test_short_waits_sleep_until_the_tokens_refill(self):
+        limiter = SharedRateLimiter('test', tokens_per_minute=600, jitter=0)
+        limiter.acquire(1, 600)
+        limiter.acquire(1, 30)
+        self.assertEqual(self.slept, [3])
+        # Requests and tokens are taken together; a refused call takes neither.
+        with self.assertRaises(RateLimited):
+            limiter.acquire(1, 600)
+        self.assertEqual(self.collection.database['api_rate_limits'].find_one({'_id': 'test'})['tokens'], 0)
+
+    def test_block_holds_every_caller_off(self):
+        limiter = SharedRateLimiter('test', requests_per_minute=100, jitter=0)
+        limiter.block(20)
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire()
+        self.assertAlmostEqual(raised.exception.retry_after, 20)
+        self.clock += 20
+        limiter.acquire()
+
+    @override_settings(LLM_BACKENDS=[{'prefix': 'fake/', 'kind': 'fake'}], LLM_CACHE_ENABLED=False,
+                       GENERATION_JOBS_ENABLED=False)
+    def test_generate_answers_429_instead_of_waiting(self):
+        backend = backends.build_backend({'prefix': 'fake/', 'kind': 'fake', 'requests_per_minute': 2})
+        patcher = mock.patch.object(backends, '_backends', [backend])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def generate():
+            return self.client.post('/api/prompts/generate/', {'prompt': 'hello', 'model_name': 'fake/model'},
+                                    content_type='application/json')
+
+        self.assertEqual(generate().status_code, 201)
+        with self.assertLogs('django.request', 'WARNING'):
+            response = generate()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 5)
+
+
+@override_settings(LLM_RATE_LIMIT_MAX_WAIT=5)
+class TokenRateLimiterTests(MongoTestCase):
+    def test_gives_up_instead_of_sleeping_out_the_window(self):
+        clock = [1000.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            clock[0] += seconds
+
+        limiter = TokenRateLimiter(100)
+        with mock.patch('api.ratelimit.time.monotonic', lambda: clock[0]), \
+                mock.patch('api.ratelimit.time.sleep', sleep):
+            limiter.acquire(100)
+            clock[0] += 57
+            # The first tokens come back 3s later, within the max wait.
+            limiter.acquire(100)
+            self.assertEqual(slept, [3])
+            with self.assertRaises(RateLimited) as raised:
+                limiter.acquire(100)
+        self.assertAlmostEqual(raised.exception.retry_after, 60)
+        self.assertEqual(slept, [3])
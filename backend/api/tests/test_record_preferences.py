@@ -0,0 +1,52 @@
+from unittest import mock
+
+from bson import ObjectId
+from django.utils import timezone
+
+from api.views import _record_votes
+
+from .base import MongoTestCase
+
+
+class RecordPreferencesTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = self.collection.insert_many([{'prompt': 'one', 'preference': 'A'}, {'prompt': 'two'}]).inserted_ids
+
+    def record(self, items):
+        response = self.client.post('/api/prompts/record-preferences/', {'items': items},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_results_match_the_write(self):
+        first, second = map(str, self.ids)
+        missing = str(ObjectId())
+        body = self.record([
+            {'id': first, 'preference': 'B'},
+            {'id': second, 'preference': 'TIE'},
+            {'id': first, 'preference': 'A'},
+            {'id': missing, 'preference': 'A'},
+            {'id': 'nope', 'preference': 'A'},
+        ])
+        # The duplicate id gets one result, for its last vote, which repeats the stored one.
+        self.assertEqual([(entry['id'], entry.get('preference'), entry.get('modified')) for entry in body['results']], [
+            (first, 'A', False), (second, 'TIE', True), (missing, 'A', False), ('nope', None, None),
+        ])
+        self.assertEqual((body['matched_count'], body['modified_count']), (2, 1))
+        self.assertIn('error', body['results'][2])
+        self.assertEqual(self.collection.find_one({'_id': self.ids[0]})['preference'], 'A')
+
+    def test_concurrent_vote_is_seen_by_the_bulk_write(self):
+        now = timezone.now().replace(microsecond=0)
+        bulk_write = self.collection.bulk_write
+
+        def vote_in_between(requests, **kwargs):
+            # Another annotator votes after the read, before the bulk write.
+            self.collection.update_one({'_id': self.ids[0]}, {'$set': {'preference': 'TIE'}})
+            return bulk_write(requests, **kwargs)
+
+        with mock.patch.object(self.collection, 'bulk_write', vote_in_between):
+            replaced = _record_votes(self.collection, {self.ids[0]: 'B', self.ids[1]: 'B'}, now)
+        self.assertEqual(replaced, {self.ids[0]: 'TIE', self.ids[1]: None})
+        self.assertEqual([doc['preference'] for doc in self.collection.find()], ['B', 'B'])
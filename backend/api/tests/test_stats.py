@@ -0,0 +1,32 @@
+from unittest import mock
+
+from bson import ObjectId
+
+from api import stats
+from api.indexes import PROMPT_INDEXES
+
+from .base import MongoTestCase
+
+
+class StatsAggregationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(stats, '_stats_index', {'exists': False, 'checked_at': None})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collection.insert_many([{'_id': ObjectId(), 'preference': preference}
+                                     for preference in ('A', 'A', 'B', 'TIE', None)])
+
+    def test_plain_group_without_the_index(self):
+        pipeline, options = stats.stats_aggregation(self.collection)
+        self.assertEqual((pipeline, options), ([stats.STATS_GROUP], {}))
+        self.assertEqual(stats.aggregate_counts(self.collection),
+                         {'total_prompts': 5, 'preference_a': 2, 'preference_b': 1, 'ties': 1})
+
+    def test_index_backed_sort_once_the_index_exists(self):
+        self.collection.create_indexes([index for index in PROMPT_INDEXES
+                                        if index.document['name'] == stats.STATS_INDEX])
+        pipeline, options = stats.stats_aggregation(self.collection)
+        self.assertEqual(pipeline[0], {'$sort': {'preference': 1}})
+        self.assertEqual(options, {'hint': stats.STATS_INDEX})
+        self.assertEqual(stats.aggregate_counts(self.collection)['preference_a'], 2)
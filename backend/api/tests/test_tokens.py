@@ -0,0 +1,38 @@
+from django.test import override_settings
+
+from api import tokens
+
+from .base import MongoTestCase
+
+
+@override_settings(TOKEN_BUDGET_PER_CLIENT=5000, TOKEN_BUDGET_GLOBAL=0, TOKEN_BUDGET_WINDOW=3600,
+                   LLM_BACKENDS=[{'prefix': 'fake/', 'kind': 'fake'}], LLM_CACHE_ENABLED=False)
+class TokenBudgetTests(MongoTestCase):
+    def reserved(self, client):
+        document = self.collection.database[tokens.BUDGETS_COLLECTION].find_one(
+            {'_id': {'$regex': f'^client:{client}:'}}
+        )
+        return document['tokens'] if document else 0
+
+    def test_admit_refuses_a_full_window(self):
+        reservation = tokens.admit('alice', 4000)
+        with self.assertRaises(tokens.BudgetExceeded) as raised:
+            tokens.admit('alice', 2000)
+        self.assertGreater(raised.exception.retry_after, 0)
+        tokens.settle(reservation, 100)
+        self.assertEqual(self.reserved('alice'), 100)
+        tokens.admit('alice', 2000)
+
+    def test_disconnected_stream_settles_its_reservation(self):
+        response = self.client.post(
+            '/api/prompts/generate-stream/',
+            {'prompt': 'tell me a story', 'model_name': 'fake/model', 'max_tokens_a': 1000, 'max_tokens_b': 1000},
+            content_type='application/json',
+            HTTP_X_CLIENT_ID='bob',
+        )
+        self.assertEqual(response.status_code, 200)
+        next(iter(response.streaming_content))
+        self.assertGreater(self.reserved('bob'), 2000)
+        # What Django does when the client goes away mid-stream.
+        response.close()
+        self.assertLess(self.reserved('bob'), 100)
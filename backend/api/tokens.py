@@ -0,0 +1,178 @@
+import logging
+import time
+from datetime import datetime, timezone as tz
+from functools import lru_cache
+
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError
+
+from . import metrics
+from .mongo import get_collection
+from .ratelimit import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Token accounting for generate requests. Prompts are counted locally with
+# tiktoken (pinned in requirements.txt; the Docker image pre-fetches its BPE
+# files into TIKTOKEN_CACHE_DIR so it never downloads at runtime). Without it
+# counts fall back to ratelimit.estimate_tokens, with a warning. A request costs
+# at most its prompt twice plus both max_tokens; admit() reserves that against
+# the client's and the global budget before any completion is requested, and
+# settle() swaps the reservation for the tokens the completions reported.
+#
+# Each budget window has one api_token_budgets document per bucket
+# ('client:<key>' and 'global'), reserved with a conditional upsert like
+# ratelimit.SharedRateLimiter's: a full window surfaces as a duplicate-key error.
+BUDGETS_COLLECTION = 'api_token_budgets'
+# Chat formatting around a single user message: role, separators and reply priming.
+MESSAGE_OVERHEAD_TOKENS = 7
+CLIENT_KEY_CHARS = 64
+
+_ttl_index_ready = False
+
+
+class BudgetExceeded(Exception):
+    """``retry_after`` is the seconds until the window resets, or None if the request can never fit."""
+
+    def __init__(self, message, scope, retry_after=None):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+        if metrics.enabled():
+            metrics.TOKEN_BUDGET_REJECTIONS.inc(scope=scope)
+
+
+@lru_cache(maxsize=64)
+def _encoding(model_name):
+    # Cached per model, so each fallback is logged once per process.
+    if tiktoken is None:
+        logger.warning('tiktoken is not installed; estimating token counts for %s', model_name)
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name.rsplit('/', 1)[-1])
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        # Offline without cached BPE files.
+        logger.warning('No tiktoken encoding for %s (%s); estimating token counts', model_name, e)
+        return None
+
+
+def count_tokens(text, model_name='gpt-3.5-turbo'):
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def prompt_tokens(prompt, model_name='gpt-3.5-turbo'):
+    return count_tokens(prompt, model_name) + MESSAGE_OVERHEAD_TOKENS
+
+
+def request_tokens(data):
+    """Most tokens one validated generate request can spend."""
+    return 2 * prompt_tokens(data['prompt'], data['model_name']) + data['max_tokens_a'] + data['max_tokens_b']
+
+
+def usage_document(usage):
+    if usage is None:
+        return None
+    return {
+        'prompt_tokens': usage.prompt_tokens or 0,
+        'completion_tokens': usage.completion_tokens or 0,
+        'total_tokens': usage.total_tokens or 0,
+    }
+
+
+def estimated_usage(prompt, content, model_name):
+    """Usage counted locally, for streamed completions that report none."""
+    prompt_count, completion_count = prompt_tokens(prompt, model_name), count_tokens(content, model_name)
+    return {
+        'prompt_tokens': prompt_count,
+        'completion_tokens': completion_count,
+        'total_tokens': prompt_count + completion_count,
+        'estimated': True,
+    }
+
+
+def spent_tokens(usage):
+    """Total tokens in a ``{'a': ..., 'b': ...}`` usage pair; cache hits have None."""
+    return sum((side or {}).get('total_tokens', 0) for side in usage.values())
+
+
+def client_key(request):
+    key = ''
+    if settings.TOKEN_CLIENT_HEADER:
+        key = request.META.get('HTTP_' + settings.TOKEN_CLIENT_HEADER.upper().replace('-', '_'), '')
+    return (key or request.META.get('REMOTE_ADDR') or 'unknown')[:CLIENT_KEY_CHARS]
+
+
+def _get_collection():
+    global _ttl_index_ready
+    collection = get_collection(BUDGETS_COLLECTION)
+    if not _ttl_index_ready:
+        collection.create_index('expires_at', expireAfterSeconds=0)
+        _ttl_index_ready = True
+    return collection
+
+
+def _buckets(client):
+    buckets = []
+    if settings.TOKEN_BUDGET_PER_CLIENT:
+        buckets.append((f'client:{client}', settings.TOKEN_BUDGET_PER_CLIENT))
+    if settings.TOKEN_BUDGET_GLOBAL:
+        buckets.append(('global', settings.TOKEN_BUDGET_GLOBAL))
+    return buckets
+
+
+def admit(client, tokens):
+    """Reserve ``tokens`` against every budget or raise BudgetExceeded.
+
+    Returns the reservation to pass to settle(), or None with budgets off.
+    """
+    buckets = _buckets(client)
+    if not buckets:
+        return None
+    for name, limit in buckets:
+        if tokens > limit:
+            scope = name.split(':')[0]
+            raise BudgetExceeded(f'Request needs up to {tokens} tokens; the {scope} budget is {limit} '
+                                 f'per {settings.TOKEN_BUDGET_WINDOW} seconds.', scope)
+
+    collection = _get_collection()
+    now = time.time()
+    window = int(now // settings.TOKEN_BUDGET_WINDOW)
+    expires_at = datetime.fromtimestamp((window + 2) * settings.TOKEN_BUDGET_WINDOW, tz.utc)
+    keys = []
+    for name, limit in buckets:
+        key = f'{name}:{window}'
+        try:
+            collection.update_one(
+                {'_id': key, 'tokens': {'$lte': limit - tokens}},
+                {'$inc': {'tokens': tokens}, '$setOnInsert': {'expires_at': expires_at}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # All-or-nothing: give back what the earlier buckets took.
+            if keys:
+                collection.update_many({'_id': {'$in': keys}}, {'$inc': {'tokens': -tokens}})
+            scope = name.split(':')[0]
+            raise BudgetExceeded(f'The {scope} token budget is used up for this window.', scope,
+                                 retry_after=(window + 1) * settings.TOKEN_BUDGET_WINDOW - now)
+        keys.append(key)
+    return {'keys': keys, 'tokens': tokens}
+
+
+def settle(reservation, spent):
+    """Replace a reservation with the ``spent`` tokens (0 when nothing was generated)."""
+    if not reservation or spent == reservation['tokens']:
+        return
+    _get_collection().update_many(
+        {'_id': {'$in': reservation['keys']}}, {'$inc': {'tokens': spent - reservation['tokens']}}
+    )
@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import PromptViewSet
 
 router = DefaultRouter()
@@ -8,3 +10,23 @@ router.register(r'prompts', PromptViewSet, basename='prompt')
 urlpatterns = [
     path('', include(router.urls)),
 ]
+
+# Under ASGI the hot endpoints are served by async views so a worker is not
+# blocked on OpenAI or MongoDB I/O. The other busy viewset actions run in the
+# thread pool rather than on Django's single thread for sync views; the rest
+# (CRUD, health) stays there.
+if settings.ASYNC_VIEWS:
+    urlpatterns = [
+        path('prompts/generate/', async_views.generate),
+        path('prompts/generate-stream/', async_views.generate_stream),
+        path('prompts/<str:pk>/job/', async_views.job),
+        path('prompts/stats/', async_views.stats),
+        path('prompts/export-training-data/', async_views.export_training_data),
+        path('prompts/export-training-data-jsonl/', async_views.export_training_data_jsonl),
+        path('prompts/generate-batch/', async_views.in_thread(PromptViewSet.as_view({'post': 'generate_batch'}))),
+        path('prompts/next-pair/', async_views.in_thread(PromptViewSet.as_view({'post': 'next_pair'}))),
+        path('prompts/record-preferences/',
+             async_views.in_thread(PromptViewSet.as_view({'post': 'record_preferences'}))),
+        path('prompts/<str:pk>/record-preference/',
+             async_views.in_thread(PromptViewSet.as_view({'post': 'record_preference'}))),
+    ] + urlpatterns
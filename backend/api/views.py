@@ -2,47 +2,248 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.conf import settings
 from bson import ObjectId
-from .models import Prompt
+from . import dedup, metrics, streaming
+from .annotation import lease_next_pair, pair_payload
+from .analytics import get_analytics, parse_analytics_params
 from .serializers import (
     PromptSerializer,
+    PromptSummarySerializer,
     GenerateResponsesSerializer,
+    GenerateBatchSerializer,
     RecordPreferenceSerializer,
+    BulkRecordPreferenceSerializer,
     TrainingDataSerializer,
 )
-from .llm_service import generate_two_responses
-import pymongo
+from .cache import get_completion_cache
+from .export import find_training_documents, parse_dedup_param, parse_export_params, training_pair
+from .jobs import build_job_document, job_payload, parse_wait, wait_for_job
+from .llm_service import (
+    describe_llm_error,
+    generate_response_batch,
+    generate_two_responses,
+    stream_two_responses,
+)
+from .mongo import get_collection, get_read_collection, health
+from .pagination import encode_cursor, parse_list_params
+from .ratelimit import RateLimited
+from .repository import (
+    PROMPT_DEFAULTS,
+    build_prompt_document,
+    delete_prompt,
+    get_prompt,
+    insert_prompt,
+    insert_prompts,
+    list_prompt_page,
+    update_prompt,
+)
+from .stats import (
+    build_stats,
+    count_preference_change,
+    count_preference_changes,
+    count_prompt_deleted,
+    count_prompts_created,
+    read_counts,
+)
+from .tokens import (
+    BudgetExceeded,
+    admit,
+    client_key,
+    request_tokens,
+    settle,
+    spent_tokens,
+)
+import json
+import math
+import time
+from pymongo import ReturnDocument, UpdateOne
 
-_mongo_client = None
 
 def _get_collection():
-    global _mongo_client
-    if _mongo_client is None:
-        _mongo_client = pymongo.MongoClient(settings.MONGODB_URI)
-    return _mongo_client[settings.MONGODB_NAME]['api_prompt']
+    return get_collection()
+
+
+def _retry_later(error):
+    response = Response({'error': str(error)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if error.retry_after is not None:
+        response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+def _record_votes(collection, votes, now):
+    """Write ``{object_id: preference}`` votes; return the preference each one replaced.
+
+    Ids that are not found are left out. bulk_write only reports totals, so
+    each update applies only over the preference read just before it: a vote
+    recorded concurrently makes it miss instead of being replaced unseen. The
+    missed ones (not stamped with ``now``) are then written one at a time with
+    find_one_and_update, like record-preference does.
+    """
+    def update(preference):
+        return {'$set': {'preference': preference, 'preference_recorded_at': now, 'updated_at': now}}
+
+    current = {
+        doc['_id']: doc.get('preference')
+        for doc in collection.find({'_id': {'$in': list(votes)}}, {'preference': 1})
+    }
+    if not current:
+        return {}
+    result = collection.bulk_write([
+        UpdateOne({'_id': object_id, 'preference': previous}, update(votes[object_id]))
+        for object_id, previous in current.items()
+    ], ordered=False)
+    if result.matched_count == len(current):
+        return current
+
+    written = {
+        doc['_id']
+        for doc in collection.find({'_id': {'$in': list(current)}, 'preference_recorded_at': now}, {'_id': 1})
+    }
+    replaced = {object_id: current[object_id] for object_id in written}
+    for object_id in current.keys() - written:
+        previous = collection.find_one_and_update(
+            {'_id': object_id}, update(votes[object_id]),
+            projection={'preference': 1}, return_document=ReturnDocument.BEFORE
+        )
+        if previous is not None:
+            replaced[object_id] = previous.get('preference')
+    return replaced
+
+
+def mongo_health(request):
+    ok, details = health()
+    return JsonResponse({'status': 'ok' if ok else 'error', 'mongo': details}, status=200 if ok else 503)
+
 
+def prometheus_metrics(request):
+    if not metrics.enabled():
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-class PromptViewSet(viewsets.ModelViewSet):
-    queryset = Prompt.objects.all()
-    serializer_class = PromptSerializer
+
+LIST_SERIALIZERS = {'full': PromptSerializer, 'summary': PromptSummarySerializer}
+LIST_FIELDS = {view: list(serializer._declared_fields) for view, serializer in LIST_SERIALIZERS.items()}
+
+
+def _parse_object_id(pk):
+    try:
+        return ObjectId(pk) if isinstance(pk, str) else pk
+    except Exception:
+        raise NotFound(f'Invalid ObjectId format: {pk}')
+
+
+class PromptViewSet(viewsets.ViewSet):
     lookup_field = 'pk'
 
-    def get_object(self):
-        pk = self.kwargs.get('pk')
+    def dispatch(self, request, *args, **kwargs):
+        if not metrics.enabled():
+            return super().dispatch(request, *args, **kwargs)
+        started = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        labels = {
+            'action': getattr(self, 'action', None) or 'unknown',
+            'method': request.method,
+            'status': response.status_code,
+        }
+        metrics.API_VIEW_SECONDS.observe(time.perf_counter() - started, stage='handler', **labels)
+        # Render here rather than in Django's handler so serialization is timed too.
+        if isinstance(response, Response):
+            with metrics.timed(metrics.API_VIEW_SECONDS, stage='render', **labels):
+                response.render()
+        return response
+
+    def list(self, request):
         try:
-            if isinstance(pk, str):
-                pk = ObjectId(pk)
-            return Prompt.objects.get(_id=pk)
-        except (Prompt.DoesNotExist, Exception) as e:
-            raise NotFound(str(e))
+            cursor, limit, view, fields = parse_list_params(request.query_params, LIST_FIELDS)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer_class = LIST_SERIALIZERS[view]
+        sources = getattr(serializer_class, 'SOURCE_FIELDS', {})
+        projection = {sources.get(name, name): 1 for name in fields or LIST_FIELDS[view]}
+        documents = list_prompt_page(projection, cursor, limit)
+        next_cursor = encode_cursor(documents[-1]) if len(documents) == limit else None
+        next_url = None
+        if next_cursor:
+            params = request.query_params.copy()
+            params['cursor'] = next_cursor
+            next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+        return Response({
+            'results': serializer_class(documents, many=True, fields=fields).data,
+            'next_cursor': next_cursor,
+            'next': next_url,
+        })
+
+    def retrieve(self, request, pk=None):
+        document = get_prompt(_parse_object_id(pk))
+        if document is None:
+            raise NotFound(f'Prompt not found with id: {pk}')
+        return Response(PromptSerializer(document).data)
+
+    def create(self, request):
+        serializer = PromptSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        document = insert_prompt({
+            '_id': ObjectId(),
+            **PROMPT_DEFAULTS,
+            **serializer.validated_data,
+            'created_at': now,
+            'updated_at': now
+        })
+        count_prompts_created()
+        count_preference_change(None, document.get('preference'))
+        return Response(PromptSerializer(document).data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, pk=None, partial=False):
+        object_id = _parse_object_id(pk)
+        serializer = PromptSerializer(data=request.data, partial=partial)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = serializer.validated_data
+        previous = update_prompt(object_id, fields)
+        if previous is None:
+            raise NotFound(f'Prompt not found with id: {pk}')
+        if 'preference' in fields:
+            count_preference_change(previous.get('preference'), fields['preference'])
+        return Response(PromptSerializer(get_prompt(object_id)).data)
+
+    def partial_update(self, request, pk=None):
+        return self.update(request, pk, partial=True)
+
+    def destroy(self, request, pk=None):
+        document = delete_prompt(_parse_object_id(pk))
+        if document is None:
+            raise NotFound(f'Prompt not found with id: {pk}')
+        count_prompt_deleted(document.get('preference'))
+        return Response(status=status.HTTP_204_NO_CONTENT)
     
     @action(detail=False, methods=['post'], url_path='generate')
     def generate(self, request):
         serializer = GenerateResponsesSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        duplicate, reusable = dedup.check_generate_request(_get_collection(), serializer.validated_data)
+        if reusable is not None:
+            return Response(dedup.reused_payload(reusable))
+        extra = {'duplicate_of': dedup.duplicate_payload(duplicate)} if duplicate else {}
+
+        try:
+            reservation = admit(client_key(request), request_tokens(serializer.validated_data))
+        except BudgetExceeded as e:
+            return _retry_later(e)
+
+        if settings.GENERATION_JOBS_ENABLED:
+            document = insert_prompt(build_job_document(serializer.validated_data, timezone.now(), reservation))
+            count_prompts_created()
+            return Response({**job_payload(document), **extra}, status=status.HTTP_202_ACCEPTED)
         
         prompt_text = serializer.validated_data['prompt']
         model_name = serializer.validated_data.get('model_name', 'gpt-3.5-turbo')
@@ -60,7 +261,7 @@ class PromptViewSet(viewsets.ModelViewSet):
         presence_penalty_b = serializer.validated_data.get('presence_penalty_b', 0.0)
         
         try:
-            response_a, response_b = generate_two_responses(
+            response_a, response_b, timing = generate_two_responses(
                 prompt_text,
                 model_name=model_name,
                 temperature_a=temperature_a,
@@ -72,54 +273,29 @@ class PromptViewSet(viewsets.ModelViewSet):
                 max_tokens_b=max_tokens_b,
                 top_p_b=top_p_b,
                 frequency_penalty_b=frequency_penalty_b,
-                presence_penalty_b=presence_penalty_b
+                presence_penalty_b=presence_penalty_b,
+                bypass_cache=serializer.validated_data['bypass_cache']
             )
+        except RateLimited as e:
+            settle(reservation, 0)
+            return _retry_later(e)
         except ValueError as e:
+            settle(reservation, 0)
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         except Exception as e:
-            error_msg = str(e)
-            if 'authentication' in error_msg.lower() or 'api key' in error_msg.lower() or 'unauthorized' in error_msg.lower():
-                error_response = 'Invalid API key.'
-            elif 'quota' in error_msg.lower() or 'billing' in error_msg.lower():
-                error_response = 'OpenAI quota exceeded.'
-            elif 'rate limit' in error_msg.lower():
-                error_response = 'Rate limit exceeded. Try again in a moment.'
-            elif 'model' in error_msg.lower():
-                error_response = f'{model_name} may not be available.'
-            else:
-                error_response = error_msg[:100]
+            settle(reservation, 0)
+            error_response = describe_llm_error(str(e), model_name)
             return Response({'error': error_response}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        usage = timing.pop('usage')
+        settle(reservation, spent_tokens(usage))
 
         now = timezone.now()
-        collection = _get_collection()
-        object_id = ObjectId()
-        collection.insert_one({
-            '_id': object_id,
-            'prompt_text': prompt_text,
-            'response_a': response_a,
-            'response_b': response_b,
-            'model_name': model_name,
-            'temperature': (temperature_a + temperature_b) / 2,
-            'temperature_a': temperature_a,
-            'max_tokens_a': max_tokens_a,
-            'top_p_a': top_p_a,
-            'frequency_penalty_a': frequency_penalty_a,
-            'presence_penalty_a': presence_penalty_a,
-            'temperature_b': temperature_b,
-            'max_tokens_b': max_tokens_b,
-            'top_p_b': top_p_b,
-            'frequency_penalty_b': frequency_penalty_b,
-            'presence_penalty_b': presence_penalty_b,
-            'response_a_generated_at': now,
-            'response_b_generated_at': now,
-            'preference': None,
-            'preference_recorded_at': None,
-            'created_at': now,
-            'updated_at': now
-        })
+        document = insert_prompt(build_prompt_document(serializer.validated_data, response_a, response_b, now, usage))
+        count_prompts_created()
+        object_id = document['_id']
         
         return Response({
             'id': str(object_id),
@@ -130,9 +306,179 @@ class PromptViewSet(viewsets.ModelViewSet):
             'temperature': (temperature_a + temperature_b) / 2,
             'temperature_a': temperature_a,
             'temperature_b': temperature_b,
-            'created_at': now.isoformat()
+            'created_at': now.isoformat(),
+            'timing': timing,
+            'usage': usage,
+            **extra
         }, status=status.HTTP_201_CREATED)
     
+    @action(detail=True, methods=['get'], url_path='job')
+    def job(self, request, pk=None):
+        object_id = _parse_object_id(pk)
+        try:
+            wait = parse_wait(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        document = wait_for_job(_get_collection(), object_id, wait) if wait else get_prompt(object_id)
+        if document is None:
+            raise NotFound(f'Prompt not found with id: {pk}')
+        return Response(job_payload(document))
+
+    @action(detail=False, methods=['post'], url_path='next-pair')
+    def next_pair(self, request):
+        document = lease_next_pair(_get_collection(), annotator=request.data.get('annotator'))
+        if document is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(pair_payload(document))
+
+    @action(detail=False, methods=['post'], url_path='generate-stream')
+    def generate_stream(self, request):
+        serializer = GenerateResponsesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        duplicate, reusable = dedup.check_generate_request(_get_collection(), data)
+        if reusable is not None:
+            return streaming.response(iter([streaming.reused(reusable)]))
+        extra = {'duplicate_of': dedup.duplicate_payload(duplicate)} if duplicate else {}
+
+        try:
+            reservation = admit(client_key(request), request_tokens(data))
+        except BudgetExceeded as e:
+            return _retry_later(e)
+
+        def event_stream():
+            finished = {}
+            streamed = {'a': [], 'b': []}
+            try:
+                try:
+                    for kind, side, payload in stream_two_responses(
+                        data['prompt'],
+                        model_name=data['model_name'],
+                        temperature_a=data['temperature_a'],
+                        max_tokens_a=data['max_tokens_a'],
+                        top_p_a=data['top_p_a'],
+                        frequency_penalty_a=data['frequency_penalty_a'],
+                        presence_penalty_a=data['presence_penalty_a'],
+                        temperature_b=data['temperature_b'],
+                        max_tokens_b=data['max_tokens_b'],
+                        top_p_b=data['top_p_b'],
+                        frequency_penalty_b=data['frequency_penalty_b'],
+                        presence_penalty_b=data['presence_penalty_b'],
+                        bypass_cache=data['bypass_cache']
+                    ):
+                        if kind == 'delta':
+                            streamed[side].append(payload)
+                        else:
+                            finished[side] = payload
+                        yield streaming.event(kind, side, payload)
+                except Exception as e:
+                    yield streaming.sse('error', {'error': describe_llm_error(str(e), data['model_name'])})
+                    return
+                usage = {side: finished[side]['usage'] for side in ('a', 'b')}
+
+                now = timezone.now()
+                document = build_prompt_document(
+                    data, finished['a']['content'], finished['b']['content'], now, usage
+                )
+                insert_prompt(document)
+                count_prompts_created()
+                yield streaming.done(data, document, now, usage, extra)
+            finally:
+                # Also runs when the client disconnects (GeneratorExit).
+                settle(reservation, spent_tokens(streaming.spent_usage(data, finished, streamed)))
+
+        return streaming.response(event_stream())
+
+    @action(detail=False, methods=['post'], url_path='generate-batch')
+    def generate_batch(self, request):
+        serializer = GenerateBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        items = serializer.validated_data['items']
+        # Same reuse/flag check as generate, per item: reused items are answered
+        # from the stored pair and neither generated nor charged.
+        entries = []
+        pending = []
+        extras = {}
+        collection = _get_collection()
+        for index, item in enumerate(items):
+            duplicate, reusable = dedup.check_generate_request(collection, item)
+            if reusable is not None:
+                entries.append({'index': index, 'status': 'ok', **dedup.reused_payload(reusable)})
+                continue
+            pending.append(index)
+            if duplicate:
+                extras[index] = {'duplicate_of': dedup.duplicate_payload(duplicate)}
+
+        # The rest of the batch is admitted or refused at once.
+        tokens = [request_tokens(items[index]) for index in pending]
+        try:
+            reservation = admit(client_key(request), sum(tokens))
+        except BudgetExceeded as e:
+            return _retry_later(e)
+
+        now = timezone.now()
+        if settings.GENERATION_JOBS_ENABLED:
+            # Each job carries its share of the reservation and settles it when it finishes.
+            documents = insert_prompts([
+                build_job_document(items[index], now, reservation and dict(reservation, tokens=item_tokens))
+                for index, item_tokens in zip(pending, tokens)
+            ])
+            count_prompts_created(len(documents))
+            entries.extend(
+                {'index': index, **job_payload(document), **extras.get(index, {})}
+                for index, document in zip(pending, documents)
+            )
+            entries.sort(key=lambda entry: entry['index'])
+            return Response({'count': len(entries), 'results': entries}, status=status.HTTP_202_ACCEPTED)
+
+        succeeded = len(entries)
+        spent = 0
+        try:
+            # Store each pair as soon as it finishes, so nothing already paid for
+            # is lost if the request dies before the batch is done.
+            for position, result in generate_response_batch([items[index] for index in pending]):
+                index = pending[position]
+                item = items[index]
+                if isinstance(result, Exception):
+                    entry = {
+                        'index': index,
+                        'status': 'error',
+                        'error': describe_llm_error(str(result), item['model_name'])
+                    }
+                    if isinstance(result, RateLimited):
+                        entry['retry_after'] = math.ceil(result.retry_after)
+                    entries.append(entry)
+                    continue
+                response_a, response_b, timing = result
+                usage = timing.pop('usage')
+                spent += spent_tokens(usage)
+                document = insert_prompt(build_prompt_document(item, response_a, response_b, timezone.now(), usage))
+                count_prompts_created()
+                succeeded += 1
+                entries.append({
+                    'index': index,
+                    'status': 'ok',
+                    'id': str(document['_id']),
+                    'timing': timing,
+                    'usage': usage,
+                    **extras.get(index, {})
+                })
+        finally:
+            settle(reservation, spent)
+
+        entries.sort(key=lambda entry: entry['index'])
+        return Response({
+            'count': len(entries),
+            'succeeded': succeeded,
+            'failed': len(entries) - succeeded,
+            'results': entries,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], url_path='record-preference')
     def record_preference(self, request, pk=None):
         serializer = RecordPreferenceSerializer(data=request.data)
@@ -143,24 +489,23 @@ class PromptViewSet(viewsets.ModelViewSet):
         preference = serializer.validated_data['preference']
         now = timezone.now()
 
-        try:
-            object_id = ObjectId(pk) if isinstance(pk, str) else pk
-        except Exception:
-            raise NotFound(f'Invalid ObjectId format: {pk}')
-        
+        object_id = _parse_object_id(pk)
         collection = _get_collection()
         
-        result = collection.update_one(
+        previous = collection.find_one_and_update(
             {'_id': object_id},
             {'$set': {
                 'preference': preference,
                 'preference_recorded_at': now,
                 'updated_at': now
-            }}
+            }},
+            projection={'preference': 1},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             raise NotFound(f'Prompt not found with id: {pk}')
+        count_preference_change(previous.get('preference'), preference)
         
         return Response({
             'id': str(object_id),
@@ -168,43 +513,91 @@ class PromptViewSet(viewsets.ModelViewSet):
             'preference_recorded_at': now.isoformat()
         })
     
+    @action(detail=False, methods=['post'], url_path='record-preferences')
+    def record_preferences(self, request):
+        serializer = BulkRecordPreferenceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        # BSON dates keep milliseconds only; _record_votes looks its writes up by this stamp.
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        votes = {}
+        results = []
+        for item in serializer.validated_data['items']:
+            try:
+                object_id = ObjectId(item['id'])
+            except Exception:
+                results.append({'id': item['id'], 'error': f"Invalid ObjectId format: {item['id']}"})
+                continue
+            # An id listed twice gets one result, for its last vote.
+            if object_id not in votes:
+                results.append({'id': str(object_id)})
+            votes[object_id] = item['preference']
+
+        replaced = _record_votes(_get_collection(), votes, now) if votes else {}
+        for entry in results:
+            if 'error' in entry:
+                continue
+            object_id = ObjectId(entry['id'])
+            entry['preference'] = votes[object_id]
+            entry['matched'] = object_id in replaced
+            entry['modified'] = entry['matched'] and replaced[object_id] != votes[object_id]
+            if entry['matched']:
+                entry['preference_recorded_at'] = now.isoformat()
+            else:
+                entry['error'] = f'Prompt not found with id: {object_id}'
+        count_preference_changes([(replaced[object_id], votes[object_id]) for object_id in replaced])
+
+        return Response({
+            'matched_count': len(replaced),
+            'modified_count': sum(1 for entry in results if entry.get('modified')),
+            'results': results,
+        })
+
     @action(detail=False, methods=['get'], url_path='export-training-data')
     def export_training_data(self, request):
-        collection = _get_collection()
-        docs = collection.find({'preference': {'$in': ['A', 'B']}})
-        training_data = []
-        for doc in docs:
-            chosen = doc['response_a'] if doc['preference'] == 'A' else doc['response_b']
-            rejected = doc['response_b'] if doc['preference'] == 'A' else doc['response_a']
-            training_data.append({
-                'prompt': doc['prompt_text'],
-                'chosen': chosen,
-                'rejected': rejected,
-                'metadata': {
-                    'model': doc.get('model_name'),
-                    'temperature': doc.get('temperature'),
-                    'temperature_a': doc.get('temperature_a'),
-                    'temperature_b': doc.get('temperature_b'),
-                    'created_at': doc['created_at'].isoformat() if doc.get('created_at') else None,
-                    'preference_recorded_at': doc['preference_recorded_at'].isoformat() if doc.get('preference_recorded_at') else None,
-                }
-            })
+        try:
+            dedup_action = parse_dedup_param(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        docs = find_training_documents(get_read_collection(), batch_size=settings.EXPORT_BATCH_SIZE, dedup=dedup_action)
+        training_data = [training_pair(doc) for doc in docs]
         return Response({'count': len(training_data), 'data': training_data})
 
+    @action(detail=False, methods=['get'], url_path='export-training-data-jsonl')
+    def export_training_data_jsonl(self, request):
+        try:
+            after, limit = parse_export_params(request.query_params)
+            dedup_action = parse_dedup_param(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        docs = find_training_documents(
+            get_read_collection(), after=after, limit=limit, batch_size=settings.EXPORT_BATCH_SIZE, dedup=dedup_action
+        )
+
+        def lines():
+            # The id lets clients resume an interrupted export with ?after=<id>.
+            for doc in docs:
+                yield json.dumps({'id': str(doc['_id']), **training_pair(doc)}) + '\n'
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="training-data.jsonl"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        try:
+            model_name, buckets, resamples = parse_analytics_params(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_analytics(get_read_collection(), model_name, buckets, resamples))
+
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        collection = _get_collection()
-        total = collection.count_documents({})
-        preference_a = collection.count_documents({'preference': 'A'})
-        preference_b = collection.count_documents({'preference': 'B'})
-        ties = collection.count_documents({'preference': 'TIE'})
-        with_preference = preference_a + preference_b + ties
-        return Response({
-            'total_prompts': total,
-            'with_preference': with_preference,
-            'without_preference': total - with_preference,
-            'preference_a': preference_a,
-            'preference_b': preference_b,
-            'ties': ties,
-            'training_pairs': preference_a + preference_b,
-        })
+        data = build_stats(read_counts(get_read_collection()))
+        cache = get_completion_cache()
+        if cache is not None:
+            data['completion_cache'] = cache.stats()
+        return Response(data)
@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -32,6 +33,11 @@ INSTALLED_APPS = [
     'api',
 ]
 
+# Route generate, generate-stream, job, stats and export to async views (set by
+# start.py in ASGI mode); generate-batch, next-pair and record-preference(s)
+# then run in a thread pool, other sync views one at a time per worker.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -44,6 +50,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# WhiteNoise's middleware is sync-only and would funnel every ASGI request
+# through one thread; backend/asgi.py serves static files in that mode.
+if ASYNC_VIEWS:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -66,17 +77,49 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 MONGODB_URI = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/')
 MONGODB_NAME = os.environ.get('MONGODB_NAME', 'prompt_selector')
+# One MongoClient per worker process (api.mongo), shared with djongo. Timeouts
+# in milliseconds; 0 leaves max idle time and wait-queue timeout unlimited.
+# MONGODB_WRITE_CONCERN is a w value ('majority', '1', ...; empty for the
+# server default). MONGODB_COMPRESSORS lists wire compressors in preference
+# order, e.g. 'zstd,snappy,zlib' (zstd needs zstandard, snappy python-snappy).
+# MONGODB_ANALYTICS_READ_PREFERENCE applies to stats, analytics and export
+# reads, e.g. 'secondaryPreferred' on a replica set; writes stay on the primary.
+MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', '100'))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get('MONGODB_MAX_IDLE_TIME_MS', '0'))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', '10000'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', '10000'))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', '0'))
+MONGODB_RETRY_WRITES = os.environ.get('MONGODB_RETRY_WRITES', 'True') == 'True'
+MONGODB_WRITE_CONCERN = os.environ.get('MONGODB_WRITE_CONCERN', '')
+MONGODB_WRITE_TIMEOUT_MS = int(os.environ.get('MONGODB_WRITE_TIMEOUT_MS', '0'))
+MONGODB_COMPRESSORS = os.environ.get('MONGODB_COMPRESSORS', '')
+MONGODB_ANALYTICS_READ_PREFERENCE = os.environ.get('MONGODB_ANALYTICS_READ_PREFERENCE', 'primary')
+# Create missing api_prompt indexes at startup (or run `python manage.py ensure_indexes`)
+MONGODB_ENSURE_INDEXES = os.environ.get('MONGODB_ENSURE_INDEXES', 'False') == 'True'
+
+# The API reads and writes api_prompt through pymongo (api.repository); djongo
+# only backs Django's own apps and the Prompt admin, through api.djongo_backend
+# so it shares the API's client. With USE_DJONGO=False those use SQLite
+# instead and djongo never opens a connection.
+USE_DJONGO = os.environ.get('USE_DJONGO', 'True') == 'True'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'djongo',
-        'NAME': MONGODB_NAME,
-        'ENFORCE_SCHEMA': False,
-        'CLIENT': {
-            'host': MONGODB_URI,
+if USE_DJONGO:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'api.djongo_backend',
+            'NAME': MONGODB_NAME,
+            'ENFORCE_SCHEMA': False,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', os.path.join(BASE_DIR, 'db.sqlite3')),
         }
     }
-}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -155,3 +198,121 @@ LOGGING = {
 }
 
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+
+# Shared OpenAI client pool (one keep-alive pool per API key and base URL, per worker)
+OPENAI_POOL_SIZE = int(os.environ.get('OPENAI_POOL_SIZE', '20'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', '30'))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '30'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '2'))
+# Async workers keep many generations in flight, so their pool is larger
+OPENAI_ASYNC_POOL_SIZE = int(os.environ.get('OPENAI_ASYNC_POOL_SIZE', '400'))
+
+# LLM backends routed by model_name prefix (see api.backends), as a JSON list:
+# [{"prefix": "local/", "kind": "openai-compatible", "base_url": "http://vllm:8000/v1",
+#   "pool_size": 64, "concurrency": 32}, {"prefix": "fake/", "kind": "fake"}]
+# Models without a matching prefix go to OpenAI, limited to OPENAI_CONCURRENCY
+# in-flight calls per worker (0 = unlimited).
+LLM_BACKENDS = json.loads(os.environ.get('LLM_BACKENDS') or '[]')
+OPENAI_CONCURRENCY = int(os.environ.get('OPENAI_CONCURRENCY', '0'))
+
+# Budget for the default OpenAI backend shared by all workers through the
+# api_rate_limits collection (0 = off). With a budget set, rate-limit, 5xx and
+# connection errors are retried with jittered backoff, honoring retry-after.
+# A call waits at most LLM_RATE_LIMIT_MAX_WAIT seconds for budget; past that the
+# request gets 429 with Retry-After (keep it well under the worker timeout).
+OPENAI_REQUESTS_PER_MINUTE = int(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', '0'))
+OPENAI_TOKENS_PER_MINUTE = int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', '0'))
+LLM_RATE_LIMIT_MAX_WAIT = float(os.environ.get('LLM_RATE_LIMIT_MAX_WAIT', '5'))
+LLM_RETRY_ATTEMPTS = int(os.environ.get('LLM_RETRY_ATTEMPTS', '4'))
+LLM_RETRY_BASE_DELAY = float(os.environ.get('LLM_RETRY_BASE_DELAY', '0.5'))
+LLM_RETRY_MAX_DELAY = float(os.environ.get('LLM_RETRY_MAX_DELAY', '30'))
+
+# Send both sides of a pair at once; each pair uses two threads from the pool
+LLM_CONCURRENT_PAIRS = os.environ.get('LLM_CONCURRENT_PAIRS', 'True') == 'True'
+LLM_PAIR_WORKERS = int(os.environ.get('LLM_PAIR_WORKERS', '8'))
+
+# Token budgets checked before any completion is requested (see api.tokens).
+# A generate request reserves its prompt twice plus both max_tokens, in
+# tokens per TOKEN_BUDGET_WINDOW seconds, against its client's budget and the
+# global one (0 = off); over-budget requests get 429 with Retry-After. Clients
+# are told apart by the TOKEN_CLIENT_HEADER header, else by REMOTE_ADDR;
+# clients choose the header, so TOKEN_BUDGET_GLOBAL is the hard cap. Prompts
+# over PROMPT_MAX_TOKENS (0 = unlimited) are rejected with 400.
+TOKEN_BUDGET_PER_CLIENT = int(os.environ.get('TOKEN_BUDGET_PER_CLIENT', '0'))
+TOKEN_BUDGET_GLOBAL = int(os.environ.get('TOKEN_BUDGET_GLOBAL', '0'))
+TOKEN_BUDGET_WINDOW = int(os.environ.get('TOKEN_BUDGET_WINDOW', '3600'))
+TOKEN_CLIENT_HEADER = os.environ.get('TOKEN_CLIENT_HEADER', 'X-Client-Id')
+PROMPT_MAX_TOKENS = int(os.environ.get('PROMPT_MAX_TOKENS', '4000'))
+
+# Bulk generation (/api/prompts/generate-batch/). Without job mode the batch
+# runs inside the request, so LLM_BATCH_MAX_ITEMS is kept small enough to
+# finish within gunicorn's 30s worker timeout; with GENERATION_JOBS_ENABLED
+# the batch is queued and returns 202, and the limit can be raised.
+# LLM_BATCH_TOKENS_PER_MINUTE is a per-worker budget; an item that would wait
+# longer than LLM_RATE_LIMIT_MAX_WAIT for it fails with its retry_after.
+LLM_BATCH_MAX_ITEMS = int(os.environ.get('LLM_BATCH_MAX_ITEMS', '20'))
+LLM_BATCH_CONCURRENCY = int(os.environ.get('LLM_BATCH_CONCURRENCY', '16'))
+LLM_BATCH_TOKENS_PER_MINUTE = int(os.environ.get('LLM_BATCH_TOKENS_PER_MINUTE', '90000'))
+
+# Bulk preference recording (/api/prompts/record-preferences/)
+BULK_PREFERENCE_MAX_ITEMS = int(os.environ.get('BULK_PREFERENCE_MAX_ITEMS', '1000'))
+
+# Documents fetched per cursor batch by the streaming JSONL export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+
+# Serve /stats from an api_counters document kept current with $inc
+# (rebuild with `python manage.py reconcile_stats`)
+STATS_COUNTERS_ENABLED = os.environ.get('STATS_COUNTERS_ENABLED', 'False') == 'True'
+
+# Opt-in completion cache keyed by prompt, model and sampling parameters
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'False') == 'True'
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '1024'))
+LLM_CACHE_MONGO = os.environ.get('LLM_CACHE_MONGO', 'True') == 'True'
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', '86400'))
+
+# Prometheus-format timings and counters at /metrics (per worker process)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+
+# Generation job mode: generate returns 202 with a pending document that
+# `python manage.py run_generation_workers` fills in; clients poll
+# /api/prompts/{id}/job/?wait=<seconds>
+GENERATION_JOBS_ENABLED = os.environ.get('GENERATION_JOBS_ENABLED', 'False') == 'True'
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '5'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1.0'))
+# Kept under gunicorn's 30s worker timeout
+JOB_WAIT_MAX_SECONDS = float(os.environ.get('JOB_WAIT_MAX_SECONDS', '20'))
+
+# Compact api_prompt layout for new documents (see api.storage): prompt text
+# stored once in api_prompt_texts, responses of COMPRESS_MIN_BYTES or more
+# compressed, sampling params packed. The API reads both layouts; the Django
+# admin only understands the flat one. Convert existing documents with
+# `python manage.py compact_storage` (--expand to go back).
+COMPACT_STORAGE_ENABLED = os.environ.get('COMPACT_STORAGE_ENABLED', 'False') == 'True'
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+# Prompt deduplication (see api.dedup): 'off', 'warn' (generate responses name
+# the closest earlier prompt in duplicate_of) or 'reuse' (a finished pair with
+# the same normalized prompt, model and parameters is returned instead of
+# generating). Fingerprints are stored while not 'off'; add them to older
+# documents with `python manage.py backfill_dedup`.
+DEDUP_MODE = os.environ.get('DEDUP_MODE', 'off')
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.8'))
+DEDUP_MAX_CANDIDATES = int(os.environ.get('DEDUP_MAX_CANDIDATES', '50'))
+
+# Annotation queue: POST /api/prompts/next-pair/ leases a pre-generated pair
+# for ANNOTATION_LEASE_SECONDS; `python manage.py fill_annotation_queue <file>`
+# keeps ANNOTATION_QUEUE_TARGET unvoted pairs buffered
+ANNOTATION_LEASE_SECONDS = int(os.environ.get('ANNOTATION_LEASE_SECONDS', '600'))
+ANNOTATION_QUEUE_TARGET = int(os.environ.get('ANNOTATION_QUEUE_TARGET', '100'))
+
+# Page size of GET /api/prompts/ (?limit= up to the max); the summary view
+# truncates prompt_text to PROMPT_SUMMARY_CHARS characters
+PROMPT_LIST_PAGE_SIZE = int(os.environ.get('PROMPT_LIST_PAGE_SIZE', '50'))
+PROMPT_LIST_MAX_PAGE_SIZE = int(os.environ.get('PROMPT_LIST_MAX_PAGE_SIZE', '500'))
+PROMPT_SUMMARY_CHARS = int(os.environ.get('PROMPT_SUMMARY_CHARS', '200'))
+
+# Upper bound for ?resamples= on /api/prompts/analytics/ (bootstrap draws per bucket)
+ANALYTICS_MAX_RESAMPLES = int(os.environ.get('ANALYTICS_MAX_RESAMPLES', '10000'))
@@ -3,10 +3,13 @@ from django.urls import path, include
 from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
+from api.views import mongo_health, prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', prometheus_metrics),
+    path('health', mongo_health),
     path('', TemplateView.as_view(template_name='index.html'), name='home'),
 ]
 
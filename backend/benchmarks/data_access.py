@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Compare the djongo ORM path with the pymongo repository for Prompt reads.
+
+Run from backend/ against a local MongoDB (documents are seeded into a scratch
+database that is dropped afterwards):
+
+    python benchmarks/data_access.py --docs 2000 --repeat 20 > data_access.json
+
+Reports worker boot time with and without djongo configured, plus list and
+retrieve latency for both data-access paths, as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT_SNIPPET = """
+import time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+import backend.urls
+print(time.perf_counter() - started)
+"""
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'p50_ms': round(statistics.median(samples) * 1000, 2),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+        'min_ms': round(samples[0] * 1000, 2),
+    }
+
+
+def measure_boot(use_djongo, repeat):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='backend.settings', USE_DJONGO=str(use_djongo))
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', BOOT_SNIPPET], cwd=BACKEND_DIR, env=env)
+        samples.append(float(output.decode().strip().splitlines()[-1]))
+    return summarize(samples)
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def seed(collection, count):
+    from bson import ObjectId
+    from django.utils import timezone
+    now = timezone.now()
+    collection.insert_many([{
+        '_id': ObjectId(),
+        'prompt_text': f'Benchmark prompt {i} ' + 'lorem ipsum ' * 20,
+        'response_a': 'Response A ' + 'dolor sit amet ' * 150,
+        'response_b': 'Response B ' + 'consectetur adipiscing ' * 150,
+        'model_name': 'gpt-3.5-turbo',
+        'temperature': 0.8,
+        'temperature_a': 0.7, 'max_tokens_a': 500, 'top_p_a': 1.0,
+        'frequency_penalty_a': 0.0, 'presence_penalty_a': 0.0,
+        'temperature_b': 0.9, 'max_tokens_b': 500, 'top_p_b': 1.0,
+        'frequency_penalty_b': 0.0, 'presence_penalty_b': 0.0,
+        'response_a_generated_at': now, 'response_b_generated_at': now,
+        'preference': 'A' if i % 2 else None,
+        'preference_recorded_at': now if i % 2 else None,
+        'created_at': now, 'updated_at': now,
+    } for i in range(count)])
+
+
+def measure_reads(docs, repeat):
+    os.environ['USE_DJONGO'] = 'True'
+    os.environ['MONGODB_NAME'] = os.environ.get('BENCH_MONGODB_NAME', 'prompt_selector_bench')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    sys.path.insert(0, BACKEND_DIR)
+    import django
+    django.setup()
+
+    from rest_framework import serializers
+    from api.models import Prompt
+    from api.mongo import get_collection, get_database
+    from api.repository import get_prompt, list_prompts
+    from api.serializers import PromptSerializer
+
+    class DjongoPromptSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Prompt
+            fields = '__all__'
+
+    collection = get_collection()
+    collection.drop()
+    seed(collection, docs)
+    object_id = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])['_id']
+
+    try:
+        return {
+            'djongo': {
+                'list': timed(lambda: DjongoPromptSerializer(Prompt.objects.all(), many=True).data, repeat),
+                'retrieve': timed(lambda: DjongoPromptSerializer(Prompt.objects.get(_id=object_id)).data, repeat),
+            },
+            'pymongo': {
+                'list': timed(lambda: PromptSerializer(list_prompts(), many=True).data, repeat),
+                'retrieve': timed(lambda: PromptSerializer(get_prompt(object_id)).data, repeat),
+            },
+        }
+    finally:
+        get_database().client.drop_database(os.environ['MONGODB_NAME'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--boot-repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    report = {
+        'docs': args.docs,
+        'boot': {
+            'djongo': measure_boot(True, args.boot_repeat),
+            'pymongo_only': measure_boot(False, args.boot_repeat),
+        },
+        'reads': measure_reads(args.docs, args.repeat),
+    }
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Fire concurrent ``generate`` requests at a running server backed by the stub LLM.
+
+Starts ``StubLLM`` in this process, then posts ``--requests`` generations with at
+most ``--concurrency`` in flight. Point the server at the stub first:
+
+    SERVER_MODE=asgi OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub python start.py
+    python benchmarks/load_generate.py --url http://127.0.0.1:8000 --requests 400 --concurrency 400
+
+Prints elapsed time, request latency percentiles and the number of completions
+the stub saw in flight at once (two per generation), as JSON.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from stub_llm import StubLLM
+
+
+def percentile(samples, fraction):
+    return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 2)
+
+
+async def run(args):
+    stub = StubLLM(args.latency, args.tokens_per_second, args.max_tokens)
+    server, _ = await stub.serve('127.0.0.1', args.stub_port)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = {}
+
+    async def one(client, index):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(
+                    f'{args.url.rstrip("/")}/api/prompts/generate/',
+                    json={'prompt': f'load test prompt {index}', 'model_name': args.model},
+                )
+                status = response.status_code
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            if status == 201:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with server, httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, index) for index in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'stub_latency_s': args.latency,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'ok': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50) if latencies else None,
+        'p95_ms': percentile(latencies, 0.95) if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) if latencies else None,
+        'stub_requests': stub.requests,
+        'stub_peak_in_flight': stub.peak_in_flight,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--stub-port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0)
+    parser.add_argument('--max-tokens', type=int, default=64)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
+
+
+if __name__ == '__main__':
+    main()
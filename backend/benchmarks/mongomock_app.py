@@ -0,0 +1,19 @@
+"""WSGI/ASGI entry points backed by an in-memory mongomock database.
+
+Used by ``benchmarks/run.py --mongo mongomock`` when no mongod is available.
+Every worker process gets its own database, so serve it with one worker.
+"""
+import os
+import sys
+
+import mongomock
+import pymongo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+pymongo.MongoClient = mongomock.MongoClient
+
+if os.environ.get('ASYNC_VIEWS') == 'True':
+    from backend.asgi import application
+else:
+    from backend.wsgi import application
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""Latency and throughput benchmark for the prompts API against a stub LLM.
+
+Starts ``stub_llm.py`` and the app under gunicorn (sync workers, or uvicorn
+workers with ``--server asgi``), then drives ``generate``, ``record-preference``,
+``stats`` and ``export-training-data`` in turn at ``--concurrency``. Run from
+backend/:
+
+    python benchmarks/run.py --mongo mongomock --requests 200 --concurrency 20 > bench.json
+    python benchmarks/run.py --server asgi --workers 4 --baseline bench.json
+
+``--llm fake`` swaps the stub server for the in-process fake backend
+(api.backends.FakeBackend) to measure the app without any LLM HTTP traffic.
+``--mongo uri`` uses MONGODB_URI with a scratch MONGODB_NAME that is dropped
+afterwards; ``--mongo mongomock`` (``pip install mongomock``) serves one worker
+with an in-memory database.
+Prints p50/p95/p99 latency and requests per second per endpoint plus the RSS of
+each worker as JSON. With ``--baseline`` it exits non-zero when an endpoint's
+p95 or throughput is more than ``--tolerance`` worse than the baseline run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(BACKEND_DIR, 'benchmarks')
+PHASES = ('generate', 'record-preference', 'stats', 'export-training-data')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args[0]} exited with {process.returncode}')
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} not ready after {timeout}s')
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as children:
+            return [int(pid) for pid in children.read().split()]
+    except OSError:
+        return []
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2)
+
+    return {
+        'ok': len(latencies),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+async def drive(client, requests, concurrency, make_request):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = {}
+    results = []
+
+    async def one(index):
+        async with semaphore:
+            method, path, body = make_request(index)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                outcome = response.status_code
+            except httpx.HTTPError as exc:
+                outcome = type(exc).__name__
+            if outcome in (200, 201):
+                latencies.append(time.perf_counter() - started)
+                if method == 'POST' and outcome == 201:
+                    results.append(response.json().get('id'))
+            else:
+                errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - started), results
+
+
+async def run_phases(base_url, args, sample_memory):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    report = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        report['generate'], ids = await drive(
+            client, args.requests, args.concurrency,
+            lambda i: ('POST', '/api/prompts/generate/', {
+                'prompt': f'benchmark prompt {i}', 'model_name': args.model,
+            }),
+        )
+        sample_memory()
+        ids = ids or ['000000000000000000000000']
+        report['record-preference'], _ = await drive(
+            client, args.requests, args.concurrency,
+            lambda i: ('POST', f'/api/prompts/{ids[i % len(ids)]}/record-preference/', {
+                'preference': random.choice(['A', 'B', 'TIE']),
+            }),
+        )
+        sample_memory()
+        report['stats'], _ = await drive(
+            client, args.requests, args.concurrency,
+            lambda i: ('GET', '/api/prompts/stats/', None),
+        )
+        sample_memory()
+        report['export-training-data'], _ = await drive(
+            client, max(1, args.requests // 10), min(args.concurrency, 4),
+            lambda i: ('GET', '/api/prompts/export-training-data/', None),
+        )
+        sample_memory()
+    return report
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for phase in PHASES:
+        current, previous = report['endpoints'].get(phase), baseline.get('endpoints', {}).get(phase)
+        if not current or not previous:
+            continue
+        if current['p95_ms'] and previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{phase}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if (current['requests_per_second'] or 0) < (previous['requests_per_second'] or 0) * (1 - tolerance):
+            regressions.append(
+                f"{phase}: {previous['requests_per_second']} -> {current['requests_per_second']} req/s"
+            )
+        if sum(current['errors'].values()) > sum(previous['errors'].values()):
+            regressions.append(f"{phase}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mongo', choices=['uri', 'mongomock'], default='uri')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--llm', choices=['stub', 'fake'], default='stub',
+                        help='stub: HTTP stub server; fake: in-process fake backend (no HTTP to the LLM).')
+    parser.add_argument('--latency', type=float, default=0.5, help='LLM seconds to first token.')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0)
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--baseline', help='Earlier report to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--output', help='Write the report here instead of stdout.')
+    parser.add_argument('--server-log', default=os.devnull, help='Where the app server logs go.')
+    args = parser.parse_args()
+
+    workers = 1 if args.mongo == 'mongomock' else args.workers
+    stub_port, app_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='stub',
+        OPENAI_BASE_URL=f'http://127.0.0.1:{stub_port}/v1',
+        ASYNC_VIEWS=str(args.server == 'asgi'),
+    )
+    if args.llm == 'fake':
+        env['LLM_BACKENDS'] = json.dumps([{'prefix': '', 'kind': 'fake', 'latency': args.latency}])
+    if args.mongo == 'mongomock':
+        env['USE_DJONGO'] = 'False'
+        app = 'mongomock_app:application'
+    else:
+        env['MONGODB_NAME'] = f"{env.get('MONGODB_NAME', 'prompt_selector')}_bench_{os.getpid()}"
+        app = f"backend.{args.server}:application"
+
+    command = [
+        'gunicorn', app,
+        '--chdir', BACKEND_DIR,
+        '--pythonpath', BENCH_DIR,
+        '--bind', f'127.0.0.1:{app_port}',
+        '--workers', str(workers),
+        '--log-level', 'warning',
+    ]
+    if args.server == 'asgi':
+        command += ['--worker-class', 'uvicorn.workers.UvicornWorker']
+
+    stub = None
+    if args.llm == 'stub':
+        stub = subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, 'stub_llm.py'),
+            '--port', str(stub_port),
+            '--latency', str(args.latency),
+            '--tokens-per-second', str(args.tokens_per_second),
+            '--max-tokens', str(args.max_tokens),
+        ], stdout=subprocess.DEVNULL)
+    server_log = open(args.server_log, 'a')
+    server = subprocess.Popen(command, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    memory = {}
+
+    def sample_memory():
+        for pid in worker_pids(server.pid):
+            current = rss_mb(pid)
+            if current is not None:
+                memory[pid] = max(memory.get(pid, 0), current)
+
+    try:
+        base_url = f'http://127.0.0.1:{app_port}'
+        wait_until_ready(f'{base_url}/api/prompts/stats/', server)
+        sample_memory()
+        boot_memory = dict(memory)
+        endpoints = asyncio.run(run_phases(base_url, args, sample_memory))
+    finally:
+        server.terminate()
+        server.wait()
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+        server_log.close()
+        if args.mongo == 'uri':
+            subprocess.run([
+                sys.executable, '-c',
+                'import pymongo, os; pymongo.MongoClient(os.environ.get("MONGODB_URI", '
+                '"mongodb://localhost:27017/")).drop_database(os.environ["MONGODB_NAME"])',
+            ], env=env, timeout=30, check=False)
+
+    report = {
+        'config': {
+            'server': args.server,
+            'workers': workers,
+            'mongo': args.mongo,
+            'llm': args.llm,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'llm_latency_s': args.latency,
+            'llm_tokens_per_second': args.tokens_per_second,
+        },
+        'endpoints': endpoints,
+        'memory_mb': {
+            'boot_per_worker': sorted(boot_memory.values()),
+            'peak_per_worker': sorted(memory.values()),
+        },
+    }
+    if args.baseline:
+        with open(args.baseline) as handle:
+            report['regressions'] = compare(report, json.load(handle), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Minimal OpenAI-compatible chat completions server for load tests.
+
+Serves POST /v1/chat/completions (plain and ``stream: true``) on asyncio, so a
+single process can hold thousands of slow requests open. Each completion waits
+``--latency`` seconds, then produces ``max_tokens`` (capped by ``--max-tokens``)
+words at ``--tokens-per-second``.
+
+    python benchmarks/stub_llm.py --port 8099 --latency 0.5 --tokens-per-second 200
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub python manage.py runserver
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+class StubLLM:
+    def __init__(self, latency=0.5, tokens_per_second=0.0, max_tokens=64):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _words(self, body):
+        count = min(int(body.get('max_tokens') or self.max_tokens), self.max_tokens)
+        seed = f"t={body.get('temperature')}"
+        return [seed] + [f'token{i}' for i in range(count - 1)]
+
+    async def _respond(self, writer, status, payload):
+        data = json.dumps(payload).encode()
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(data)}\r\n\r\n'.encode() + data
+        )
+        await writer.drain()
+
+    async def _complete(self, writer, body):
+        words = self._words(body)
+        await asyncio.sleep(self.latency)
+        usage = {
+            'prompt_tokens': sum(len(m.get('content', '').split()) for m in body.get('messages', [])),
+            'completion_tokens': len(words),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        if not body.get('stream'):
+            if self.tokens_per_second:
+                await asyncio.sleep(len(words) / self.tokens_per_second)
+            await self._respond(writer, '200 OK', {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ' '.join(words)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            })
+            return
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n')
+        for index, word in enumerate(words):
+            chunk = {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body.get('model'),
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': word if index == 0 else ' ' + word},
+                    'finish_reason': None,
+                }],
+            }
+            event = f'data: {json.dumps(chunk)}\n\n'.encode()
+            writer.write(f'{len(event):x}\r\n'.encode() + event + b'\r\n')
+            await writer.drain()
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+        done = b'data: [DONE]\n\n'
+        writer.write(f'{len(done):x}\r\n'.encode() + done + b'\r\n0\r\n\r\n')
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method, path = request_line.decode('latin-1').split()[:2]
+                if method != 'POST' or not path.endswith('/chat/completions'):
+                    await self._respond(writer, '404 Not Found', {'error': {'message': f'No route for {path}'}})
+                    continue
+
+                self.requests += 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                try:
+                    await self._complete(writer, json.loads(body or b'{}'))
+                finally:
+                    self.in_flight -= 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=0):
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096)
+        return server, server.sockets[0].getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds before the first token.')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='0 returns all tokens at once.')
+    parser.add_argument('--max-tokens', type=int, default=64, help='Upper bound on tokens per completion.')
+    args = parser.parse_args()
+
+    stub = StubLLM(args.latency, args.tokens_per_second, args.max_tokens)
+
+    async def run():
+        server, port = await stub.serve(args.host, args.port)
+        print(f'Stub LLM listening on http://{args.host}:{port}/v1', flush=True)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -23,9 +23,34 @@ const api = {
       frequency_penalty_b: options.frequencyPenaltyB !== undefined ? options.frequencyPenaltyB : 0.0,
       presence_penalty_b: options.presencePenaltyB !== undefined ? options.presencePenaltyB : 0.0
     });
+    if (response.status === 202) {
+      return this.waitForGeneration(response.data.id);
+    }
     return response.data;
   },
 
+  // Job mode: generate returns 202 with a pending id; long-poll until done.
+  async waitForGeneration(promptId) {
+    for (;;) {
+      const response = await axios.get(`${API_BASE_URL}/prompts/${promptId}/job/`, {
+        params: { wait: 20 }
+      });
+      if (response.data.status === 'done') {
+        return response.data;
+      }
+      if (response.data.status === 'failed') {
+        throw new Error(response.data.error || 'Generation failed');
+      }
+    }
+  },
+
+  // Annotation queue: a pre-generated pair leased to this annotator, or null
+  // when the queue is empty. Vote on it with recordPreference.
+  async getNextPair(annotator) {
+    const response = await axios.post(`${API_BASE_URL}/prompts/next-pair/`, { annotator });
+    return response.status === 204 ? null : response.data;
+  },
+
   async recordPreference(promptId, preference) {
     const response = await axios.post(
       `${API_BASE_URL}/prompts/${promptId}/record-preference/`,
@@ -44,9 +69,24 @@ const api = {
     return response.data;
   },
 
-  async getAllPrompts() {
-    const response = await axios.get(`${API_BASE_URL}/prompts/`);
+  // One page, newest first: { results, next_cursor, next }. Pass
+  // view: 'summary' for history rows and fields: 'a,b' to trim either view.
+  async getPrompts({ cursor, limit, view, fields } = {}) {
+    const response = await axios.get(`${API_BASE_URL}/prompts/`, {
+      params: { cursor, limit, view, fields }
+    });
     return response.data;
+  },
+
+  async getAllPrompts(options = {}) {
+    const prompts = [];
+    let cursor;
+    do {
+      const page = await this.getPrompts({ ...options, cursor });
+      prompts.push(...page.results);
+      cursor = page.next_cursor;
+    } while (cursor);
+    return prompts;
   }
 };
 
@@ -6,13 +6,41 @@ import sys
 # Get port from environment variable or use default
 port = os.environ.get('PORT', '8000')
 
-# Start gunicorn with the determined port
-cmd = [
-    'gunicorn',
-    'backend.wsgi:application',
-    '--bind', f'0.0.0.0:{port}',
-    '--workers', '4'
-]
+# SERVER_MODE=asgi serves the async generate/stats/export views under uvicorn
+# workers, so each worker can hold many OpenAI calls in flight.
+server_mode = os.environ.get('SERVER_MODE', 'wsgi')
 
-print(f"Starting server on port {port}...")
-sys.exit(subprocess.call(cmd))
+if server_mode == 'asgi':
+    os.environ['ASYNC_VIEWS'] = 'True'
+    cmd = [
+        'gunicorn',
+        'backend.asgi:application',
+        '--bind', f'0.0.0.0:{port}',
+        '--workers', '4',
+        '--worker-class', 'uvicorn.workers.UvicornWorker'
+    ]
+else:
+    # Start gunicorn with the determined port
+    cmd = [
+        'gunicorn',
+        'backend.wsgi:application',
+        '--bind', f'0.0.0.0:{port}',
+        '--workers', '4'
+    ]
+
+# In generation job mode the pending prompts are filled in by a worker pool
+# running next to the web server.
+workers = None
+if os.environ.get('GENERATION_JOBS_ENABLED') == 'True':
+    workers = subprocess.Popen([
+        sys.executable, 'manage.py', 'run_generation_workers',
+        '--workers', os.environ.get('GENERATION_WORKERS', '4')
+    ])
+
+print(f"Starting {server_mode} server on port {port}...")
+try:
+    sys.exit(subprocess.call(cmd))
+finally:
+    if workers is not None:
+        workers.terminate()
+        workers.wait()